@@ -0,0 +1,103 @@
+# benchmarks/engine_bench.py
+# Segmented download engine vs. a single connection (and yt-dlp's default
+# downloader when yt-dlp is installed), against a local HTTP server that
+# throttles every connection like a CDN does per stream.
+#
+#   python -m benchmarks.engine_bench [--size-mb 64] [--rate-mb 8] [--connections 1,4,8] [--json]
+import os, sys, time, json, hashlib, argparse, tempfile, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from functions.engine import segmented_download, ConnectionPool
+
+def make_server(payload, rate):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, so pooled connections get reused
+
+        def do_GET(self):
+            start, end = 0, len(payload) - 1
+            rng = self.headers.get("Range")
+            if rng and rng.startswith("bytes="):
+                a, _, b = rng[6:].partition("-")
+                start, end = int(a), min(int(b) if b else end, end)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            # per-connection throttle: chunk, then sleep to hold `rate` bytes/s
+            chunk = 64 * 1024
+            pos = start
+            t0 = time.monotonic()
+            while pos <= end:
+                n = min(chunk, end - pos + 1)
+                self.wfile.write(payload[pos:pos + n])
+                pos += n
+                ahead = (pos - start) / rate - (time.monotonic() - t0)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_segmented(url, dest, connections, segment_size):
+    pool = ConnectionPool()
+    t0 = time.monotonic()
+    segmented_download(url, dest, connections=connections, segment_size=segment_size, pool=pool)
+    return time.monotonic() - t0, pool.stats()
+
+def run_ytdlp(url, dest):
+    from yt_dlp import YoutubeDL
+    with YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
+        t0 = time.monotonic()
+        ydl.dl(dest, {"url": url, "protocol": "http", "http_headers": {}, "ext": "bin", "id": "bench"})
+        return time.monotonic() - t0, {}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size-mb", type=int, default=64)
+    ap.add_argument("--rate-mb", type=float, default=8.0, help="per-connection throttle, MB/s")
+    ap.add_argument("--connections", default="1,4,8")
+    ap.add_argument("--segment-mb", type=int, default=4)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+    digest = hashlib.sha256(payload).hexdigest()
+    server = make_server(payload, args.rate_mb * 1024 * 1024)
+    url = f"http://127.0.0.1:{server.server_address[1]}/video.bin"
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [(f"segmented x{n}", lambda d, n=n: run_segmented(url, d, n, args.segment_mb * 1024 * 1024))
+                for n in (int(c) for c in args.connections.split(","))]
+        try:
+            import yt_dlp  # noqa: F401
+            runs.insert(0, ("yt-dlp default", lambda d: run_ytdlp(url, d)))
+        except ImportError:
+            pass
+        for name, fn in runs:
+            dest = os.path.join(tmp, name.replace(" ", "_"))
+            seconds, pool = fn(dest)
+            with open(dest, "rb") as f:
+                ok = hashlib.sha256(f.read()).hexdigest() == digest
+            results.append({"engine": name, "seconds": round(seconds, 3),
+                            "mb_s": round(args.size_mb / seconds, 2), "verified": ok, "pool": pool})
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps({"size_mb": args.size_mb, "rate_mb_per_conn": args.rate_mb, "results": results}, indent=2))
+        return
+    print(f"{args.size_mb} MB, server throttled to {args.rate_mb} MB/s per connection")
+    for r in results:
+        extra = f"  connections opened {r['pool']['opened']}, reused {r['pool']['reused']}" if r["pool"] else ""
+        print(f"{r['engine']:<16} {r['seconds']:>8.2f}s {r['mb_s']:>8.2f} MB/s  {'ok' if r['verified'] else 'CORRUPT'}{extra}")
+
+if __name__ == "__main__":
+    main()
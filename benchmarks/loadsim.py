@@ -0,0 +1,608 @@
+# benchmarks/loadsim.py
+# End-to-end load simulation: drives the real handlers in bot.py (handle_text,
+# callbacks, rename_handler) with thousands of simulated users clicking through
+# link -> video/audio -> quality -> download (-> rename reply), and reports
+# latency percentiles per step, throughput, memory and event-loop lag.
+#
+# Only Telegram, YouTube and ffmpeg are stand-ins; the scheduler, single-flight,
+# caches, sessions, storage backend and yt-dlp worker pool are the bot's own:
+# - FakeClient replaces pyrogram's Client (bot.app and the UploadPool sessions).
+#   Every call costs --api-latency (+-50%), uploads add size / --upload-speed,
+#   and --flood-rate of calls get a FloodWait of --flood-wait seconds: slept
+#   inside the call up to --sleep-threshold (as pyrogram does), raised above it.
+#   Edits that change nothing raise MessageNotModified, like Telegram.
+# - fake_extract / fake_download replace yt-dlp in download.py: recorded info
+#   dicts (--info, e.g. `yt-dlp -J` dumps) or synthetic ones, and sparse files
+#   "downloaded" at --bandwidth MB/s per connection with progress hooks at
+#   --hook-rate per second.
+# - FakeFFmpeg keeps FFmpegPool's limits and accounting but only sleeps.
+# --time-scale multiplies every simulated duration (0.1 = ten times faster;
+# FloodWait values stay in whole seconds). Bot settings (MAX_CONCURRENT_DOWNLOADS,
+# YTDLP_WORKERS, ...) come from the usual environment variables; every file
+# the run writes lives in a temporary directory.
+#
+#   python -m benchmarks.loadsim [--users 2000] [--ramp 60] [--flows 1] [--videos 100] [--premium-share 0.2]
+#                                [--audio-share 0.3] [--time-scale 1] [--api-latency 0.05] [--flood-rate 0]
+#                                [--mongo-uri mongodb://localhost:27017] [--json] [--out results.json]
+#                                [--compare previous.json [--threshold 0.15]]
+import os, sys, copy, glob, json, time, random, shutil, asyncio, argparse, itertools, platform, multiprocessing
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.suite import prepare_env, synthetic_info, result, compare, git_rev
+
+MB = 1024 * 1024
+MEDIA = ("send_video", "send_audio", "send_document", "send_cached_media")
+
+# ------------ yt-dlp stand-ins ------------
+# Module-level and configured through LOADSIM_* variables, so yt-dlp worker
+# processes (YTDLP_WORKERS > 0) can import and run them too.
+def _knob(name, default):
+    return float(os.environ.get("LOADSIM_" + name, default))
+
+def _scaled(seconds):
+    return seconds * _knob("TIME_SCALE", 1)
+
+_RECORDED = None
+
+def _recorded():
+    global _RECORDED
+    if _RECORDED is None:
+        files = []
+        for p in filter(None, os.environ.get("LOADSIM_INFO", "").split(os.pathsep)):
+            files += sorted(glob.glob(os.path.join(p, "*.json"))) if os.path.isdir(p) else [p]
+        _RECORDED = []
+        for path in files:
+            with open(path, "r", encoding="utf-8") as f:
+                _RECORDED.append(json.load(f))
+    return _RECORDED
+
+# the same video id always gets the same info dict
+def sim_info(video_id):
+    rnd = random.Random(video_id)
+    recorded = _recorded()
+    if recorded:
+        info = copy.deepcopy(recorded[rnd.randrange(len(recorded))])
+        info.update(id=video_id, webpage_url=f"https://youtu.be/{video_id}")
+        return info
+    return synthetic_info(int(_knob("FORMATS", 120)), video_id, video_id, rnd.choice((60, 240, 600, 1200, 3600)))
+
+# pure-Python work that holds the GIL, as yt-dlp's extractors do
+def _burn(seconds):
+    end = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < end:
+        n += 1
+    return n
+
+def fake_extract(url, on_progress=None, is_cancelled=None):
+    from functions.utils import extract_video_id
+    vid = extract_video_id(url)
+    if vid is None:
+        raise ValueError(f"Unsupported URL: {url}")
+    _burn(_scaled(_knob("EXTRACT_CPU", 0.05)))
+    time.sleep(_scaled(_knob("EXTRACT_TIME", 0.8)) * random.uniform(0.5, 1.5))
+    return sim_info(vid)
+
+# same signature and result as download.download_blocking
+def fake_download(url, format_id, is_audio, info=None, workdir=None, connections=1,
+                  on_progress=None, is_cancelled=None):
+    from yt_dlp.utils import DownloadError
+    from download import make_progress_hook, DOWNLOAD_DIR
+    from functions.planner import estimate_size
+    from functions.utils import extract_video_id, human_size
+    info = info or sim_info(extract_video_id(url))
+    by_id = {f.get("format_id"): f for f in info.get("formats") or []}
+    picked = [by_id[x] for x in format_id.split("+") if x in by_id]
+    if not picked:
+        raise DownloadError(f"Requested format is not available: {format_id}")
+    size = sum(estimate_size(f, info.get("duration") or 0) or MB for f in picked)
+    exts = {f.get("ext") or "mp4" for f in picked}
+    ext = exts.pop() if len(exts) == 1 else "mkv"
+    name = os.path.join(workdir or DOWNLOAD_DIR, f"{info.get('title')} [{info.get('id')}-{format_id}].{ext}")
+    tmp = name + ".part"
+    hook = make_progress_hook(on_progress, is_cancelled)
+    rate = _knob("BANDWIDTH", 100) * MB * max(1, connections) / _knob("TIME_SCALE", 1)
+    interval = 1 / _knob("HOOK_RATE", 50)
+    started = time.monotonic()
+    open(tmp, "wb").close()
+    done = 0
+    while done < size:
+        time.sleep(interval)
+        done = min(size, int((time.monotonic() - started) * rate))
+        os.truncate(tmp, done)      # sparse: the size grows, the disk doesn't fill
+        hook({"status": "downloading", "downloaded_bytes": done, "total_bytes": size, "tmpfilename": tmp, "filename": name,
+              "eta": int((size - done) / rate), "_percent_str": f"{done * 100 / size:5.1f}%", "_speed_str": f"{human_size(rate)}/s"})
+    os.replace(tmp, name)
+    hook({"status": "finished", "downloaded_bytes": size, "total_bytes": size, "filename": name})
+    return {"filepath": name, "title": info.get("title"), "filesize": size, "acodec": picked[-1].get("acodec"),
+            "timings": {"download": time.monotonic() - started, "postprocess": 0.0}}
+
+def _fake_ffmpeg_class():
+    from functions.ffmpeg import FFmpegPool
+
+    # FFmpegPool's concurrency limit and counters; the conversion itself is a sleep
+    class FakeFFmpeg(FFmpegPool):
+        def __init__(self, workers, transcode_speed, remux_speed):
+            super().__init__(workers)
+            self.transcode_speed = transcode_speed    # source MB/s
+            self.remux_speed = remux_speed
+
+        async def _exec(self, args):
+            src, dst = args[args.index("-i") + 1], args[-1]
+            size = os.path.getsize(src)
+            speed = self.transcode_speed if "libmp3lame" in args else self.remux_speed
+            await asyncio.sleep(_scaled(size / (speed * MB)))
+            with open(dst, "wb") as f:
+                f.truncate(size)
+    return FakeFFmpeg
+
+# ------------ Telegram stand-ins ------------
+class FakeMessage:
+    def __init__(self, client, chat_id, msg_id, text=None, reply_markup=None, from_user=None):
+        self._client = client
+        self.id = msg_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = from_user
+        self.text = text
+        self.reply_markup = reply_markup
+        self.audio = self.video = self.document = None
+        self.empty = False
+
+    async def reply_text(self, text, quote=None, reply_markup=None, **kw):
+        return await self._client.send_message(self.chat.id, text, reply_markup=reply_markup)
+
+    async def reply_photo(self, photo, caption=None, reply_markup=None, **kw):
+        return await self._client.send_photo(self.chat.id, photo, caption=caption, reply_markup=reply_markup)
+
+    async def edit_text(self, text, reply_markup=None, **kw):
+        return await self._client.edit_message_text(self.chat.id, self.id, text, reply_markup=reply_markup)
+
+    async def delete(self):
+        return await self._client.delete_messages(self.chat.id, self.id)
+
+    def stop_propagation(self):
+        from pyrogram import StopPropagation
+        raise StopPropagation
+
+class FakeCallbackQuery:
+    def __init__(self, client, user, message, data):
+        self._client = client
+        self.from_user = user
+        self.message = message
+        self.data = data
+        self.answers = []           # (text, show_alert)
+
+    async def answer(self, text=None, show_alert=None, url=None, **kw):
+        await self._client._call("answer_callback_query")
+        self.answers.append((text, bool(show_alert)))
+
+    def alert(self):
+        return next((t for t, alert in self.answers if alert), None)
+
+# What bot.py calls on pyrogram's Client. Messages are kept per chat (dropped
+# with forget); a chat with an inbox gets every send/edit as (method, message).
+class FakeClient:
+    def __init__(self, latency=0.05, upload_speed=20.0, flood_rate=0.0, flood_wait=3, sleep_threshold=10, seed=0):
+        self.latency = latency
+        self.upload_speed = upload_speed
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.sleep_threshold = sleep_threshold
+        self.rnd = random.Random(seed)
+        self.calls = Counter()
+        self.floods = Counter()
+        self.flood_slept = 0
+        self.uploaded = 0
+        self.chats = {}             # chat_id -> {msg_id: FakeMessage}
+        self.inboxes = {}           # chat_id -> asyncio.Queue
+        self._ids = itertools.count(1)
+
+    # another session of the same bot (UploadPool's extra clients): shared chats and log
+    def session(self):
+        return copy.copy(self)
+
+    async def start(self):
+        return self
+
+    async def stop(self):
+        pass
+
+    async def _call(self, method, upload=0):
+        from pyrogram.errors import FloodWait
+        self.calls[method] += 1
+        delay = self.latency * self.rnd.uniform(0.5, 1.5) + upload / (self.upload_speed * MB)
+        if self.flood_rate and self.rnd.random() < self.flood_rate:
+            self.floods[method] += 1
+            if self.flood_wait > self.sleep_threshold:
+                await asyncio.sleep(_scaled(self.latency))
+                raise FloodWait(value=self.flood_wait)
+            # pyrogram sleeps short FloodWaits inside the call and retries
+            self.flood_slept += self.flood_wait
+            delay += self.flood_wait
+        await asyncio.sleep(_scaled(delay))
+
+    def _post(self, chat_id, method, text=None, reply_markup=None, media=None, kind=None):
+        msg = FakeMessage(self, chat_id, next(self._ids), text, reply_markup)
+        if media is not None:
+            setattr(msg, kind, media)
+        self.chats.setdefault(chat_id, {})[msg.id] = msg
+        self._notify(chat_id, method, msg)
+        return msg
+
+    def _notify(self, chat_id, method, msg):
+        q = self.inboxes.get(chat_id)
+        if q is not None:
+            q.put_nowait((method, msg))
+
+    # ---- updates from simulated users ----
+    def incoming(self, user_id, text):
+        return FakeMessage(self, user_id, next(self._ids), text, from_user=SimpleNamespace(id=user_id))
+
+    def callback(self, user_id, message, data):
+        return FakeCallbackQuery(self, SimpleNamespace(id=user_id), message, data)
+
+    def forget(self, chat_id):
+        self.chats.pop(chat_id, None)
+        self.inboxes.pop(chat_id, None)
+
+    # ---- Client methods bot.py uses ----
+    async def send_message(self, chat_id, text, reply_markup=None, **kw):
+        await self._call("send_message")
+        return self._post(chat_id, "send_message", text, reply_markup)
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kw):
+        await self._call("send_photo")
+        return self._post(chat_id, "send_photo", caption, reply_markup)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kw):
+        from pyrogram.errors import MessageIdInvalid, MessageNotModified
+        await self._call("edit_message_text")
+        msg = self.chats.get(chat_id, {}).get(message_id)
+        if msg is None:
+            raise MessageIdInvalid()
+        if msg.text == text and msg.reply_markup is reply_markup:
+            raise MessageNotModified()
+        msg.text, msg.reply_markup = text, reply_markup
+        self._notify(chat_id, "edit_message_text", msg)
+        return msg
+
+    async def delete_messages(self, chat_id, message_ids, **kw):
+        await self._call("delete_messages")
+        for mid in message_ids if isinstance(message_ids, (list, tuple)) else (message_ids,):
+            self.chats.get(chat_id, {}).pop(mid, None)
+        return True
+
+    async def _send_file(self, method, chat_id, f, caption, kind):
+        # FileParts know their length; the bytes themselves are never read
+        size = f.length if hasattr(f, "length") else os.path.getsize(f)
+        await self._call(method, upload=size)
+        self.uploaded += size
+        return self._post(chat_id, method, caption, media=SimpleNamespace(file_id=f"file{next(self._ids)}", file_size=size), kind=kind)
+
+    async def send_video(self, chat_id, video, caption=None, **kw):
+        return await self._send_file("send_video", chat_id, video, caption, "video")
+
+    async def send_audio(self, chat_id, audio, caption=None, **kw):
+        return await self._send_file("send_audio", chat_id, audio, caption, "audio")
+
+    async def send_document(self, chat_id, document, caption=None, **kw):
+        return await self._send_file("send_document", chat_id, document, caption, "document")
+
+    async def send_cached_media(self, chat_id, file_id, caption=None, **kw):
+        await self._call("send_cached_media")
+        return self._post(chat_id, "send_cached_media", caption, media=SimpleNamespace(file_id=file_id, file_size=0), kind="document")
+
+    async def get_messages(self, chat_id, message_ids, **kw):
+        await self._call("get_messages")
+        return self.chats.get(chat_id, {}).get(message_ids) or SimpleNamespace(empty=True)
+
+# ------------ simulated users ------------
+def _buttons(msg, prefix):
+    rows = getattr(msg.reply_markup, "inline_keyboard", None) or []
+    return [b.callback_data for row in rows for b in row if (b.callback_data or "").startswith(prefix)]
+
+def _drain(inbox):
+    events = []
+    while not inbox.empty():
+        events.append(inbox.get_nowait())
+    return events
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def _rss(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+class Simulation:
+    def __init__(self, args, bot, client):
+        import script as S
+        self.args = args
+        self.bot = bot
+        self.client = client
+        self.rnd = random.Random(args.seed)
+        self.videos = [f"sim{i:08d}" for i in range(args.videos)]
+        self.weights = [1 / (i + 1) ** args.zipf for i in range(args.videos)]
+        # like pyrogram's dispatcher: one handler per group, in group order (rename_handler is group -1)
+        self.text_handlers = (bot.rename_handler, bot.handle_text)
+        self.callback_handlers = (bot.callbacks,)
+        self.rename_prompt = S.RENAME_PROMPT
+        self.from_cache = S.SENT_FROM_CACHE
+        # reply text prefix -> outcome of the flow
+        self.failures = [(t.split("{")[0], key) for t, key in (
+            (S.FREE_LIMIT_REACHED, "free_limit"), (S.QUEUE_FULL, "queue_full"), (S.DISK_FULL, "disk_full"),
+            (S.DL_CANCELLED, "cancelled"), (S.DL_ERROR, "download_error"), (S.FAILED_INFO, "info_error"),
+            (S.TOO_LARGE_PREFLIGHT, "too_large"), (S.NOTHING_FITS, "too_large"), ("Session expired", "session_expired"),
+            ("Failed to store file", "store_error"), ("Error sending file", "upload_error"),
+            ("Higher qualities are premium only", "premium_only"), ("High bitrates are premium only", "premium_only"),
+            ("No video formats found", "no_formats"), ("No audio formats found", "no_formats"))]
+        self.latency = {step: [] for step in ("info", "menu", "click", "delivery", "flow")}
+        self.outcomes = Counter()
+        self.handler_errors = Counter()
+        self.lag = []
+        self.rss_peak = 0
+        self.workers_rss_peak = 0
+
+    def outcome_of(self, text):
+        for prefix, key in self.failures:
+            if (text or "").startswith(prefix):
+                return key
+        return None
+
+    async def think(self):
+        await asyncio.sleep(_scaled(self.rnd.expovariate(1 / self.args.think)) if self.args.think > 0 else 0)
+
+    async def dispatch(self, handlers, update):
+        from pyrogram import StopPropagation
+        for fn in handlers:
+            try:
+                await fn(self.client, update)
+            except StopPropagation:
+                return
+            except Exception as e:
+                # pyrogram logs it and goes on with the next group
+                self.handler_errors[f"{fn.__name__}: {e.__class__.__name__}"] += 1
+
+    async def user(self, uid, delay):
+        await asyncio.sleep(delay)
+        inbox = self.client.inboxes[uid] = asyncio.Queue()
+        try:
+            for _ in range(self.args.flows):
+                started = time.perf_counter()
+                outcome = await self.flow(uid, inbox)
+                self.outcomes[outcome] += 1
+                if outcome in ("delivered", "cached", "stored"):
+                    self.latency["flow"].append(time.perf_counter() - started)
+                await self.think()
+        finally:
+            self.client.forget(uid)
+
+    async def flow(self, uid, inbox):
+        vid = self.rnd.choices(self.videos, self.weights)[0]
+        _drain(inbox)
+        t = time.perf_counter()
+        await self.dispatch(self.text_handlers, self.client.incoming(uid, f"https://youtu.be/{vid}"))
+        events = _drain(inbox)
+        menu = next((m for _, m in reversed(events) if _buttons(m, "choose_video|")), None)
+        if menu is None:
+            return next((o for o in (self.outcome_of(m.text) for _, m in reversed(events)) if o), "no_reply")
+        self.latency["info"].append(time.perf_counter() - t)
+
+        await self.think()
+        typ = "audio" if self.rnd.random() < self.args.audio_share else "video"
+        cq = self.client.callback(uid, menu, _buttons(menu, f"choose_{typ}|")[0])
+        t = time.perf_counter()
+        await self.dispatch(self.callback_handlers, cq)
+        self.latency["menu"].append(time.perf_counter() - t)
+        if cq.alert():
+            return self.outcome_of(cq.alert()) or "rejected"
+        choices = _buttons(menu, "dl|")
+        if not choices:
+            return "no_choice"
+
+        await self.think()
+        cq = self.client.callback(uid, menu, self.rnd.choice(choices))
+        _drain(inbox)
+        t = time.perf_counter()
+        await self.dispatch(self.callback_handlers, cq)
+        self.latency["click"].append(time.perf_counter() - t)
+        if cq.alert():
+            return self.outcome_of(cq.alert()) or "rejected"
+        if any(text == self.from_cache for text, _ in cq.answers):
+            self.latency["delivery"].append(time.perf_counter() - t)
+            return "cached"
+        return await self.wait_delivery(uid, inbox, t)
+
+    # status edits go by until the file (its first part), a rename prompt or an error arrives
+    async def wait_delivery(self, uid, inbox, t):
+        deadline = t + self.args.timeout
+        while True:
+            try:
+                method, msg = await asyncio.wait_for(inbox.get(), max(deadline - time.perf_counter(), 0))
+            except asyncio.TimeoutError:
+                return "timeout"
+            if method in MEDIA:
+                self.latency["delivery"].append(time.perf_counter() - t)
+                return "delivered"
+            if method == "edit_message_text":
+                continue
+            if msg.text == self.rename_prompt:
+                await self.think()
+                reply = f"renamed {uid}" if self.rnd.random() < self.args.rename_share else "/skip"
+                await self.dispatch(self.text_handlers, self.client.incoming(uid, reply))
+                continue
+            if (msg.text or "").startswith("Your file was uploaded to storage channel"):
+                self.latency["delivery"].append(time.perf_counter() - t)
+                return "stored"
+            outcome = self.outcome_of(msg.text)
+            if outcome:
+                return outcome
+
+    async def monitor(self, interval=0.01):
+        n = 0
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.lag.append(time.perf_counter() - t - interval)
+            n += 1
+            if n % 50 == 0:
+                self.rss_peak = max(self.rss_peak, _rss())
+                self.workers_rss_peak = max(self.workers_rss_peak, sum(_rss(p.pid) for p in multiprocessing.active_children()))
+
+async def run(args):
+    import bot, database, download
+    from functions.uploads import UploadPool
+    from functions.metrics import METRICS
+    from config import UPLOAD_SESSIONS, UPLOAD_PARALLEL, UPLOAD_RETRIES, STORAGE_CHANNEL, FFMPEG_WORKERS
+    from pyrogram.errors import FloodWait
+
+    client = FakeClient(args.api_latency, args.upload_speed, args.flood_rate, args.flood_wait, args.sleep_threshold, args.seed)
+    bot.app = client
+    bot.UPLOADERS = UploadPool(client, [client.session() for _ in range(UPLOAD_SESSIONS)],
+                               int(STORAGE_CHANNEL) if STORAGE_CHANNEL else None, UPLOAD_PARALLEL, UPLOAD_RETRIES, FloodWait)
+    download.extract_info_blocking = fake_extract
+    download.download_blocking = fake_download
+    download.FFMPEG = bot.FFMPEG = _fake_ffmpeg_class()(FFMPEG_WORKERS, args.ffmpeg_speed, 200.0)
+
+    sim = Simulation(args, bot, client)
+    if database.backend.name == "mongo":
+        await database.backend.client.drop_database(database.backend.db.name)
+    uids = [10_000_000 + i for i in range(args.users)]
+    plans = ("Silver", "Gold", "Platinum")
+    for uid in sim.rnd.sample(uids, int(args.users * args.premium_share)):
+        await database.add_premium(uid, 30, sim.rnd.choice(plans))
+
+    rss_start = _rss()
+    monitor = asyncio.ensure_future(sim.monitor())
+    started = time.perf_counter()
+    await asyncio.gather(*(sim.user(uid, sim.rnd.uniform(0, args.ramp)) for uid in uids))
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+    sim.rss_peak = max(sim.rss_peak, _rss())
+
+    # leftovers (progress tickers, abandoned jobs) don't outlive the run
+    rest = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    for t in rest:
+        t.cancel()
+    await asyncio.gather(*rest, return_exceptions=True)
+    await database.close()
+    bot.SESSIONS.close()
+    bot.DISK.close()
+    if download.WORKERS is not None:
+        download.WORKERS.shutdown()
+    return report(args, sim, client, METRICS.summary(), elapsed, rss_start)
+
+def report(args, sim, client, metrics, elapsed, rss_start):
+    results = []
+    for step, values in sim.latency.items():
+        values.sort()
+        for q, label in ((0.5, "p50"), (0.99, "p99")):
+            results.append(result(f"latency.{step}.{label}", _percentile(values, q) * 1000, "ms", "lower"))
+    done = sum(sim.outcomes[o] for o in ("delivered", "cached", "stored"))
+    results += [result("throughput.flows", sum(sim.outcomes.values()) / elapsed, "flows/s"),
+                result("throughput.delivered", done / elapsed, "flows/s"),
+                result("throughput.api_calls", sum(client.calls.values()) / elapsed, "calls/s")]
+    lag = sorted(sim.lag)
+    results += [result("loop_lag.p50", _percentile(lag, 0.5) * 1000, "ms", "lower"),
+                result("loop_lag.p99", _percentile(lag, 0.99) * 1000, "ms", "lower"),
+                result("loop_lag.max", (lag[-1] if lag else 0) * 1000, "ms", "lower"),
+                result("memory.rss_start", rss_start / MB, "MB", "lower"),
+                result("memory.rss_peak", sim.rss_peak / MB, "MB", "lower"),
+                result("memory.workers_rss_peak", sim.workers_rss_peak / MB, "MB", "lower")]
+    # the bot's own stage timers (functions/metrics.py), bucketed
+    for (name, labels), t in sorted(metrics["timers"].items()):
+        if name == "stage":
+            stage = dict(labels)["stage"]
+            results.append(result(f"stage.{stage}.p50", t["p50"], "s", "lower"))
+            results.append(result(f"stage.{stage}.p95", t["p95"], "s", "lower"))
+    return {"meta": {"timestamp": int(time.time()), "git": git_rev(), "python": platform.python_version(),
+                     "platform": platform.platform(), "cpus": os.cpu_count(), "elapsed": round(elapsed, 2),
+                     "args": {k: v for k, v in vars(args).items() if k not in ("json", "out", "compare")}},
+            "results": results,
+            "counts": {step: len(v) for step, v in sim.latency.items()},
+            "outcomes": dict(sim.outcomes.most_common()),
+            "handler_errors": dict(sim.handler_errors.most_common()),
+            "api_calls": dict(client.calls.most_common()),
+            "flood_waits": {"calls": dict(client.floods), "slept_seconds": client.flood_slept},
+            "uploaded_bytes": client.uploaded}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--ramp", type=float, default=60.0, help="seconds over which users arrive")
+    ap.add_argument("--flows", type=int, default=1, help="links each user sends, one after another")
+    ap.add_argument("--videos", type=int, default=100, help="distinct videos, Zipf-popular")
+    ap.add_argument("--zipf", type=float, default=1.0)
+    ap.add_argument("--premium-share", type=float, default=0.2)
+    ap.add_argument("--audio-share", type=float, default=0.3)
+    ap.add_argument("--rename-share", type=float, default=0.3, help="premium rename prompts answered with a name, not /skip")
+    ap.add_argument("--think", type=float, default=1.0, help="mean seconds between a user's clicks")
+    ap.add_argument("--timeout", type=float, default=900.0, help="wall seconds a user waits for a file")
+    ap.add_argument("--time-scale", type=float, default=1.0)
+    ap.add_argument("--api-latency", type=float, default=0.05)
+    ap.add_argument("--upload-speed", type=float, default=20.0, help="MB/s per upload")
+    ap.add_argument("--flood-rate", type=float, default=0.0)
+    ap.add_argument("--flood-wait", type=int, default=3)
+    ap.add_argument("--sleep-threshold", type=int, default=10)
+    ap.add_argument("--extract-time", type=float, default=0.8)
+    ap.add_argument("--extract-cpu", type=float, default=0.05, help="seconds of GIL-holding work per extraction")
+    ap.add_argument("--bandwidth", type=float, default=100.0, help="MB/s per download connection")
+    ap.add_argument("--hook-rate", type=float, default=50.0, help="progress callbacks per second per download")
+    ap.add_argument("--ffmpeg-speed", type=float, default=1.0, help="source MB/s of an mp3 re-encode")
+    ap.add_argument("--formats", type=int, default=120, help="formats per synthetic info dict")
+    ap.add_argument("--info", default="", help="recorded info JSON files or directories (os.pathsep-separated)")
+    ap.add_argument("--mongo-uri", default="", help="run on this MongoDB (a throwaway bot_loadsim database) instead of SQLite")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true")
+    ap.add_argument("--out")
+    ap.add_argument("--compare")
+    ap.add_argument("--threshold", type=float, default=0.15)
+    args = ap.parse_args()
+
+    tmp = prepare_env()
+    os.environ.update({"LOADSIM_TIME_SCALE": str(args.time_scale), "LOADSIM_EXTRACT_TIME": str(args.extract_time),
+                       "LOADSIM_EXTRACT_CPU": str(args.extract_cpu), "LOADSIM_BANDWIDTH": str(args.bandwidth),
+                       "LOADSIM_HOOK_RATE": str(args.hook_rate), "LOADSIM_FORMATS": str(args.formats),
+                       "LOADSIM_INFO": args.info})
+    if args.mongo_uri:
+        os.environ.update({"MONGODB_URI": args.mongo_uri, "MONGO_DB_NAME": "bot_loadsim"})
+    try:
+        rep = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2)
+    rows, regressions = [], 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            rows, regressions = compare(rep, json.load(f), args.threshold)
+        rep["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(rep, indent=2))
+    else:
+        print(f"{args.users} users x {args.flows} flows in {rep['meta']['elapsed']}s (time scale {args.time_scale})")
+        print("outcomes: " + ", ".join(f"{k} {v}" for k, v in rep["outcomes"].items()))
+        if rep["handler_errors"]:
+            print("handler errors: " + ", ".join(f"{k} x{v}" for k, v in rep["handler_errors"].items()))
+        for r in rep["results"]:
+            print(f"{r['name']:<32} {r['value']:>12,.2f} {r['unit']}")
+        print("api calls: " + ", ".join(f"{k} {v}" for k, v in rep["api_calls"].items()))
+        if rows:
+            print(f"\nagainst {args.compare} (threshold {args.threshold:.0%}):")
+            for name, old, new, change, flag in rows:
+                print(f"{name:<32} {old:>12,.2f} -> {new:>12,.2f} {change:+7.1%}{'  REGRESSION' if flag else ''}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
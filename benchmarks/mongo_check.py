@@ -0,0 +1,89 @@
+# benchmarks/mongo_check.py
+# Exercises the async Mongo backend end to end (indexes, quota, premium, history,
+# file cache) and reports ops/sec per call. Runs against a real server with
+# --uri (use a throwaway database), or in-process with mongomock-motor when no
+# URI is given.
+#
+#   python -m benchmarks.mongo_check [--uri mongodb://localhost:27017] [--ops 2000] [--json]
+import os, sys, time, json, asyncio, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage.mongo import MongoStorage
+
+def make_storage(uri, db_name):
+    if uri:
+        return MongoStorage(uri, db_name, bulk_interval=0.02, history_ttl_days=30)
+    from mongomock_motor import AsyncMongoMockClient
+    return MongoStorage(None, db_name, bulk_interval=0.02, history_ttl_days=30, client=AsyncMongoMockClient())
+
+async def timed(n, make_call, concurrency=32):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await make_call(i)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return round(n / max(time.perf_counter() - t0, 1e-9))
+
+async def check(db):
+    await db.start()
+    users = await db.users.index_information()
+    downloads = await db.downloads.index_information()
+    assert any(v.get("unique") and v["key"] == [("user_id", 1)] for v in users.values()), users
+    assert any(v["key"] == [("user_id", 1), ("created_at", -1)] for v in downloads.values()), downloads
+    assert any("expireAfterSeconds" in v for v in downloads.values()), downloads
+
+    # free quota: exactly `limit` of many concurrent consumes succeed
+    results = await asyncio.gather(*(db.try_consume_quota(1, 3) for _ in range(10)))
+    assert sum(ok for ok, _, _ in results) == 3, results
+    await db.add_premium(2, 30, "Gold")
+    until, plan = await db.premium_info(2)
+    assert plan == "Gold" and until, (until, plan)
+    assert "_id" not in await db.user_info(2)
+
+    await db.put_cached_file("vid", "18", "video", None, "FILE", 1, 2, 100)
+    assert (await db.get_cached_file("vid", "18", "video"))["file_id"] == "FILE"
+    await db.invalidate_cached_file("vid", "18", "video")
+    assert await db.get_cached_file("vid", "18", "video") is None
+
+    for i in range(50):
+        await db.add_download_record(i % 5, f"v{i}", "", 1000)
+    await db.flush()
+    assert await db.count_downloads() >= 50
+    return {"users": sorted(users), "downloads": sorted(downloads)}
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--uri", default="")
+    ap.add_argument("--db", default="mongo_check")
+    ap.add_argument("--ops", type=int, default=2000)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    db = make_storage(args.uri, args.db)
+    await db.client.drop_database(args.db)
+    indexes = await check(db)
+    n = args.ops
+    res = {
+        "add_download_record": await timed(n, lambda i: db.add_download_record(i % 500, f"v{i}", "", 1000)),
+        "try_consume_quota": await timed(n, lambda i: db.try_consume_quota(10_000 + i % 500, 5)),
+        "user_info": await timed(n, lambda i: db.user_info(10_000 + i % 500)),
+        "get_cached_file": await timed(n, lambda i: db.get_cached_file("vid", "18", "video")),
+    }
+    await db.flush()
+    res["bulk_writes"] = db.bulk_writes
+    await db.client.drop_database(args.db)
+    await db.close()
+
+    target = args.uri or "mongomock-motor (in-process)"
+    if args.json:
+        print(json.dumps({"target": target, "ops": n, "indexes": indexes, "ops_per_sec": res}, indent=2))
+        return
+    print(f"{target}: checks passed")
+    print("indexes: users " + ", ".join(indexes["users"]) + "; downloads " + ", ".join(indexes["downloads"]))
+    for op, v in res.items():
+        print(f"{op:<22} {v:>10}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+# benchmarks/sqlite_bench.py
+# SQLite backend before/after: the old setup (rollback journal, synchronous=FULL,
+# a commit per download record, no indexes on downloads) against the tuned
+# SQLiteStorage (WAL, per-connection pragmas and statement cache, indexes,
+# group commit). Every run gets a fresh database file on disk.
+#
+#   python -m benchmarks.sqlite_bench [--users 2000] [--records 5000] [--threads 8] [--json]
+import os, sys, time, json, random, sqlite3, argparse, datetime, tempfile, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage.base import now_ts
+from storage.sqlite import SQLiteStorage
+
+class Baseline:
+    # the backend as it was, built on its own so none of SQLiteStorage's setup leaks in:
+    # rollback journal with synchronous=FULL, no indexes, a commit per write, and the
+    # quota as a SELECT then an UPDATE (can_download_free + increment_daily_count)
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("""CREATE TABLE IF NOT EXISTS users (
+                        user_id INTEGER PRIMARY KEY,
+                        premium_until TEXT,
+                        plan TEXT,
+                        daily_count INTEGER DEFAULT 0,
+                        last_reset INTEGER DEFAULT 0
+                    )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS downloads (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        title TEXT,
+                        filepath TEXT,
+                        filesize INTEGER,
+                        created_at TEXT
+                    )""")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def add_download_record(self, user_id, title, filepath, filesize):
+        created = datetime.datetime.utcnow().isoformat()
+        conn = self._conn()
+        conn.execute("INSERT INTO downloads (user_id,title,filepath,filesize,created_at) VALUES (?,?,?,?,?)",
+                     (user_id, title, filepath, filesize, created))
+        conn.commit()
+
+    def user_info(self, user_id):
+        r = self._conn().execute("SELECT premium_until,plan,daily_count,last_reset FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if not r:
+            return {}
+        return {"premium_until": r[0], "plan": r[1], "daily_count": r[2], "last_reset": r[3]}
+
+    def can_download_free(self, user_id, free_limit):
+        ts = now_ts()
+        conn = self._conn()
+        r = conn.execute("SELECT daily_count,last_reset FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if not r:
+            conn.execute("INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)", (user_id, 0, ts))
+            conn.commit()
+            return 0 < free_limit
+        daily_count, last_reset = r
+        if ts - last_reset > 86400:
+            conn.execute("UPDATE users SET daily_count=0,last_reset=? WHERE user_id=?", (ts, user_id))
+            conn.commit()
+            daily_count = 0
+        return daily_count < free_limit
+
+    def increment_daily_count(self, user_id):
+        ts = now_ts()
+        conn = self._conn()
+        r = conn.execute("SELECT daily_count,last_reset FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if not r:
+            conn.execute("INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)", (user_id, 1, ts))
+        elif ts - r[1] > 86400:
+            conn.execute("UPDATE users SET daily_count=1,last_reset=? WHERE user_id=?", (ts, user_id))
+        else:
+            conn.execute("UPDATE users SET daily_count=daily_count+1 WHERE user_id=?", (user_id,))
+        conn.commit()
+
+    def try_consume_quota(self, user_id, free_limit):
+        if not self.can_download_free(user_id, free_limit):
+            return False
+        self.increment_daily_count(user_id)
+        return True
+
+    def count_downloads(self):
+        return self._conn().execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def close(self):
+        with self._conns_lock:
+            for conn in self._conns:
+                try: conn.close()
+                except Exception: pass
+            self._conns.clear()
+
+HISTORY = "SELECT title,filesize,created_at FROM downloads WHERE user_id=? ORDER BY created_at DESC LIMIT 10"
+WINDOW = "SELECT COUNT(*), COALESCE(SUM(filesize),0) FROM downloads WHERE user_id=? AND created_at >= ?"
+
+def timed(n, fn):
+    t0 = time.perf_counter()
+    fn()
+    return round(n / max(time.perf_counter() - t0, 1e-9))
+
+def in_threads(threads, n, op):
+    def work(k):
+        for i in range(k, n, threads):
+            op(i)
+    ts = [threading.Thread(target=work, args=(k,)) for k in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+
+def run(make, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = make(os.path.join(tmp, "bench.sqlite3"))
+        users = list(range(1, args.users + 1))
+        rnd = random.Random(7)
+        res = {}
+
+        def inserts():
+            in_threads(args.threads, args.records,
+                       lambda i: db.add_download_record(users[i % len(users)], f"video {i}", "", rnd.randint(1, 2 ** 30)))
+            db.count_downloads()   # includes the final group commit
+        res["add_download_record"] = timed(args.records, inserts)
+        res["try_consume_quota"] = timed(args.records, lambda: in_threads(
+            args.threads, args.records, lambda i: db.try_consume_quota(users[i % len(users)], 5)))
+        res["user_info"] = timed(args.records, lambda: in_threads(
+            args.threads, args.records, lambda i: db.user_info(users[i % len(users)])))
+
+        # the read paths the indexes are for
+        res["user_history"] = timed(args.queries, lambda: in_threads(
+            args.threads, args.queries, lambda i: db._conn().execute(HISTORY, (users[i % len(users)],)).fetchall()))
+        res["user_window_stats"] = timed(args.queries, lambda: in_threads(
+            args.threads, args.queries, lambda i: db._conn().execute(WINDOW, (users[i % len(users)], "2000-01-01")).fetchone()))
+        db.close()
+        return res
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--records", type=int, default=5000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    before = run(Baseline, args)
+    after = run(SQLiteStorage, args)
+    rows = [{"op": op, "before_ops_s": before[op], "after_ops_s": after[op],
+             "speedup": round(after[op] / before[op], 2) if before[op] else None} for op in before]
+
+    if args.json:
+        print(json.dumps({"users": args.users, "records": args.records, "threads": args.threads, "results": rows}, indent=2))
+        return
+    print(f"{args.records} records / {args.users} users / {args.threads} threads (ops/sec)")
+    print(f"{'operation':<22} {'before':>10} {'after':>10} {'speedup':>8}")
+    for r in rows:
+        print(f"{r['op']:<22} {r['before_ops_s']:>10} {r['after_ops_s']:>10} {r['speedup']:>7}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# benchmarks/suite.py
+# Offline micro-benchmarks of the bot's hot paths, with machine-readable output
+# so releases can be compared. Nothing here touches the network: Mongo is only
+# measured when --mongo-uri points at a local instance. Every file the run
+# creates lives in a temporary directory (config paths are redirected there).
+#
+#   python -m benchmarks.suite [--only storage,facade,qualities,split,progress,human_size]
+#                              [--quick] [--split-gb 4] [--formats 400] [--info recorded.json]
+#                              [--mongo-uri mongodb://localhost:27017] [--json] [--out results.json]
+#                              [--compare previous.json [--threshold 0.15]]
+#
+# Results are {"name", "value", "unit", "better"}; a group whose dependencies
+# can't be imported is reported as skipped. --compare exits 1 on regressions.
+import os, sys, gc, json, time, random, shutil, asyncio, argparse, platform, tempfile, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GROUPS = ("storage", "facade", "qualities", "split", "progress", "human_size")
+
+def prepare_env():
+    # before config is imported anywhere: keep every path the modules create in a scratch dir
+    tmp = os.environ.get("BENCH_TMP") or tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ["BENCH_TMP"] = tmp
+    for key, name in (("DOWNLOAD_DIR", "downloads"), ("TRANSCODE_CACHE_DIR", "transcode_cache"),
+                      ("META_CACHE_DB", "meta_cache.sqlite3"), ("SQLITE_DB", "facade.sqlite3"), ("JSON_DB", "facade.json")):
+        os.environ[key] = os.path.join(tmp, name)
+    os.environ["SESSION_DB"] = ""
+    os.environ.pop("MONGODB_URI", None)
+    return tmp
+
+def result(name, value, unit, better="higher"):
+    return {"name": name, "value": round(value, 3), "unit": unit, "better": better}
+
+# best of `repeat` runs of fn(i) for i in range(n) -> ops/sec
+def ops_per_sec(n, fn, repeat=3, setup=None):
+    best = 0.0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        t0 = time.perf_counter()
+        for i in range(n):
+            fn(i)
+        best = max(best, n / max(time.perf_counter() - t0, 1e-9))
+    return best
+
+def ns_per_call(n, fn, repeat=3):
+    return 1e9 / ops_per_sec(n, fn, repeat)
+
+# ------------ storage backends ------------
+def bench_storage(args, tmp):
+    from storage.sqlite import SQLiteStorage
+    from storage.jsondb import JSONStorage
+    n = 2000 if args.quick else 20000
+    out = []
+    for name, make in (("json", lambda p: JSONStorage(p + ".json")), ("sqlite", lambda p: SQLiteStorage(p + ".sqlite3"))):
+        db = make(os.path.join(tmp, f"storage-{name}"))
+        try:
+            out += _storage_ops(name, db, n)
+        finally:
+            db.close()
+    if args.mongo_uri:
+        out += asyncio.run(_mongo_ops(args.mongo_uri, max(n // 10, 500)))
+    return out
+
+def _storage_ops(name, db, n):
+    users = 1000
+    def add_records():
+        for i in range(n):
+            db.add_download_record(i % users, f"video {i}", "", 50_000_000, "video" if i % 3 else "audio", f"vid{i % 300:08d}")
+        db.count_downloads()    # includes any pending group commit
+    t0 = time.perf_counter()
+    add_records()
+    res = [result(f"storage.{name}.add_download_record", n / (time.perf_counter() - t0), "ops/s")]
+    for i in range(0, users, 10):
+        db.add_premium(i, 30, "Gold")
+    for op, fn in (("user_info", lambda i: db.user_info(i % users)),
+                   ("try_consume_quota", lambda i: db.try_consume_quota(i % users, 5)),
+                   ("put_cached_file", lambda i: db.put_cached_file(f"vid{i % 500:08d}", "18", "video", None, f"file{i}", 1, i, 1000)),
+                   ("get_cached_file", lambda i: db.get_cached_file(f"vid{i % 500:08d}", "18", "video")),
+                   ("count_downloads", lambda i: db.count_downloads()),
+                   ("stats_7d", lambda i: db.stats(7, 5))):
+        res.append(result(f"storage.{name}.{op}", ops_per_sec(n if op not in ("stats_7d", "count_downloads") else n // 10, fn, 1), "ops/s"))
+    batch = [(u, 1, int(time.time())) for u in range(100)]
+    res.append(result(f"storage.{name}.record_quota_batch_100", ops_per_sec(max(n // 100, 20), lambda i: db.record_quota_batch(batch), 1) * 100, "rows/s"))
+    return res
+
+async def _mongo_ops(uri, n):
+    from storage.mongo import MongoStorage
+    db = MongoStorage(uri, "bot_bench", server_timeout_ms=1000)
+    try:
+        await db.client.admin.command("ping")
+    except Exception as e:
+        db.client.close()
+        return [{"name": "storage.mongo", "skipped": f"no server at {uri}: {e.__class__.__name__}"}]
+    await db.client.drop_database("bot_bench")
+    await db.start()
+    res = []
+    async def rate(op, fn, count=n):
+        t0 = time.perf_counter()
+        for i in range(count):
+            await fn(i)
+        res.append(result(f"storage.mongo.{op}", count / (time.perf_counter() - t0), "ops/s"))
+    async def add(i):
+        await db.add_download_record(i % 1000, f"video {i}", "", 50_000_000, "video", f"vid{i % 300:08d}")
+    await rate("add_download_record", add)
+    await db.flush()
+    await rate("user_info", lambda i: db.user_info(i % 1000))
+    await rate("try_consume_quota", lambda i: db.try_consume_quota(i % 1000, 5))
+    await rate("put_cached_file", lambda i: db.put_cached_file(f"vid{i % 500:08d}", "18", "video", None, f"file{i}", 1, i, 1000))
+    await rate("get_cached_file", lambda i: db.get_cached_file(f"vid{i % 500:08d}", "18", "video"))
+    await rate("stats_7d", lambda i: db.stats(7, 5), max(n // 10, 20))
+    await db.client.drop_database("bot_bench")
+    await db.close()
+    return res
+
+# ------------ database.py facade (SQLite, with its caches) ------------
+def bench_facade(args, tmp):
+    import database
+    n = 2000 if args.quick else 20000
+    async def run():
+        res = []
+        async def rate(op, fn):
+            t0 = time.perf_counter()
+            for i in range(n):
+                await fn(i)
+            res.append(result(f"facade.{database.backend.name}.{op}", n / (time.perf_counter() - t0), "ops/s"))
+        await database.add_premium(1, 30, "Gold")
+        await rate("is_premium", lambda i: database.is_premium(i % 500))
+        await rate("can_download_free", lambda i: database.can_download_free(i % 500, 5))
+        await rate("try_consume_quota", lambda i: database.try_consume_quota(i % 500, 5))
+        await rate("add_download_record", lambda i: database.add_download_record(i % 500, "t", "", 1000, "video", f"vid{i % 50}"))
+        await rate("get_cached_file", lambda i: database.get_cached_file(f"vid{i % 50}", "18", "video"))
+        await database.close()
+        return res
+    return asyncio.run(run())
+
+# ------------ format lists ------------
+# A YouTube-like info dict: storyboards, muxed and HLS formats, DASH video per
+# height x codec x fps (HDR on top), and audio tracks per dubbed language,
+# repeated until `n` formats. Some sizes are missing, as in real extractions.
+def synthetic_info(n=400, seed=1, video_id="bench0000000", duration=1800):
+    rnd = random.Random(seed)
+    formats = [{"format_id": f"sb{i}", "format_note": "storyboard", "ext": "mhtml", "vcodec": "none", "acodec": "none",
+                "protocol": "mhtml"} for i in range(4)]
+    formats.append({"format_id": "18", "ext": "mp4", "height": 360, "vcodec": "avc1.42001E", "acodec": "mp4a.40.2",
+                    "tbr": 600, "filesize": 600 * 125 * duration})
+    langs = ["en", "es", "fr", "de", "pt", "ja", "hi", "ko", "ar", "ru", "it", "id", "tr", "pl", "nl", "vi"]
+    lang_i = 0
+    while len(formats) < n:
+        lang = langs[lang_i % len(langs)] + ("" if lang_i < len(langs) else f"-{lang_i}")
+        for itag, abr, codec, ext in ((139, 48, "mp4a.40.5", "m4a"), (140, 129, "mp4a.40.2", "m4a"),
+                                      (249, 50, "opus", "webm"), (250, 70, "opus", "webm"), (251, 135, "opus", "webm")):
+            f = {"format_id": f"{itag}-{lang}", "ext": ext, "vcodec": "none", "acodec": codec, "abr": abr + rnd.random(),
+                 "language": lang, "format_note": f"{lang} audio", "protocol": "https"}
+            if rnd.random() < 0.8:
+                f["filesize"] = int(abr * 125 * duration * rnd.uniform(0.9, 1.1))
+            formats.append(f)
+        if lang_i == 0:
+            for h, vbr in ((144, 80), (240, 150), (360, 300), (480, 600), (720, 1200), (1080, 2500), (1440, 6000), (2160, 14000), (4320, 40000)):
+                for codec, ext, k in (("avc1.64001F", "mp4", 1.0), ("vp09.00.40.08", "webm", 0.8), ("av01.0.08M.08", "mp4", 0.7)):
+                    for fps in ((30, 60) if h >= 720 else (30,)):
+                        for hdr in ((False, True) if h >= 1080 and codec.startswith("vp09") else (False,)):
+                            f = {"format_id": f"{h}{codec[:4]}{fps}{'hdr' if hdr else ''}", "ext": ext, "height": h, "width": h * 16 // 9,
+                                 "fps": fps, "vcodec": codec, "acodec": "none", "vbr": vbr * k * (1.5 if fps == 60 else 1), "protocol": "https",
+                                 "format_note": f"{h}p{fps if fps > 30 else ''}{' HDR' if hdr else ''}"}
+                            if rnd.random() < 0.7:
+                                f["filesize"] = int(f["vbr"] * 125 * duration)
+                            formats.append(f)
+                            formats.append(dict(f, format_id=f["format_id"] + "-hls", protocol="m3u8_native", filesize=None,
+                                                tbr=f["vbr"] + 128, acodec="mp4a.40.2"))
+        lang_i += 1
+    return {"id": video_id, "extractor_key": "Youtube", "title": f"benchmark video {video_id}", "uploader": "bench", "duration": duration, "view_count": 1,
+            "upload_date": "20240101", "description": "x" * 5000, "thumbnail": "", "webpage_url": f"https://youtu.be/{video_id}",
+            "formats": formats[:n]}
+
+def bench_qualities(args, tmp):
+    from download import list_video_qualities, list_audio_qualities, VideoMeta
+    if args.info:
+        with open(args.info, "r", encoding="utf-8") as f:
+            info = json.load(f)
+    else:
+        info = synthetic_info(args.formats)
+    n = 200 if args.quick else 2000
+    tag = f"{len(info.get('formats') or [])}f"
+    return [result(f"qualities.list_video_qualities.{tag}", ns_per_call(n, lambda i: list_video_qualities(info, True)) / 1000, "us/call", "lower"),
+            result(f"qualities.list_audio_qualities.{tag}", ns_per_call(n, lambda i: list_audio_qualities(info, True)) / 1000, "us/call", "lower"),
+            result(f"qualities.VideoMeta.from_info.{tag}", ns_per_call(n, lambda i: VideoMeta.from_info(info)) / 1000, "us/call", "lower")]
+
+# ------------ split_file / virtual_parts ------------
+# Each run happens in a fresh interpreter so its peak RSS is its own.
+def bench_split(args, tmp):
+    import download  # noqa: F401  (fail early, in this process, if it can't be imported)
+    size = int((0.5 if args.quick else args.split_gb) * 1024 ** 3)
+    src = os.path.join(tmp, "split-src.bin")
+    with open(src, "wb") as f:
+        f.truncate(size)    # sparse: no real disk use for the source
+    chunk = max(size // 4, 1)
+    out = []
+    try:
+        for mode in ("split_file", "virtual_parts"):
+            r = json.loads(subprocess.run([sys.executable, "-m", "benchmarks.suite", "--child", mode, src, str(chunk)],
+                                          cwd=ROOT, check=True, capture_output=True, text=True).stdout)
+            gb = f"{size / 1024 ** 3:g}GB"
+            out.append(result(f"split.{mode}.{gb}.throughput", size / r["seconds"] / 1024 ** 2, "MB/s"))
+            out.append(result(f"split.{mode}.{gb}.peak_rss", r["rss_kb"] / 1024, "MB", "lower"))
+            out.append(result(f"split.{mode}.{gb}.peak_rss_delta", r["rss_delta_kb"] / 1024, "MB", "lower"))
+    finally:
+        for p in os.listdir(tmp):
+            if p.startswith("split-"):
+                os.remove(os.path.join(tmp, p))
+    return out
+
+def _child(mode, src, chunk):
+    import resource
+    from download import split_file, virtual_parts
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    if mode == "split_file":
+        parts = split_file(src, int(chunk), prefix=src.replace("split-src", "split-part") + ".")
+    else:
+        # what the uploader does with each part: read it through in 512 KiB blocks
+        parts = virtual_parts(src, int(chunk))
+        buf = bytearray(512 * 1024)
+        for p in parts:
+            while p.readinto(buf):
+                pass
+            p.close()
+    seconds = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss   # KiB on Linux
+    print(json.dumps({"seconds": seconds, "parts": len(parts), "rss_kb": peak, "rss_delta_kb": peak - base}))
+
+# ------------ progress callbacks ------------
+def bench_progress(args, tmp):
+    from download import make_progress_hook, progress_text
+    from functions.progress import ProgressReporter
+    n = 50_000 if args.quick else 500_000
+    d = {"status": "downloading", "_percent_str": " 42.0%", "_speed_str": "5.00 MB/s", "downloaded_bytes": 123456789,
+         "total_bytes": 293456789, "eta": 34, "tmpfilename": "/tmp/x.mp4.part", "filename": "/tmp/x.mp4", "info_dict": {}}
+    bare = make_progress_hook(lambda kind, p: None)
+    cancellable = make_progress_hook(lambda kind, p: None, lambda: False)
+    reporter = ProgressReporter(None, progress_text)
+    reporting = make_progress_hook(lambda kind, p: reporter.update(("vid", "18", False), kind, p))
+    payload = {"percent": "42.0%", "speed": "5.00 MB/s", "downloaded": 123456789, "total": 293456789, "eta": 34}
+    return [result("progress.hook", ns_per_call(n, lambda i: bare(d)), "ns/call", "lower"),
+            result("progress.hook_cancellable", ns_per_call(n, lambda i: cancellable(d)), "ns/call", "lower"),
+            result("progress.hook_to_reporter", ns_per_call(n, lambda i: reporting(d)), "ns/call", "lower"),
+            result("progress.render_text", ns_per_call(n // 5, lambda i: progress_text("downloading", payload)), "ns/call", "lower")]
+
+# ------------ human_size ------------
+def bench_human_size(args, tmp):
+    from functions.utils import human_size
+    sizes = [0, 1, 1023, 1024, 5 * 1024 ** 2 + 7, 3 * 1024 ** 3, 2 * 1024 ** 4, None, "12345"]
+    n = 100_000 if args.quick else 1_000_000
+    return [result("human_size", ns_per_call(n, lambda i: human_size(sizes[i % len(sizes)])), "ns/call", "lower")]
+
+# ------------ runner ------------
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def compare(current, previous, threshold):
+    old = {r["name"]: r for r in previous.get("results", []) if "value" in r}
+    rows, regressions = [], 0
+    for r in current["results"]:
+        o = old.get(r.get("name"))
+        if "value" not in r or o is None or not o["value"]:
+            continue
+        change = (r["value"] - o["value"]) / o["value"]
+        worse = -change if r["better"] == "higher" else change
+        flag = worse > threshold
+        regressions += flag
+        rows.append((r["name"], o["value"], r["value"], change, flag))
+    return rows, regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--only", default=",".join(GROUPS))
+    ap.add_argument("--quick", action="store_true", help="smaller iteration counts and a 0.5 GB split file")
+    ap.add_argument("--split-gb", type=float, default=4.0)
+    ap.add_argument("--formats", type=int, default=400, help="formats in the synthetic info dict")
+    ap.add_argument("--info", help="recorded info JSON (e.g. from yt-dlp -J) instead of the synthetic one")
+    ap.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", ""))
+    ap.add_argument("--json", action="store_true")
+    ap.add_argument("--out")
+    ap.add_argument("--compare")
+    ap.add_argument("--threshold", type=float, default=0.15, help="relative slowdown that counts as a regression")
+    ap.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    tmp = prepare_env()
+    if args.child:
+        return _child(*args.child)
+    results = []
+    try:
+        for group in args.only.split(","):
+            fn = globals().get(f"bench_{group}")
+            if fn is None:
+                ap.error(f"unknown group {group}; choose from {', '.join(GROUPS)}")
+            try:
+                results += fn(args, tmp)
+            except ImportError as e:
+                results.append({"name": group, "skipped": f"missing dependency: {e.name or e}"})
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {"meta": {"timestamp": int(time.time()), "git": git_rev(), "python": platform.python_version(),
+                       "platform": platform.platform(), "cpus": os.cpu_count(), "quick": args.quick},
+              "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    regressions = 0
+    rows = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            rows, regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for r in results:
+            if "skipped" in r:
+                print(f"{r['name']:<48} skipped ({r['skipped']})")
+            else:
+                print(f"{r['name']:<48} {r['value']:>14,.2f} {r['unit']}")
+        if rows:
+            print(f"\nagainst {args.compare} (threshold {args.threshold:.0%}):")
+            for name, old, new, change, flag in rows:
+                print(f"{name:<48} {old:>12,.2f} -> {new:>12,.2f} {change:+7.1%}{'  REGRESSION' if flag else ''}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,124 @@
 # bot.py
-import os, uuid, asyncio
-from pyrogram import Client, filters
+import os, time, uuid, shutil, asyncio
+from pyrogram import Client, filters, idle
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from pyrogram.errors import FloodWait
 from config import *
 import script as S
-from download import list_video_qualities, list_audio_qualities, download_and_prepare, split_file
+from download import VideoMeta, FFMPEG, TRANSCODES, WORKERS, download_and_prepare, split_file, virtual_parts, fetch_info, progress_text
 import database
-from functions.utils import human_size
+from functions.utils import human_size, extract_video_id
+from functions.scheduler import JobScheduler, QueueFull
+from functions.singleflight import SingleFlight
+from functions.progress import ProgressReporter
+from functions.sessions import SessionStore
+from functions.planner import route, best_fit, button_label
+from functions.disk import DiskManager, DiskFull
+from functions.uploads import UploadPool
+from functions.metrics import METRICS
 
 # Fix asyncio policy early (Termux compatibility)
 asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 
 app = Client("inert_downloader", bot_token=BOT_TOKEN, api_id=API_ID, api_hash=API_HASH)
 
-# In-memory sessions for progress and rename flows
-SESSIONS = {}  # session_id -> {info, chat_id, user_id, msg_id, awaiting_rename, filepath, is_audio}
+# Sessions for inline buttons, progress and rename flows (TTL + LRU, indexed per user;
+# info sessions are persisted when SESSION_DB is set)
+def _session_evicted(sid, data):
+    # an unanswered rename prompt still holds a reference to the downloaded file
+    if data and data.get("flight") is not None:
+        FLIGHTS.release(data["flight"])
 
-LAST_UPDATE = {}
+SESSIONS = SessionStore(SESSION_TTL, SESSION_MAX, SESSION_DB or None, on_evict=_session_evicted)
+# session_id -> {meta, chat_id, user_id, msg_id, awaiting_rename, filepath, is_audio}
 
-async def async_progress_update(session_id, text):
-    session = SESSIONS.get(session_id)
-    if not session:
-        return
-    now = asyncio.get_event_loop().time()
-    last = LAST_UPDATE.get(session_id, 0)
-    if now - last < 1.0:
-        return
-    LAST_UPDATE[session_id] = now
-    try:
-        await app.edit_message_text(session["chat_id"], session["msg_id"], text)
-    except Exception:
-        pass
+async def edit_status(chat_id, msg_id, text, reply_markup=None):
+    await app.edit_message_text(chat_id, msg_id, text, reply_markup=reply_markup)
+
+# Latest progress per download key, flushed by one ticker per chat
+REPORTER = ProgressReporter(edit_status, progress_text, FloodWait, PROGRESS_INTERVAL)
+
+# Download jobs: global/per-user caps, Gold & Platinum get the "instant queue" lane
+SCHEDULER = JobScheduler(MAX_CONCURRENT_DOWNLOADS, PER_USER_DOWNLOADS, MAX_QUEUED_PER_USER, PRIORITY_RESERVED_SLOTS)
+PLAN_LANES = {"Platinum": 0, "Gold": 0, "Silver": 1}
+
+def plan_lane(plan):
+    return PLAN_LANES.get(plan, 2)
+
+# Parallel connections per download stream ("faster downloads" for paid plans)
+PLAN_CONNECTIONS = {"Platinum": DL_CONNECTIONS_PLATINUM, "Gold": DL_CONNECTIONS_GOLD, "Silver": DL_CONNECTIONS_SILVER}
+
+def plan_connections(plan):
+    return PLAN_CONNECTIONS.get(plan, DL_CONNECTIONS_FREE)
+
+# Split parts upload in parallel over UPLOAD_SESSIONS extra sessions of this bot to the
+# storage channel, then reach the user in order by file_id
+UPLOADERS = UploadPool(app, [Client(f"inert_uploader_{i}", bot_token=BOT_TOKEN, api_id=API_ID, api_hash=API_HASH,
+                                    in_memory=True, no_updates=True) for i in range(UPLOAD_SESSIONS)],
+                       int(STORAGE_CHANNEL) if STORAGE_CHANNEL else None, UPLOAD_PARALLEL, UPLOAD_RETRIES, FloodWait)
+
+# Each download gets its own directory under DOWNLOAD_DIR, admitted against free space / DISK_QUOTA
+DISK = DiskManager(DOWNLOAD_DIR, DISK_QUOTA, DISK_MIN_FREE, DISK_DEFAULT_RESERVE, interval=DISK_JANITOR_INTERVAL,
+                   orphan_age=DISK_ORPHAN_AGE, part_age=DISK_PART_AGE)
+
+# Identical (video, format, audio/video) requests share one download and its job directory,
+# removed once the last of them is done with the file
+FLIGHTS = SingleFlight(cleanup=lambda res: DISK.release((res or {}).get("workdir")))
+
+# Stage timers and counters for /perf (and Prometheus text on METRICS_PORT); the gauges
+# below are only read when someone asks
+METRICS.enabled = METRICS_ENABLED
+METRICS.gauge("sessions", lambda: len(SESSIONS))
+METRICS.gauge("jobs", lambda: {"running": SCHEDULER.running, "queued": SCHEDULER.stats()["queued"]}, label="state")
+METRICS.gauge("progress_updates", lambda: {"sent": REPORTER.sent, "dropped": REPORTER.dropped, "flood_wait": REPORTER.flood_waits},
+              label="result", kind="counter")
+METRICS.gauge("upload_parts", lambda: {"sent": UPLOADERS.parts, "retried": UPLOADERS.retried, "failed": UPLOADERS.failed},
+              label="result", kind="counter")
+METRICS.gauge("disk_free_bytes", lambda: shutil.disk_usage(DOWNLOAD_DIR).free)
+
+def flight_key(meta, url, fmt, is_audio):
+    return (meta.id or url, fmt, is_audio)
+
+# Video rows a user may pick: free users get up to 720p and only what fits in one upload
+def allowed_video(qualities, is_prem):
+    allowed = []
+    for label, fmt, size in qualities:
+        # parse numeric height if possible
+        try:
+            h = int(label.replace("p",""))
+        except:
+            h = 0
+        if (not is_prem) and (h > 720):
+            continue
+        if route(size, is_prem, MAX_UPLOAD_FILESIZE) == "storage":
+            continue
+        allowed.append((label, fmt, size))
+    return allowed
+
+def planned_size(meta, fmt, is_audio):
+    qualities = meta.audio_qualities if is_audio else meta.video_qualities
+    return next((q[2] for q in qualities if q[1] == fmt), 0)
+
+def cancel_markup(job_id):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel|{job_id}")]])
+
+# Queue a run_download job and keep the status message updated with its queue position
+async def submit_download(prog_sid, chat_id, user_id, msg_id, meta, url, fmt, is_audio, rename=None, ask_rename=True):
+    plan = await database.get_plan(user_id)
+    queued_at = time.monotonic()
+    async def on_position(pos):
+        await app.edit_message_text(chat_id, msg_id, S.QUEUED.format(pos=pos), reply_markup=cancel_markup(job.id))
+    async def on_start():
+        METRICS.observe("stage", time.monotonic() - queued_at, stage="queue")
+        try:
+            await app.edit_message_text(chat_id, msg_id, S.PREPARING_DOWNLOAD, reply_markup=cancel_markup(job.id))
+        except Exception:
+            pass
+    job = SCHEDULER.submit(user_id, plan_lane(plan),
+                           lambda j: run_download(prog_sid, chat_id, user_id, meta, url, fmt, is_audio, rename, ask_rename, j),
+                           on_position, on_start)
+    SESSIONS[prog_sid]["job_id"] = job.id
+    return job
 
 # ---------------- Commands ----------------
 @app.on_message(filters.command("start") & filters.private)
@@ -53,7 +141,7 @@ async def cmd_add_premium(_, message):
     except:
         return await message.reply_text(S.CORRECT_ADD_CMD)
     try:
-        database.add_premium(user_id, days)
+        await database.add_premium(user_id, days)
         await message.reply_text(f"✅ Added premium for {user_id} for {days} days.")
     except Exception as e:
         await message.reply_text(f"❌ Error adding premium: {e}")
@@ -69,7 +157,7 @@ async def cmd_rmpremium(_, message):
     except:
         return await message.reply_text(S.CORRECT_RM_CMD)
     try:
-        database.remove_premium(user_id)
+        await database.remove_premium(user_id)
         await message.reply_text(f"✅ Removed premium for {user_id}.")
     except Exception as e:
         await message.reply_text(f"❌ Error removing premium: {e}")
@@ -77,8 +165,8 @@ async def cmd_rmpremium(_, message):
 @app.on_message(filters.command("check_premium") & filters.private)
 async def cmd_check_premium(_, message):
     uid = message.from_user.id
-    rem = database.get_remaining_days(uid)
-    if database.is_premium(uid):
+    rem = await database.get_remaining_days(uid)
+    if await database.is_premium(uid):
         await message.reply_text(f"💎 Premium active. Days left: {rem}")
     else:
         await message.reply_text("You are not premium. Use /add_premium (owner) or upgrade link.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Premium", url=QR_CODE)]]))
@@ -94,40 +182,34 @@ async def handle_text(_, message):
     uid = message.from_user.id
 
     # Check free limit (non-premium)
-    if not database.is_premium(uid):
-        allowed = database.can_download_free(uid, FREE_DAILY_LIMIT)
+    if not await database.is_premium(uid):
+        allowed = await database.can_download_free(uid, FREE_DAILY_LIMIT)
         if not allowed:
             return await message.reply_text(S.FREE_LIMIT_REACHED.format(limit=FREE_DAILY_LIMIT))
 
     info_msg = await message.reply_text(S.FETCHING_INFO)
-    # extract info with yt-dlp without download — use blocking in thread
-    import yt_dlp
-    def extract_info():
-        with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
-            return ydl.extract_info(url, download=False)
+    # extract info with yt-dlp without download (cached per video id, blocking part runs in a thread)
     try:
-        loop = asyncio.get_event_loop()
-        info = await loop.run_in_executor(None, extract_info)
+        with METRICS.stage("extract"):
+            info = await fetch_info(url)
+        # sessions keep only this compact record; the raw dict stays in the bounded META_CACHE
+        meta = VideoMeta.from_info(info)
+        del info
     except Exception as e:
         return await info_msg.edit_text(S.FAILED_INFO.format(error=e))
 
     # build info + buttons
     sid = str(uuid.uuid4())
-    SESSIONS[sid] = {"info": info, "chat_id": message.chat.id, "user_id": uid}
-    title = info.get("title","Unknown")
-    uploader = info.get("uploader","Unknown")
-    duration = info.get("duration",0)
-    views = info.get("view_count",0)
-    upload = info.get("upload_date","")
-    desc = (info.get("description") or "")[:300].replace("\n"," ")
-    txt = (f"🎬 *{title}*\n👤 {uploader}\n🕒 {duration}s | 👁️ {views}\n📅 {upload}\n\n{desc}...\n\nChoose an action:")
+    SESSIONS.put(sid, {"meta": meta, "chat_id": message.chat.id, "user_id": uid}, persist=True)
+    desc = meta.description[:300].replace("\n"," ")
+    txt = (f"🎬 *{meta.title}*\n👤 {meta.uploader}\n🕒 {meta.duration}s | 👁️ {meta.views}\n📅 {meta.upload_date}\n\n{desc}...\n\nChoose an action:")
     kb = [
         [InlineKeyboardButton("ℹ️ Info", callback_data=f"info|{sid}")],
         [InlineKeyboardButton("🎞️ Video", callback_data=f"choose_video|{sid}")],
         [InlineKeyboardButton("🎧 Audio", callback_data=f"choose_audio|{sid}")],
         [InlineKeyboardButton("💎 Premium", callback_data=f"premium|{sid}")],
     ]
-    thumb = info.get("thumbnail")
+    thumb = meta.thumbnail
     await info_msg.delete()
     if thumb:
         await message.reply_photo(thumb, caption=txt, reply_markup=InlineKeyboardMarkup(kb))
@@ -142,64 +224,58 @@ async def callbacks(_, cq):
     cmd = parts[0]
 
     if cmd == "info":
-        sid = parts[1]; session = SESSIONS.get(sid)
+        sid = parts[1]; session = await SESSIONS.aget(sid)
         if not session: return await cq.answer("Session expired", show_alert=True)
-        info = session["info"]
-        txt = f"📋 *{info.get('title','Unknown')}*\n\n" + (info.get("description","")[:800] or "No description")
+        meta = session["meta"]
+        txt = f"📋 *{meta.title}*\n\n" + (meta.description or "No description")
         await cq.answer(); await cq.message.edit_text(txt)
 
     elif cmd == "choose_video":
-        sid = parts[1]; session = SESSIONS.get(sid)
+        sid = parts[1]; session = await SESSIONS.aget(sid)
         if not session: return await cq.answer("Session expired", show_alert=True)
-        info = session["info"]
-        choices = list_video_qualities(info)
+        choices = session["meta"].video_qualities
         if not choices: return await cq.answer("No video formats found", show_alert=True)
-        allowed = []
-        is_prem = database.is_premium(cq.from_user.id)
-        for label, fmt in choices:
-            # parse numeric height if possible
-            try:
-                h = int(label.replace("p",""))
-            except:
-                h = 0
-            if (not is_prem) and (h > 720):
-                continue
-            allowed.append((label, fmt))
+        is_prem = await database.is_premium(cq.from_user.id)
+        allowed = allowed_video(choices, is_prem)
         if not allowed:
             return await cq.answer("Higher qualities are premium only", show_alert=True)
-        kb = [[InlineKeyboardButton(label, callback_data=f"dl|video|{sid}|{fmt}")] for label,fmt in allowed]
+        kb = [[InlineKeyboardButton(button_label(label, size, route(size, is_prem, MAX_UPLOAD_FILESIZE)), callback_data=f"dl|video|{sid}|{fmt}")]
+              for label, fmt, size in allowed]
+        if best_fit(allowed, MAX_UPLOAD_FILESIZE):
+            kb.append([InlineKeyboardButton("⭐ Best that fits", callback_data=f"dl|video|{sid}|best")])
         kb.append([InlineKeyboardButton("↩️ Back", callback_data=f"back|{sid}")])
         await cq.message.edit_text("Select video quality (lowest → highest):", reply_markup=InlineKeyboardMarkup(kb))
         await cq.answer()
 
     elif cmd == "choose_audio":
-        sid = parts[1]; session = SESSIONS.get(sid)
+        sid = parts[1]; session = await SESSIONS.aget(sid)
         if not session: return await cq.answer("Session expired", show_alert=True)
-        info = session["info"]
-        choices = list_audio_qualities(info)
+        choices = session["meta"].audio_qualities
         if not choices: return await cq.answer("No audio formats found", show_alert=True)
         allowed = []
-        is_prem = database.is_premium(cq.from_user.id)
-        for label, fmt in choices:
+        is_prem = await database.is_premium(cq.from_user.id)
+        for label, fmt, size in choices:
             try:
                 abr = int(label.replace("kbps",""))
             except:
                 abr = 0
             if (not is_prem) and (abr > 192):
                 continue
-            allowed.append((label, fmt))
+            if route(size, is_prem, MAX_UPLOAD_FILESIZE) == "storage":
+                continue
+            allowed.append((label, fmt, size))
         if not allowed:
             return await cq.answer("High bitrates are premium only", show_alert=True)
-        kb = [[InlineKeyboardButton(label, callback_data=f"dl|audio|{sid}|{fmt}")] for label,fmt in allowed]
+        kb = [[InlineKeyboardButton(button_label(label, size, route(size, is_prem, MAX_UPLOAD_FILESIZE)), callback_data=f"dl|audio|{sid}|{fmt}")]
+              for label, fmt, size in allowed]
         kb.append([InlineKeyboardButton("↩️ Back", callback_data=f"back|{sid}")])
         await cq.message.edit_text("Select audio quality (lowest → highest):", reply_markup=InlineKeyboardMarkup(kb))
         await cq.answer()
 
     elif cmd == "back":
-        sid = parts[1]; session = SESSIONS.get(sid)
+        sid = parts[1]; session = await SESSIONS.aget(sid)
         if not session: return await cq.answer("Session expired", show_alert=True)
-        info = session["info"]
-        txt = (f"🎬 *{info.get('title','Unknown')}*\nChoose an action:")
+        txt = (f"🎬 *{session['meta'].title}*\nChoose an action:")
         kb = [
             [InlineKeyboardButton("ℹ️ Info", callback_data=f"info|{sid}")],
             [InlineKeyboardButton("🎞️ Video", callback_data=f"choose_video|{sid}")],
@@ -220,152 +296,360 @@ async def callbacks(_, cq):
     elif cmd == "dl":
         # dl|type|sid|format
         typ = parts[1]; sid = parts[2]; fmt = parts[3]
-        session = SESSIONS.get(sid)
+        session = await SESSIONS.aget(sid)
         if not session: return await cq.answer("Session expired", show_alert=True)
-        info = session["info"]
-        url = info.get("webpage_url") or info.get("original_url")
+        meta = session["meta"]
+        url = meta.url
         user_id = cq.from_user.id
+        chat_id = cq.message.chat.id
+        is_prem = await database.is_premium(user_id)
+
+        # pre-flight: pick the route from the size estimate before spending any bandwidth
+        qualities = meta.audio_qualities if typ == "audio" else meta.video_qualities
+        if fmt == "best":
+            row = best_fit(allowed_video(qualities, is_prem), MAX_UPLOAD_FILESIZE)
+            if row is None:
+                return await cq.answer(S.NOTHING_FITS, show_alert=True)
+            fmt = row[1]
+        size = planned_size(meta, fmt, is_audio=(typ == "audio"))
+        planned = route(size, is_prem, MAX_UPLOAD_FILESIZE)
+        if planned == "storage":
+            return await cq.answer(S.TOO_LARGE_PREFLIGHT.format(size=human_size(size)), show_alert=True)
 
-        # enforce free daily limits (re-check)
-        if not database.is_premium(user_id):
-            allowed = database.can_download_free(user_id, FREE_DAILY_LIMIT)
-            if not allowed:
+        # enforce free daily limits: check and consume in one atomic step (double clicks can't overshoot)
+        if not is_prem:
+            if not await database.try_consume_quota(user_id, FREE_DAILY_LIMIT):
                 return await cq.answer(S.FREE_LIMIT_REACHED.format(limit=FREE_DAILY_LIMIT), show_alert=True)
-            database.increment_daily_count(user_id)
+
+        is_audio = (typ == "audio")
+        # already uploaded once? answer from Telegram's copy instead of downloading again
+        cached = await database.get_cached_file(meta.id, fmt, typ)
+        # an entry without file_id is a storage-channel upload, only a fallback for free users
+        if cached and (cached.get("file_id") or not is_prem):
+            if is_prem:
+                # still offer the rename prompt; /skip re-sends the cached file instantly
+                prog_sid = str(uuid.uuid4())
+                SESSIONS.put(prog_sid, {"meta": meta, "chat_id": chat_id, "user_id": user_id,
+                                        "cached": cached, "fmt": fmt, "is_audio": is_audio, "title": meta.title})
+                SESSIONS.set_awaiting(prog_sid, RENAME_TTL)
+                await cq.answer()
+                return await app.send_message(chat_id, S.RENAME_PROMPT)
+            if await deliver_cached(chat_id, user_id, meta, fmt, typ, cached):
+                return await cq.answer(S.SENT_FROM_CACHE)
 
         # create status msg
         status_msg = await cq.message.edit_text(S.PREPARING_DOWNLOAD)
         prog_sid = str(uuid.uuid4())
-        SESSIONS[prog_sid] = {"info": info, "chat_id": cq.message.chat.id, "msg_id": status_msg.id, "user_id": user_id}
-        is_audio = (typ == "audio")
+        # pinned: never evicted while the job runs
+        SESSIONS.put(prog_sid, {"meta": meta, "chat_id": chat_id, "msg_id": status_msg.id, "user_id": user_id}, pinned=True)
 
-        # run download in executor
-        loop = asyncio.get_event_loop()
-        async def run_download():
-            try:
-                res = await download_and_prepare(url, fmt, is_audio, async_progress_update)
-                filepath = res.get("filepath")
-                title = res.get("title")
-                filesize = res.get("filesize", 0)
-                # if too large for Telegram
-                if filesize > MAX_UPLOAD_FILESIZE:
-                    if database.is_premium(user_id):
-                        # split and send parts
-                        parts = split_file(filepath)
-                        for p in parts:
-                            await app.send_document(cq.message.chat.id, p, caption=f"{title} (part) - by {BOT_NAME}")
-                            try: os.remove(p)
-                            except: pass
-                    else:
-                        # upload to storage channel
-                        try:
-                            await app.send_message(cq.message.chat.id, S.FILE_TOO_LARGE.format(size=human_size(filesize)))
-                            await app.send_document(int(STORAGE_CHANNEL), filepath, caption=f"Stored for user {user_id} - {title}")
-                            await app.send_message(cq.message.chat.id, f"Your file was uploaded to storage channel {STORAGE_CHANNEL}.")
-                        except Exception as e:
-                            await app.send_message(cq.message.chat.id, f"Failed to store file: {e}")
-                else:
-                    # Premium rename flow
-                    if database.is_premium(user_id):
-                        # set awaiting rename in session
-                        SESSIONS[prog_sid].update({"awaiting_rename": True, "filepath": filepath, "is_audio": is_audio, "title": title, "info": info})
-                        await app.send_message(cq.message.chat.id, S.RENAME_PROMPT)
-                    else:
-                        caption = f"✅ *{title}*\nDownloaded by @{BOT_NAME}"
-                        if is_audio:
-                            await app.send_audio(cq.message.chat.id, filepath, caption=caption)
-                        else:
-                            thumb = info.get("thumbnail")
-                            if thumb:
-                                await app.send_video(cq.message.chat.id, filepath, caption=caption, thumb=thumb)
-                            else:
-                                await app.send_video(cq.message.chat.id, filepath, caption=caption)
-                        # record
-                        try:
-                            database.add_download_record(user_id, title, filepath, filesize)
-                        except:
-                            pass
-                        try: os.remove(filepath)
-                        except: pass
-                # show premium CTA
-                await app.send_message(cq.message.chat.id, "💎 Want more features? Upgrade:", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Get Premium", url=QR_CODE)]]))
-            except Exception as e:
-                await app.send_message(cq.message.chat.id, S.DL_ERROR.format(error=e))
-            finally:
-                SESSIONS.pop(prog_sid, None)
-        loop.create_task(run_download())
+        if FLIGHTS.active(flight_key(meta, url, fmt, is_audio)):
+            # same file is already downloading: attach to it without taking a scheduler slot
+            asyncio.get_event_loop().create_task(run_download(prog_sid, chat_id, user_id, meta, url, fmt, is_audio))
+            return await cq.answer(S.JOINED_DOWNLOAD)
+
+        # queue the download; it runs in the download pool once a slot is free
+        try:
+            await submit_download(prog_sid, chat_id, user_id, status_msg.id, meta, url, fmt, is_audio)
+        except QueueFull:
+            SESSIONS.pop(prog_sid, None)
+            await status_msg.edit_text(S.QUEUE_FULL)
+            return await cq.answer(S.QUEUE_FULL, show_alert=True)
+        if planned == "split":
+            return await cq.answer(S.WILL_SPLIT.format(size=human_size(size), parts=-(-size // SPLIT_CHUNK_SIZE)))
         await cq.answer("Download started. Progress will update shortly.")
 
+    elif cmd == "cancel":
+        job = SCHEDULER.jobs.get(parts[1])
+        if not job or job.user_id != cq.from_user.id:
+            return await cq.answer("Nothing to cancel", show_alert=True)
+        started = job.task is not None
+        SCHEDULER.cancel(job.id)
+        if not started:
+            # never ran, so run_download won't clean up after it
+            for sid, s in SESSIONS.user_sessions(job.user_id):
+                if s.get("job_id") == job.id:
+                    SESSIONS.pop(sid, None)
+            await cq.message.edit_text(S.DL_CANCELLED)
+        await cq.answer("Cancelled")
+
     else:
         await cq.answer("Unknown action", show_alert=True)
 
-# ---------------- Handler to accept rename reply (premium only) ----------------
-@app.on_message(filters.private & filters.text)
-async def rename_handler(_, message):
-    # find session awaiting rename for this user
-    for sid, s in list(SESSIONS.items()):
-        if s.get("awaiting_rename") and s.get("user_id") == message.from_user.id:
-            text = message.text.strip()
-            filepath = s.get("filepath")
-            is_audio = s.get("is_audio")
-            title = s.get("title")
-            info = s.get("info")
-            if text == "/skip":
-                newname = None
+# ---------------- Delivery ----------------
+def media_caption(title):
+    return f"✅ *{title}*\nDownloaded by @{BOT_NAME}"
+
+# Upload a finished file and remember Telegram's file_id for (video, format, type, rename)
+async def send_media(chat_id, meta, fmt, is_audio, filepath, title, rename=None):
+    caption = media_caption(rename or title)
+    # on-disk names carry id/format to keep jobs apart; users see the title (or their rename)
+    file_name = (rename or title or "file") + os.path.splitext(filepath)[1]
+    if is_audio:
+        msg = await app.send_audio(chat_id, filepath, caption=caption, file_name=file_name)
+        media = msg.audio or msg.document
+    else:
+        thumb = meta.thumbnail
+        if thumb:
+            msg = await app.send_video(chat_id, filepath, caption=caption, thumb=thumb, file_name=file_name)
+        else:
+            msg = await app.send_video(chat_id, filepath, caption=caption, file_name=file_name)
+        media = msg.video or msg.document
+    if media and meta.id:
+        try:
+            await database.put_cached_file(meta.id, fmt, "audio" if is_audio else "video", rename,
+                                           file_id=media.file_id, filesize=media.file_size)
+        except Exception:
+            pass
+    return msg
+
+# Re-send a cached upload; returns False (and marks the entry invalid) if Telegram rejects it
+async def deliver_cached(chat_id, user_id, meta, fmt, typ, cached, rename=None):
+    title = rename or meta.title
+    try:
+        if cached.get("file_id"):
+            await app.send_cached_media(chat_id, cached["file_id"], caption=media_caption(title))
+        else:
+            # oversized file kept in the storage channel: make sure the message still exists
+            msg = await app.get_messages(cached["chat_id"], cached["message_id"])
+            if not msg or msg.empty:
+                raise ValueError("stored message is gone")
+            await app.send_message(chat_id, f"Your file was uploaded to storage channel {STORAGE_CHANNEL}.")
+    except Exception:
+        await database.invalidate_cached_file(meta.id, fmt, typ, rename)
+        return False
+    try:
+        await database.add_download_record(user_id, title, None, cached.get("filesize") or 0, typ, meta.id)
+    except:
+        pass
+    return True
+
+async def run_download(prog_sid, chat_id, user_id, meta, url, fmt, is_audio, rename=None, ask_rename=True, job=None):
+    started = time.monotonic()
+    typ = "audio" if is_audio else "video"
+    key = flight_key(meta, url, fmt, is_audio)
+    connections = plan_connections(await database.get_plan(user_id))
+    async def _download(fl):
+        workdir = DISK.reserve(planned_size(meta, fmt, is_audio))
+        try:
+            # the full info dict comes from META_CACHE (or a fresh extraction), not the session
+            res = await download_and_prepare(url, fmt, is_audio, lambda kind, p: REPORTER.update(key, kind, p), None,
+                                             fl.cancel_event, workdir, connections)
+        except BaseException:
+            DISK.release(workdir)
+            raise
+        finally:
+            REPORTER.finish(key)
+        res["workdir"] = workdir
+        return res
+    flight = None
+    msg_id = SESSIONS[prog_sid].get("msg_id")
+    REPORTER.watch(key, chat_id, msg_id, cancel_markup(job.id) if job else None)
+    try:
+        flight, res = await FLIGHTS.join(key, _download)
+        REPORTER.unwatch(chat_id, msg_id)
+        filepath = res.get("filepath")
+        title = res.get("title")
+        filesize = res.get("filesize", 0)
+        # if too large for Telegram
+        if filesize > MAX_UPLOAD_FILESIZE:
+            if await database.is_premium(user_id):
+                # split and send parts (not cached: one file_id per part)
+                if SPLIT_MODE == "virtual":
+                    # byte ranges of the original: no part files, no extra disk or RAM
+                    parts = virtual_parts(filepath, name=(title or "file") + os.path.splitext(filepath)[1])
+                    with METRICS.stage("upload"):
+                        await UPLOADERS.send_parts(chat_id, parts, f"{title} (part) - by {BOT_NAME}")
+                else:
+                    # the prefix is per job since coalesced jobs share the source file
+                    with METRICS.stage("split"):
+                        parts = split_file(filepath, prefix=f"{filepath}.{prog_sid[:8]}.part_")
+                    try:
+                        with METRICS.stage("upload"):
+                            await UPLOADERS.send_parts(chat_id, parts, f"{title} (part) - by {BOT_NAME}")
+                    finally:
+                        for p in parts:
+                            try: os.remove(p)
+                            except: pass
             else:
-                newname = text
-            # rename if requested
-            if newname:
-                base, ext = os.path.splitext(filepath)
-                newpath = os.path.join(os.path.dirname(filepath), newname + ext)
+                # upload to storage channel
                 try:
-                    os.rename(filepath, newpath)
-                    filepath = newpath
-                except Exception:
-                    pass
-            caption = f"✅ *{newname or title}*\nDownloaded by @{BOT_NAME}"
-            try:
-                if is_audio:
-                    await app.send_audio(message.chat.id, filepath, caption=caption)
-                else:
-                    thumb = info.get("thumbnail")
-                    if thumb:
-                        await app.send_video(message.chat.id, filepath, caption=caption, thumb=thumb)
-                    else:
-                        await app.send_video(message.chat.id, filepath, caption=caption)
-                database.add_download_record(message.from_user.id, newname or title, filepath, os.path.getsize(filepath))
-            except Exception as e:
-                await message.reply_text(f"Error sending file: {e}")
+                    await app.send_message(chat_id, S.FILE_TOO_LARGE.format(size=human_size(filesize)))
+                    with METRICS.stage("upload"):
+                        stored = await app.send_document(int(STORAGE_CHANNEL), filepath, caption=f"Stored for user {user_id} - {title}")
+                    await app.send_message(chat_id, f"Your file was uploaded to storage channel {STORAGE_CHANNEL}.")
+                    if meta.id:
+                        await database.put_cached_file(meta.id, fmt, typ, None, chat_id=stored.chat.id,
+                                                       message_id=stored.id, filesize=filesize)
+                except Exception as e:
+                    await app.send_message(chat_id, f"Failed to store file: {e}")
+        elif ask_rename and await database.is_premium(user_id):
+            # Premium rename flow: keep the session (and file) until the user answers
+            # the session now holds this job's reference to the (shared) file
+            SESSIONS[prog_sid].update({"filepath": filepath, "fmt": fmt, "is_audio": is_audio, "title": title, "meta": meta, "flight": flight})
+            SESSIONS.set_awaiting(prog_sid, RENAME_TTL)
+            flight = None
+            await app.send_message(chat_id, S.RENAME_PROMPT)
+            return
+        else:
+            with METRICS.stage("upload"):
+                await send_media(chat_id, meta, fmt, is_audio, filepath, title, rename)
+            # record
             try:
-                os.remove(filepath)
+                await database.add_download_record(user_id, rename or title, filepath, filesize, typ, meta.id)
             except:
                 pass
-            # cleanup
-            s.pop("awaiting_rename", None)
-            s.pop("filepath", None)
-            s.pop("is_audio", None)
-            s.pop("title", None)
-            break
+        METRICS.inc("bytes", filesize or 0, direction="upload")
+        # show premium CTA
+        await app.send_message(chat_id, "💎 Want more features? Upgrade:", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Get Premium", url=QR_CODE)]]))
+    except asyncio.CancelledError:
+        SESSIONS.pop(prog_sid, None)
+        try: await app.send_message(chat_id, S.DL_CANCELLED)
+        except Exception: pass
+        raise
+    except DiskFull:
+        await app.send_message(chat_id, S.DISK_FULL)
+    except Exception as e:
+        METRICS.inc("stage_errors", stage="job")
+        await app.send_message(chat_id, S.DL_ERROR.format(error=e))
+    finally:
+        METRICS.observe("stage", time.monotonic() - started, stage="job")
+        REPORTER.unwatch(chat_id, msg_id)
+        # the file is deleted once every coalesced job is done with it
+        if flight is not None:
+            FLIGHTS.release(flight)
+    SESSIONS.pop(prog_sid, None)
+
+# ---------------- Handler to accept rename reply (premium only) ----------------
+# group -1 runs before handle_text (both match private text); a consumed rename stops propagation
+@app.on_message(filters.private & filters.text, group=-1)
+async def rename_handler(_, message):
+    # O(1) lookup of the session awaiting this user's rename reply
+    sid, s = SESSIONS.awaiting(message.from_user.id)
+    if s is None:
+        return
+    text = message.text.strip()
+    # commands and new links go on to their handlers; the rename stays pending
+    if (text.startswith("/") and text != "/skip") or extract_video_id(text):
+        return
+    filepath = s.get("filepath")
+    is_audio = s.get("is_audio")
+    title = s.get("title")
+    meta = s.get("meta")
+    fmt = s.get("fmt")
+    typ = "audio" if is_audio else "video"
+    if text == "/skip":
+        newname = None
+    else:
+        newname = text
+    SESSIONS.clear_awaiting(sid)
+    if s.get("cached"):
+        # nothing downloaded yet: reuse an upload with this exact name if we have one
+        cached = s["cached"] if not newname else await database.get_cached_file(meta.id, fmt, typ, newname)
+        if not (cached and cached.get("file_id") and await deliver_cached(message.chat.id, message.from_user.id, meta, fmt, typ, cached, newname)):
+            status_msg = await message.reply_text(S.PREPARING_DOWNLOAD)
+            s.update({"msg_id": status_msg.id})
+            s.pop("cached", None)
+            SESSIONS.pin(sid)
+            try:
+                await submit_download(sid, message.chat.id, message.from_user.id, status_msg.id, meta, meta.url, fmt, is_audio, newname, False)
+            except QueueFull:
+                SESSIONS.pop(sid, None)
+                await status_msg.edit_text(S.QUEUE_FULL)
+        else:
+            SESSIONS.pop(sid, None)
+        message.stop_propagation()
+    try:
+        with METRICS.stage("upload"):
+            await send_media(message.chat.id, meta, fmt, is_audio, filepath, title, newname)
+        METRICS.inc("bytes", os.path.getsize(filepath), direction="upload")
+        await database.add_download_record(message.from_user.id, newname or title, filepath, os.path.getsize(filepath), typ, meta.id)
+    except Exception as e:
+        await message.reply_text(f"Error sending file: {e}")
+    if s.get("flight") is not None:
+        FLIGHTS.release(s["flight"])
+    # cleanup
+    SESSIONS.pop(sid, None)
+    message.stop_propagation()
 
 # ---------------- Admin stats ----------------
 @app.on_message(filters.command("stats") & filters.user(*OWNER_IDS))
 async def cmd_stats(_, message):
+    # /stats [days]: per-day breakdown of the last `days` days (default 7, at most 31)
+    parts = message.text.strip().split()
+    days = min(max(int(parts[1]), 1), 31) if len(parts) > 1 and parts[1].isdigit() else 7
     try:
-        cnt = "unknown"
-        # rough count
-        if database.USE_MONGO:
-            cnt = database.downloads_coll.count_documents({})
-        elif database.USE_SQLITE:
-            database.cur.execute("SELECT COUNT(*) FROM downloads")
-            cnt = database.cur.fetchone()[0]
-        else:
-            with open(database.JSON_DB, "r") as f:
-                data = json.load(f)
-            cnt = len(data.get("downloads", []))
-        await message.reply_text(f"📊 Total downloads recorded: {cnt}")
+        st = await database.get_stats(days)
+        d = await asyncio.to_thread(DISK.stats)
+        u = UPLOADERS.stats()
+        f, c = FFMPEG.stats(), TRANSCODES.stats()
+        quota = human_size(d["quota"]) if d["quota"] else "none"
+        t = st["total"]
+        win = {k: sum(day[k] for day in st["days"]) for k in ("downloads", "bytes", "audio", "video")}
+        daily = "\n".join(f"  {day['day']}: {day['downloads']} ({day['video']} video, {day['audio']} audio), {human_size(day['bytes'])}"
+                          for day in st["days"])
+        top = "\n".join(f"  {i}. {v['title'] or v['video_id']} — {v['downloads']}" for i, v in enumerate(st["top"], 1)) or "  none yet"
+        await message.reply_text(f"📊 Downloads: {t['downloads']} total ({t['video']} video, {t['audio']} audio), {human_size(t['bytes'])} served\n"
+                                 f"💎 Active premium users: {st['premium']}\n"
+                                 f"📅 Last {days} days: {win['downloads']} ({win['video']} video, {win['audio']} audio), {human_size(win['bytes'])}\n"
+                                 f"{daily}\n"
+                                 f"🔥 Top videos:\n{top}\n"
+                                 f"💽 Disk: {human_size(d['used'])} used (quota {quota}), {human_size(d['free'])} free, "
+                                 f"{d['active_jobs']} jobs reserving {human_size(d['reserved'])}\n"
+                                 f"🧹 Janitor: {d['removed']} removed, {human_size(d['freed'])} freed; {d['rejected']} jobs refused\n"
+                                 f"📤 Parts: {u['parts']} uploaded over {u['sessions']} sessions, {u['avg_mb_s']} MB/s avg, "
+                                 f"{u['retried']} retries, {u['failed']} failed; last {u['last_rates']} MB/s\n"
+                                 f"🎛️ Audio: {f['remuxes']} remuxed, {f['transcodes']} transcoded ({f['running']}/{f['workers']} running, "
+                                 f"{f['waiting']} waiting); cache {c['hits']} hits / {c['misses']} misses")
     except Exception as e:
         await message.reply_text(f"Error fetching stats: {e}")
 
+def _secs(s):
+    return f"{s * 1000:.0f}ms" if s < 1 else f"{s:.1f}s"
+
+@app.on_message(filters.command("perf") & filters.user(*OWNER_IDS))
+async def cmd_perf(_, message):
+    if not METRICS.enabled:
+        return await message.reply_text(S.PERF_DISABLED)
+    m = await asyncio.to_thread(METRICS.summary)
+    timers, counters, gauges = m["timers"], m["counters"], m["gauges"]
+    order = ("extract", "queue", "download", "postprocess", "ffmpeg", "split", "upload", "job")
+    stage_rows = sorted(((dict(l)["stage"], t) for (name, l), t in timers.items() if name == "stage"),
+                        key=lambda r: order.index(r[0]) if r[0] in order else len(order))
+    lines = ["⏱️ Stages: count · avg · p95 · max · errors"]
+    for stage, t in stage_rows:
+        errors = t["errors"] + counters.get(("stage_errors", (("stage", stage),)), 0)
+        lines.append(f"  {stage}: {t['count']} · {_secs(t['avg'])} · {_secs(t['p95'])} · {_secs(t['max'])} · {errors}")
+    db_rows = sorted(((dict(l), t) for (name, l), t in timers.items() if name == "db"), key=lambda r: -r[1]["avg"])
+    if db_rows:
+        lines.append(f"🗄️ DB ({db_rows[0][0]['backend']}), slowest first: calls · avg · p95 · errors")
+        lines += [f"  {l['op']}: {t['count']} · {_secs(t['avg'])} · {_secs(t['p95'])} · {t['errors']}" for l, t in db_rows[:8]]
+    down = counters.get(("bytes", (("direction", "download"),)), 0)
+    up = counters.get(("bytes", (("direction", "upload"),)), 0)
+    pu, jobs = gauges.get("progress_updates", {}), gauges.get("jobs", {})
+    lines.append(f"📦 Bytes: {human_size(down)} downloaded, {human_size(up)} uploaded")
+    lines.append(f"✏️ Progress edits: {pu.get('sent', 0)} sent, {pu.get('dropped', 0)} dropped, {pu.get('flood_wait', 0)} flood waits")
+    lines.append(f"👥 Sessions: {gauges.get('sessions', 0)}; jobs {jobs.get('running', 0)} running, {jobs.get('queued', 0)} queued")
+    await message.reply_text("\n".join(lines))
+
 # ---------------- Run ----------------
-if __name__ == "__main__":
-    app.run()
+# started from main.py; importing this module only sets things up, so spawned yt-dlp
+# workers (which re-run main.py's module body, not its __main__ block) start nothing
+async def serve():
+    await app.start()
+    try:
+        await idle()
+    finally:
+        # no new updates, then flush what is still buffered (free-quota counters, batched
+        # history and cache writes, persisted sessions) before the process exits
+        await app.stop()
+        await UPLOADERS.close()
+        await database.close()
+        SESSIONS.close()
+        if WORKERS is not None:
+            WORKERS.shutdown()
+
+def main():
+    if METRICS_ENABLED and METRICS_PORT:
+        METRICS.serve(METRICS_HOST, METRICS_PORT)
+    app.run(serve())
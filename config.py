@@ -23,11 +23,100 @@ STORAGE_CHANNEL = os.getenv("STORAGE_CHANNEL", "-1003292407667")
 MONGODB_URI = os.getenv("MONGODB_URI", "")  # if empty, will fallback
 SQLITE_DB = os.getenv("SQLITE_DB", "bot.sqlite3")
 JSON_DB = os.getenv("JSON_DB", "bot.json")
+# MongoDB (async driver): connection pool and timeouts, optional expiry of download
+# records after MONGO_HISTORY_TTL_DAYS (0 = keep), bulk insert cadence for those records
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "inert_downloader_db")
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_HISTORY_TTL_DAYS = float(os.getenv("MONGO_HISTORY_TTL_DAYS", "0"))
+MONGO_BULK_INTERVAL = float(os.getenv("MONGO_BULK_INTERVAL", "0.05"))
+MONGO_BULK_SIZE = int(os.getenv("MONGO_BULK_SIZE", "500"))
+# threads reserved for blocking storage calls (keeps DB I/O off the event loop)
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+# JSON fallback: journal compaction cadence and optional fsync per append
+JSON_COMPACT_INTERVAL = int(os.getenv("JSON_COMPACT_INTERVAL", "60"))
+JSON_COMPACT_OPS = int(os.getenv("JSON_COMPACT_OPS", "1000"))
+JSON_FSYNC = os.getenv("JSON_FSYNC", "0") == "1"
+# SQLite: download records are group-committed every SQLITE_COMMIT_INTERVAL seconds or
+# SQLITE_COMMIT_BATCH rows, whichever comes first (interval 0 = commit each record)
+SQLITE_COMMIT_INTERVAL = float(os.getenv("SQLITE_COMMIT_INTERVAL", "0.05"))
+SQLITE_COMMIT_BATCH = int(os.getenv("SQLITE_COMMIT_BATCH", "200"))
+# per-user premium/quota cache (seconds, entries)
+ENTITLEMENT_TTL = int(os.getenv("ENTITLEMENT_TTL", "300"))
+ENTITLEMENT_CACHE_SIZE = int(os.getenv("ENTITLEMENT_CACHE_SIZE", "10000"))
+# free-quota counters kept in memory and persisted in batches every QUOTA_FLUSH_INTERVAL seconds
+# (0 = one atomic storage call per download instead)
+QUOTA_WRITE_BEHIND = os.getenv("QUOTA_WRITE_BEHIND", "1") == "1"
+QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "2"))
 
 # Download folder & limits
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "downloads")
 MAX_UPLOAD_FILESIZE = int(os.getenv("MAX_UPLOAD_FILESIZE", str(1900 * 1024 * 1024)))  # ~1.9GB
 SPLIT_CHUNK_SIZE = int(os.getenv("SPLIT_CHUNK_SIZE", str(1800 * 1024 * 1024)))  # ~1.8GB per chunk
+# "virtual" uploads byte ranges of the original file, "copy" writes part files first
+SPLIT_MODE = os.getenv("SPLIT_MODE", "virtual")
+
+# Split uploads: extra bot sessions for parallel part uploads, parts in flight at once, retries per part
+UPLOAD_SESSIONS = int(os.getenv("UPLOAD_SESSIONS", "2"))
+UPLOAD_PARALLEL = int(os.getenv("UPLOAD_PARALLEL", "3"))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "3"))
+
+# Disk: each download gets its own directory under DOWNLOAD_DIR. Jobs are admitted only if
+# free space (minus DISK_MIN_FREE) and DISK_QUOTA (bytes used by DOWNLOAD_DIR, 0 = no quota)
+# leave room for them; the janitor removes orphaned job dirs and stale .part files
+DISK_QUOTA = int(os.getenv("DISK_QUOTA", "0"))
+DISK_MIN_FREE = int(os.getenv("DISK_MIN_FREE", str(1024 * 1024 * 1024)))
+DISK_DEFAULT_RESERVE = int(os.getenv("DISK_DEFAULT_RESERVE", str(512 * 1024 * 1024)))  # when the size is unknown
+DISK_JANITOR_INTERVAL = int(os.getenv("DISK_JANITOR_INTERVAL", "300"))
+DISK_ORPHAN_AGE = int(os.getenv("DISK_ORPHAN_AGE", "3600"))
+DISK_PART_AGE = int(os.getenv("DISK_PART_AGE", str(6 * 3600)))
+
+# yt-dlp info cache: signed format URLs expire after ~6h, entries are also capped by their expire= param
+META_CACHE_DB = os.getenv("META_CACHE_DB", "meta_cache.sqlite3")
+META_CACHE_TTL = int(os.getenv("META_CACHE_TTL", str(3 * 3600)))
+META_CACHE_SIZE = int(os.getenv("META_CACHE_SIZE", "512"))
+
+# Download scheduler: global cap, per-user running/queued caps and slots kept free for Gold/Platinum
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "4"))
+PER_USER_DOWNLOADS = int(os.getenv("PER_USER_DOWNLOADS", "1"))
+MAX_QUEUED_PER_USER = int(os.getenv("MAX_QUEUED_PER_USER", "3"))
+PRIORITY_RESERVED_SLOTS = int(os.getenv("PRIORITY_RESERVED_SLOTS", "1"))
+# yt-dlp worker processes (0 = run in threads inside the bot) and tasks before a worker is replaced
+YTDLP_WORKERS = int(os.getenv("YTDLP_WORKERS", "4"))
+YTDLP_WORKER_MAX_TASKS = int(os.getenv("YTDLP_WORKER_MAX_TASKS", "50"))
+
+# Segmented download engine: parallel range requests per stream by plan (the "faster downloads"
+# perk), 1 = yt-dlp's own single-connection downloader; bytes per range request
+DL_CONNECTIONS_FREE = int(os.getenv("DL_CONNECTIONS_FREE", "1"))
+DL_CONNECTIONS_SILVER = int(os.getenv("DL_CONNECTIONS_SILVER", "4"))
+DL_CONNECTIONS_GOLD = int(os.getenv("DL_CONNECTIONS_GOLD", "8"))
+DL_CONNECTIONS_PLATINUM = int(os.getenv("DL_CONNECTIONS_PLATINUM", "8"))
+DL_SEGMENT_SIZE = int(os.getenv("DL_SEGMENT_SIZE", str(10 * 1024 * 1024)))
+
+# Audio: source codecs sent as they are (remuxed, no re-encode; others become mp3),
+# concurrent ffmpeg re-encodes, and a cache of converted tracks (bytes, 0 = off)
+AUDIO_REMUX_CODECS = tuple(c.strip() for c in os.getenv("AUDIO_REMUX_CODECS", "mp4a,mp3").split(",") if c.strip())
+FFMPEG_WORKERS = int(os.getenv("FFMPEG_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+TRANSCODE_CACHE_DIR = os.getenv("TRANSCODE_CACHE_DIR", "transcode_cache")
+TRANSCODE_CACHE_SIZE = int(os.getenv("TRANSCODE_CACHE_SIZE", str(2 * 1024 * 1024 * 1024)))
+
+# Sessions: TTL for inline-button sessions, how long a rename prompt waits, memory cap,
+# and an optional SQLite file so buttons survive restarts
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+RENAME_TTL = int(os.getenv("RENAME_TTL", "900"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "20000"))
+SESSION_DB = os.getenv("SESSION_DB", "")
+
+# seconds between progress edits per chat (raised automatically on FloodWait)
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "1.5"))
+
+# Instrumentation (/perf); METRICS_PORT > 0 also serves Prometheus text on METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
 # Free user daily limit (adjustable)
 FREE_DAILY_LIMIT = int(os.getenv("FREE_DAILY_LIMIT", "2"))
@@ -1,248 +1,188 @@
 # database.py
-import os, json, time, datetime
-from config import MONGODB_URI, SQLITE_DB, JSON_DB
+import asyncio, functools
+from concurrent.futures import ThreadPoolExecutor
+from config import MONGODB_URI, SQLITE_DB, SQLITE_COMMIT_INTERVAL, SQLITE_COMMIT_BATCH, JSON_DB, DB_WORKERS, JSON_COMPACT_INTERVAL, JSON_COMPACT_OPS, JSON_FSYNC, \
+    ENTITLEMENT_TTL, ENTITLEMENT_CACHE_SIZE, QUOTA_WRITE_BEHIND, QUOTA_FLUSH_INTERVAL, MONGO_DB_NAME, MONGO_POOL_SIZE, \
+    MONGO_MIN_POOL_SIZE, MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_HISTORY_TTL_DAYS, \
+    MONGO_BULK_INTERVAL, MONGO_BULK_SIZE
+from storage.cache import EntitlementCache, QuotaLimiter
+from functions.metrics import METRICS
 
 USE_MONGO = False
 USE_SQLITE = False
 USE_JSON = False
 
-# Try MongoDB (pymongo)
+backend = None
+
+# Try MongoDB (motor)
 if MONGODB_URI:
     try:
-        from pymongo import MongoClient
-        client = MongoClient(MONGODB_URI)
-        db = client.get_database("inert_downloader_db")
-        users_coll = db.get_collection("users")
-        downloads_coll = db.get_collection("downloads")
+        from storage.mongo import MongoStorage
+        backend = MongoStorage(MONGODB_URI, MONGO_DB_NAME, MONGO_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_CONNECT_TIMEOUT_MS,
+                               MONGO_SERVER_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_HISTORY_TTL_DAYS,
+                               MONGO_BULK_INTERVAL, MONGO_BULK_SIZE)
         USE_MONGO = True
     except Exception:
-        USE_MONGO = False
+        backend = None
 
 # Try SQLite
-if not USE_MONGO:
+if backend is None:
     try:
-        import sqlite3
-        conn = sqlite3.connect(SQLITE_DB, check_same_thread=False)
-        cur = conn.cursor()
-        # init tables
-        cur.execute("""CREATE TABLE IF NOT EXISTS users (
-                        user_id INTEGER PRIMARY KEY,
-                        premium_until TEXT,
-                        plan TEXT,
-                        daily_count INTEGER DEFAULT 0,
-                        last_reset INTEGER DEFAULT 0
-                    )""")
-        cur.execute("""CREATE TABLE IF NOT EXISTS downloads (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        title TEXT,
-                        filepath TEXT,
-                        filesize INTEGER,
-                        created_at TEXT
-                    )""")
-        conn.commit()
+        from storage.sqlite import SQLiteStorage
+        backend = SQLiteStorage(SQLITE_DB, SQLITE_COMMIT_INTERVAL, SQLITE_COMMIT_BATCH)
         USE_SQLITE = True
     except Exception:
-        USE_SQLITE = False
+        backend = None
 
 # Fallback to JSON
-if not USE_MONGO and not USE_SQLITE:
+if backend is None:
+    from storage.jsondb import JSONStorage
+    backend = JSONStorage(JSON_DB, JSON_COMPACT_INTERVAL, JSON_COMPACT_OPS, JSON_FSYNC)
     USE_JSON = True
-    if not os.path.exists(JSON_DB):
-        with open(JSON_DB, "w") as f:
-            json.dump({"users":{}, "downloads":[]}, f, indent=2)
 
-def now_ts():
-    return int(time.time())
+# Storage calls get their own small pool so a slow Mongo round trip or SQLite
+# commit never blocks the event loop or queues behind yt-dlp jobs.
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
 
-# ------------ Downloads record ------------
-def add_download_record(user_id, title, filepath, filesize):
-    created = datetime.datetime.utcnow().isoformat()
-    if USE_MONGO:
-        downloads_coll.insert_one({"user_id": user_id, "title": title, "filepath": filepath, "filesize": filesize, "created_at": created})
-    elif USE_SQLITE:
-        cur.execute("INSERT INTO downloads (user_id,title,filepath,filesize,created_at) VALUES (?,?,?,?,?)",
-                    (user_id, title, filepath, filesize, created))
-        conn.commit()
+# latency per backend call, executor queueing included (bot_db_seconds{backend,op})
+async def _run(fn, *args):
+    with METRICS.timer("db", backend=backend.name, op=fn.__name__):
+        if backend.is_async:
+            # native coroutines run on the loop itself
+            await _start()
+            return await fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(fn, *args))
+
+# An async backend is started (indexes, background writers) by the first call;
+# a failed start is retried by the next one
+_loop = None
+_started = None
+
+async def _start():
+    global _loop, _started
+    if _started is None or (_started.done() and (_started.cancelled() or _started.exception() is not None)):
+        _loop = asyncio.get_running_loop()
+        _started = asyncio.ensure_future(backend.start())
+    await asyncio.shield(_started)
+
+# runs on the limiter's own thread, so an async backend's write goes back to the loop
+def _flush_quota(items):
+    if backend.is_async:
+        asyncio.run_coroutine_threadsafe(backend.record_quota_batch(items), _loop).result(60)
     else:
-        with open(JSON_DB, "r+") as f:
-            data = json.load(f)
-            data["downloads"].append({"user_id":user_id,"title":title,"filepath":filepath,"filesize":filesize,"created_at":created})
-            f.seek(0); f.truncate(); json.dump(data, f, indent=2)
+        backend.record_quota_batch(items)
+
+# Premium expiry / plan / quota per user, so the callback hot path does no I/O
+entitlements = EntitlementCache(ENTITLEMENT_TTL, ENTITLEMENT_CACHE_SIZE)
+
+# Free-quota counters in memory with batched write-behind (QUOTA_WRITE_BEHIND=1);
+# otherwise every consume is one atomic backend call
+quota = QuotaLimiter(_flush_quota, QUOTA_FLUSH_INTERVAL) if QUOTA_WRITE_BEHIND else None
+
+async def get_entitlement(user_id):
+    e = entitlements.get(user_id)
+    if e is None:
+        e = entitlements.put(user_id, await _run(backend.user_info, user_id))
+    return e
+
+# ------------ Downloads record ------------
+async def add_download_record(user_id, title, filepath, filesize, kind=None, video_id=None):
+    return await _run(backend.add_download_record, user_id, title, filepath, filesize, kind, video_id)
+
+async def count_downloads():
+    return await _run(backend.count_downloads)
+
+# materialized counters: totals, the last `days` days, top videos, active premium users
+async def get_stats(days=7, top=5):
+    return await _run(backend.stats, days, top)
+
+# ------------ Telegram file cache ------------
+async def get_cached_file(video_id, format_id, kind, rename=None):
+    if not video_id:
+        return None
+    return await _run(backend.get_cached_file, video_id, format_id, kind, rename)
+
+async def put_cached_file(video_id, format_id, kind, rename=None, file_id=None, chat_id=None, message_id=None, filesize=0):
+    return await _run(backend.put_cached_file, video_id, format_id, kind, rename, file_id, chat_id, message_id, filesize)
+
+async def invalidate_cached_file(video_id, format_id, kind, rename=None):
+    if not video_id:
+        return
+    return await _run(backend.invalidate_cached_file, video_id, format_id, kind, rename)
 
 # ------------ Premium ------------
-def add_premium(user_id, days, plan="Gold"):
-    until = (datetime.datetime.utcnow() + datetime.timedelta(days=int(days))).isoformat()
-    if USE_MONGO:
-        users_coll.update_one({"user_id": user_id}, {"$set": {"premium_until": until, "plan": plan, "daily_count":0, "last_reset": now_ts()}}, upsert=True)
-    elif USE_SQLITE:
-        cur.execute("INSERT OR REPLACE INTO users (user_id,premium_until,plan,last_reset,daily_count) VALUES (?,?,?,?,?)",
-                    (user_id, until, plan, now_ts(), 0))
-        conn.commit()
-    else:
-        with open(JSON_DB, "r+") as f:
-            data = json.load(f)
-            u = data["users"].get(str(user_id), {})
-            u["premium_until"] = until
-            u["plan"] = plan
-            u["daily_count"] = 0
-            u["last_reset"] = now_ts()
-            data["users"][str(user_id)] = u
-            f.seek(0); f.truncate(); json.dump(data, f, indent=2)
-
-def remove_premium(user_id):
-    if USE_MONGO:
-        users_coll.update_one({"user_id": user_id}, {"$unset": {"premium_until": "", "plan": ""}})
-    elif USE_SQLITE:
-        cur.execute("UPDATE users SET premium_until=NULL, plan=NULL WHERE user_id=?", (user_id,))
-        conn.commit()
-    else:
-        with open(JSON_DB, "r+") as f:
-            data = json.load(f)
-            u = data["users"].get(str(user_id), {})
-            u.pop("premium_until", None)
-            u.pop("plan", None)
-            data["users"][str(user_id)] = u
-            f.seek(0); f.truncate(); json.dump(data, f, indent=2)
-
-def premium_info(user_id):
-    if USE_MONGO:
-        u = users_coll.find_one({"user_id": user_id}) or {}
-        return u.get("premium_until"), u.get("plan")
-    elif USE_SQLITE:
-        cur.execute("SELECT premium_until, plan FROM users WHERE user_id=?", (user_id,))
-        r = cur.fetchone()
-        return (r[0], r[1]) if r else (None, None)
-    else:
-        with open(JSON_DB, "r") as f:
-            data = json.load(f)
-        u = data["users"].get(str(user_id), {})
-        return u.get("premium_until"), u.get("plan")
-
-def is_premium(user_id):
-    now = datetime.datetime.utcnow()
-    if USE_MONGO:
-        u = users_coll.find_one({"user_id": user_id}) or {}
-        until = u.get("premium_until")
-        if not until: return False
-        try:
-            return datetime.datetime.fromisoformat(until) > now
-        except:
-            return False
-    elif USE_SQLITE:
-        cur.execute("SELECT premium_until FROM users WHERE user_id=?", (user_id,))
-        r = cur.fetchone()
-        if not r or not r[0]:
-            return False
-        try:
-            return datetime.datetime.fromisoformat(r[0]) > now
-        except:
-            return False
-    else:
-        with open(JSON_DB, "r") as f:
-            data = json.load(f)
-        u = data["users"].get(str(user_id), {})
-        until = u.get("premium_until")
-        if not until: return False
-        try:
-            return datetime.datetime.fromisoformat(until) > now
-        except:
-            return False
-
-def get_remaining_days(user_id):
-    if USE_MONGO:
-        u = users_coll.find_one({"user_id": user_id}) or {}
-        until = u.get("premium_until")
-        if not until: return 0
-        try:
-            delta = datetime.datetime.fromisoformat(until) - datetime.datetime.utcnow()
-            return max(0, delta.days)
-        except:
-            return 0
-    elif USE_SQLITE:
-        cur.execute("SELECT premium_until FROM users WHERE user_id=?", (user_id,))
-        r = cur.fetchone()
-        if not r or not r[0]:
-            return 0
-        try:
-            delta = datetime.datetime.fromisoformat(r[0]) - datetime.datetime.utcnow()
-            return max(0, delta.days)
-        except:
-            return 0
-    else:
-        with open(JSON_DB, "r") as f:
-            data = json.load(f)
-        u = data["users"].get(str(user_id), {})
-        until = u.get("premium_until")
-        if not until: return 0
-        try:
-            delta = datetime.datetime.fromisoformat(until) - datetime.datetime.utcnow()
-            return max(0, delta.days)
-        except:
-            return 0
+async def add_premium(user_id, days, plan="Gold"):
+    try:
+        return await _run(backend.add_premium, user_id, days, plan)
+    finally:
+        entitlements.invalidate(user_id)
+        if quota is not None:
+            quota.forget(user_id)
+
+async def remove_premium(user_id):
+    try:
+        return await _run(backend.remove_premium, user_id)
+    finally:
+        entitlements.invalidate(user_id)
+        if quota is not None:
+            quota.forget(user_id)
+
+async def premium_info(user_id):
+    return await _run(backend.premium_info, user_id)
+
+async def is_premium(user_id):
+    return (await get_entitlement(user_id)).is_premium()
+
+async def get_plan(user_id):
+    e = await get_entitlement(user_id)
+    return e.plan if e.is_premium() else None
+
+async def get_remaining_days(user_id):
+    return (await get_entitlement(user_id)).remaining_days()
 
 # ------------ Daily free limit ------------
-def can_download_free(user_id, free_limit):
-    ts = now_ts()
-    if USE_MONGO:
-        u = users_coll.find_one({"user_id": user_id}) or {}
-        last_reset = u.get("last_reset", 0)
-        daily_count = u.get("daily_count", 0)
-        if ts - last_reset > 86400:
-            users_coll.update_one({"user_id": user_id}, {"$set": {"daily_count": 0, "last_reset": ts}}, upsert=True)
-            daily_count = 0
-        return daily_count < free_limit
-    elif USE_SQLITE:
-        cur.execute("SELECT daily_count,last_reset FROM users WHERE user_id=?", (user_id,))
-        r = cur.fetchone()
-        if not r:
-            cur.execute("INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)", (user_id,0,ts))
-            conn.commit()
-            return 0 < free_limit
-        daily_count, last_reset = r
-        if ts - last_reset > 86400:
-            cur.execute("UPDATE users SET daily_count=0,last_reset=? WHERE user_id=?", (ts,user_id))
-            conn.commit()
-            daily_count = 0
-        return daily_count < free_limit
+async def can_download_free(user_id, free_limit):
+    # an expired window counts as zero; consuming starts the new one
+    if quota is not None:
+        ok = quota.peek(user_id, free_limit)
+        if ok is not None:
+            return ok
+    return (await get_entitlement(user_id)).can_download_free(free_limit)
+
+# Check and consume one free download atomically -> allowed
+async def try_consume_quota(user_id, free_limit):
+    if quota is not None:
+        if not quota.known(user_id):
+            e = await get_entitlement(user_id)
+            quota.seed(user_id, e.daily_count, e.last_reset)
+        allowed, daily_count, last_reset = quota.try_consume(user_id, free_limit)
     else:
-        with open(JSON_DB, "r+") as f:
-            data = json.load(f)
-            u = data["users"].get(str(user_id), {"daily_count":0,"last_reset":0})
-            if ts - u.get("last_reset",0) > 86400:
-                u["daily_count"] = 0
-                u["last_reset"] = ts
-            allowed = u.get("daily_count",0) < free_limit
-            # save
-            data["users"][str(user_id)] = u
-            f.seek(0); f.truncate()
-            json.dump(data, f, indent=2)
-            return allowed
-
-def increment_daily_count(user_id):
-    ts = now_ts()
-    if USE_MONGO:
-        users_coll.update_one({"user_id": user_id}, {"$inc": {"daily_count":1}, "$set": {"last_reset": ts}}, upsert=True)
-    elif USE_SQLITE:
-        cur.execute("SELECT daily_count,last_reset FROM users WHERE user_id=?", (user_id,))
-        r = cur.fetchone()
-        if not r:
-            cur.execute("INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)", (user_id,1,ts))
-        else:
-            daily_count, last_reset = r
-            if ts - last_reset > 86400:
-                cur.execute("UPDATE users SET daily_count=1,last_reset=? WHERE user_id=?", (ts,user_id))
-            else:
-                cur.execute("UPDATE users SET daily_count=daily_count+1 WHERE user_id=?", (user_id,))
-        conn.commit()
+        try:
+            allowed, daily_count, last_reset = await _run(backend.try_consume_quota, user_id, free_limit)
+        except Exception:
+            entitlements.invalidate(user_id)
+            raise
+    entitlements.update_quota(user_id, daily_count, last_reset)
+    return allowed
+
+async def increment_daily_count(user_id):
+    if quota is not None:
+        return await try_consume_quota(user_id, float("inf"))
+    try:
+        daily_count, last_reset = await _run(backend.increment_daily_count, user_id)
+    except Exception:
+        entitlements.invalidate(user_id)
+        raise
+    entitlements.update_quota(user_id, daily_count, last_reset)
+
+async def close():
+    loop = asyncio.get_running_loop()
+    if quota is not None:
+        # its final flush may need this loop, so it can't block it
+        await loop.run_in_executor(None, quota.close)
+    _executor.shutdown(wait=True)
+    if backend.is_async:
+        await backend.close()
     else:
-        with open(JSON_DB, "r+") as f:
-            data = json.load(f)
-            u = data["users"].get(str(user_id), {"daily_count":0,"last_reset":0})
-            if ts - u.get("last_reset",0) > 86400:
-                u["daily_count"] = 1
-                u["last_reset"] = ts
-            else:
-                u["daily_count"] = u.get("daily_count",0) + 1
-            data["users"][str(user_id)] = u
-            f.seek(0); f.truncate(); json.dump(data, f, indent=2)
+        backend.close()
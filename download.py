@@ -1,13 +1,56 @@
 # download.py
-import os, uuid, asyncio, subprocess
+import os, io, copy, time, asyncio
 from yt_dlp import YoutubeDL
-from yt_dlp.utils import DownloadError
-from config import YTDLP_OPTS_BASE, DOWNLOAD_DIR, SPLIT_CHUNK_SIZE
-from functions.utils import human_size
+from concurrent.futures import ThreadPoolExecutor
+from yt_dlp.utils import DownloadError, DownloadCancelled
+from config import YTDLP_OPTS_BASE, DOWNLOAD_DIR, SPLIT_CHUNK_SIZE, META_CACHE_DB, META_CACHE_TTL, META_CACHE_SIZE, MAX_CONCURRENT_DOWNLOADS
+from config import YTDLP_WORKERS, YTDLP_WORKER_MAX_TASKS, DL_SEGMENT_SIZE
+from config import AUDIO_REMUX_CODECS, FFMPEG_WORKERS, TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_SIZE
+from functions.utils import human_size, extract_video_id
+from functions.meta_cache import MetaCache
+from functions.planner import plan_video, plan_audio
+from functions.workers import WorkerPool
+from functions.engine import segmented_download
+from functions.ffmpeg import FFmpegPool, TranscodeCache
+from functions.metrics import METRICS
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-def list_video_qualities(info):
+# yt-dlp runs in worker processes (YTDLP_WORKERS > 0) so its GIL-heavy Python
+# code can't starve the event loop; with 0 it falls back to a thread pool sized
+# to the scheduler's cap. Workers are spawned lazily, on first use.
+WORKERS = WorkerPool(YTDLP_WORKERS, YTDLP_WORKER_MAX_TASKS) if YTDLP_WORKERS > 0 else None
+_download_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="ytdlp")
+
+async def run_ytdlp(fn, *args, on_event=None, cancel_event=None):
+    if WORKERS is not None:
+        return await WORKERS.run(fn, *args, on_event=on_event)
+    loop = asyncio.get_running_loop()
+    is_cancelled = cancel_event.is_set if cancel_event is not None else None
+    return await loop.run_in_executor(_download_executor, lambda: fn(*args, on_progress=on_event, is_cancelled=is_cancelled))
+
+# Extracted info per video id, shared by every user who pastes the same link
+META_CACHE = MetaCache(META_CACHE_DB, META_CACHE_TTL, META_CACHE_SIZE)
+
+def extract_info_blocking(url, on_progress=None, is_cancelled=None):
+    with YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
+        # sanitize so the dict is JSON-safe for the cache and can be fed back to process_ie_result
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+# Info for a link, from the cache when the same video was seen recently
+async def fetch_info(url):
+    vid = extract_video_id(url)
+    if vid:
+        info = await META_CACHE.aget(vid)
+        if info is not None:
+            return info
+    info = await run_ytdlp(extract_info_blocking, url)
+    # only a YouTube extraction of that very video (not a redirect, playlist or other site)
+    if vid and info.get("extractor_key") == "Youtube" and info.get("id") == vid:
+        info = await META_CACHE.aput(vid, info)
+    return info
+
+def list_video_qualities(info, with_sizes=False):
     formats = info.get("formats", []) or []
     video_formats = []
     for f in formats:
@@ -22,9 +65,11 @@ def list_video_qualities(info):
         if key not in dedup or (v["filesize"] and v["filesize"] < dedup[key]["filesize"]):
             dedup[key] = v
     sorted_list = sorted(dedup.values(), key=lambda x: (x["height"] if isinstance(x["height"], int) else 0))
+    if with_sizes:
+        return [(x["label"], x["format_id"], x["filesize"]) for x in sorted_list]
     return [(x["label"], x["format_id"]) for x in sorted_list]
 
-def list_audio_qualities(info):
+def list_audio_qualities(info, with_sizes=False):
     formats = info.get("formats", []) or []
     audio_formats = []
     for f in formats:
@@ -38,67 +83,330 @@ def list_audio_qualities(info):
         if key not in dedup or (a["filesize"] and a["filesize"] < dedup[key]["filesize"]):
             dedup[key] = a
     sorted_list = sorted(dedup.values(), key=lambda x: (x["abr"] if isinstance(x["abr"], (int,float)) else 0))
+    if with_sizes:
+        return [(x["label"], x["format_id"], x["filesize"]) for x in sorted_list]
     return [(x["label"], x["format_id"]) for x in sorted_list]
 
-# Progress hook generator that calls an async callback
-def make_progress_hook(async_update_cb, session_id):
-    loop = asyncio.get_event_loop()
+# What the bot keeps per link instead of the raw info dict (every format with
+# signed URLs and headers, subtitles, thumbnails... often hundreds of KB).
+# Built once per link; plain slots so sessions can pickle it.
+class VideoMeta:
+    __slots__ = ("id", "title", "uploader", "duration", "views", "upload_date", "description",
+                 "thumbnail", "url", "video_qualities", "audio_qualities")
+
+    def __init__(self, id, title, uploader, duration, views, upload_date, description, thumbnail, url,
+                 video_qualities, audio_qualities):
+        self.id = id
+        self.title = title
+        self.uploader = uploader
+        self.duration = duration
+        self.views = views
+        self.upload_date = upload_date
+        self.description = description
+        self.thumbnail = thumbnail
+        self.url = url
+        self.video_qualities = video_qualities    # ((label, format_spec, estimated_size), ...) lowest first
+        self.audio_qualities = audio_qualities
+
+    @classmethod
+    def from_info(cls, info):
+        return cls(info.get("id"), info.get("title") or "Unknown", info.get("uploader") or "Unknown",
+                   info.get("duration") or 0, info.get("view_count") or 0, info.get("upload_date") or "",
+                   (info.get("description") or "")[:800], info.get("thumbnail"),
+                   info.get("webpage_url") or info.get("original_url"),
+                   tuple(plan_video(info, list_video_qualities(info, with_sizes=True))),
+                   tuple(plan_audio(info, list_audio_qualities(info, with_sizes=True), AUDIO_MP3_KBPS, AUDIO_REMUX_CODECS)))
+
+# yt-dlp progress hook -> on_progress(kind, payload) events; runs in the worker
+# (process or thread), so payloads are plain picklable dicts
+def make_progress_hook(on_progress, is_cancelled=None):
     def _hook(d):
+        if is_cancelled is not None and is_cancelled():
+            raise DownloadCancelled("cancelled by user")
+        if on_progress is None:
+            return
         status = d.get("status")
         if status == "downloading":
-            per = d.get("_percent_str","").strip()
-            speed = d.get("_speed_str","") or ""
-            downloaded = d.get("downloaded_bytes") or 0
-            total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
-            eta = d.get("eta")
-            text = (f"📥 Downloading: {per}\n⬇️ Speed: {speed}\n📦 {human_size(downloaded)} / {human_size(total)}\n⏱️ ETA: {eta}s")
-            loop.call_soon_threadsafe(asyncio.ensure_future, async_update_cb(session_id, text))
+            on_progress("downloading", {"percent": d.get("_percent_str","").strip(), "speed": d.get("_speed_str","") or "",
+                                        "downloaded": d.get("downloaded_bytes") or 0,
+                                        "total": d.get("total_bytes") or d.get("total_bytes_estimate") or 0,
+                                        "eta": d.get("eta")})
         elif status == "finished":
-            loop.call_soon_threadsafe(asyncio.ensure_future, async_update_cb(session_id, "✅ Download finished, preparing upload..."))
+            on_progress("finished", None)
     return _hook
 
+def progress_text(kind, p):
+    if kind == "finished":
+        return "✅ Download finished, preparing upload..."
+    if kind == "converting":
+        return "🎛️ Converting audio..."
+    return (f"📥 Downloading: {p['percent']}\n⬇️ Speed: {p['speed']}\n📦 {human_size(p['downloaded'])} / {human_size(p['total'])}\n⏱️ ETA: {p['eta']}s")
+
+# Audio: sources in a codec Telegram plays (AUDIO_REMUX_CODECS) are remuxed as they are;
+# anything else is transcoded to mp3 at AUDIO_MP3_KBPS (also what the planner estimates with)
+AUDIO_MP3_KBPS = 192
+AUDIO_CONTAINERS = {"mp4a": "m4a", "mp3": "mp3", "opus": "ogg", "vorbis": "ogg", "flac": "flac"}
+
+# Runs ffmpeg for audio outside the yt-dlp workers; re-encodes are capped at FFMPEG_WORKERS
+FFMPEG = FFmpegPool(FFMPEG_WORKERS)
+TRANSCODES = TranscodeCache(TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_SIZE)
+
+# -> (codec, ext, kbps, remux) for a source acodec such as "mp4a.40.2" or "opus"
+def audio_target(acodec):
+    codec = (acodec or "").split(".")[0]
+    if codec in AUDIO_REMUX_CODECS and codec in AUDIO_CONTAINERS:
+        return codec, AUDIO_CONTAINERS[codec], 0, True
+    return "mp3", "mp3", AUDIO_MP3_KBPS, False
+
+# Download engine: yt-dlp calls dl() once per file it fetches (each stream of a
+# merge included). With connections > 1, plain http(s) streams are fetched by
+# the segmented engine (functions/engine.py: parallel range requests over pooled
+# keep-alive connections); manifests (HLS/DASH fragments), live streams and any
+# segmented failure go through yt-dlp's own downloaders. Merging and
+# postprocessing stay with yt-dlp either way.
+class EngineYDL(YoutubeDL):
+    def __init__(self, params=None, connections=1, segment_size=DL_SEGMENT_SIZE):
+        super().__init__(params)
+        self.connections = connections
+        self.segment_size = segment_size
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if subtitle or test or self.connections <= 1 or name == "-" or info.get("protocol") not in ("http", "https"):
+            return super().dl(name, info, subtitle, test)
+        try:
+            self._segmented(name, info)
+        except DownloadCancelled:
+            raise
+        except Exception as e:
+            self.report_warning(f"segmented download failed ({e}); using the default downloader")
+            return super().dl(name, info, subtitle, test)
+        return True, True
+
+    def _segmented(self, name, info):
+        tmp = name + ".part"
+        started = time.monotonic()
+        def progress(done, total):
+            elapsed = max(time.monotonic() - started, 1e-6)
+            speed = done / elapsed
+            self._hooks({"status": "downloading", "downloaded_bytes": done, "total_bytes": total,
+                         "tmpfilename": tmp, "filename": name, "speed": speed, "elapsed": elapsed,
+                         "eta": int((total - done) / speed) if total and speed else None,
+                         "_percent_str": f"{done * 100 / total:.1f}%" if total else "",
+                         "_speed_str": f"{human_size(speed)}/s", "info_dict": info})
+        total = segmented_download(info["url"], tmp, info.get("http_headers"), self.connections,
+                                   self.segment_size, progress)
+        os.replace(tmp, name)
+        self._hooks({"status": "finished", "downloaded_bytes": total, "total_bytes": total,
+                     "filename": name, "elapsed": time.monotonic() - started, "info_dict": info})
+
+    def _hooks(self, d):
+        for hook in self._progress_hooks:
+            hook(d)
+
 # Blocking function to run in executor (safe)
-def download_blocking(url, format_id, is_audio, async_update_cb):
-    outtmpl = os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s")
+# When info is given (from fetch_info) yt-dlp skips the second extraction and
+# downloads straight from the already-resolved formats.
+# connections: parallel range requests per stream (by plan, see config.DL_CONNECTIONS_*)
+def download_blocking(url, format_id, is_audio, info=None, workdir=None, connections=1,
+                      on_progress=None, is_cancelled=None):
+    # workdir: the job's own directory (see functions/disk.py); id + format in the name as well
+    outtmpl = os.path.join(workdir or DOWNLOAD_DIR, "%(title).150B [%(id)s-%(format_id)s].%(ext)s")
     opts = dict(YTDLP_OPTS_BASE)
-    opts.update({"format": format_id, "outtmpl": outtmpl, "progress_hooks":[make_progress_hook(async_update_cb, str(uuid.uuid4()))]})
-    if is_audio:
-        opts.update({"postprocessors":[{"key":"FFmpegExtractAudio","preferredcodec":"mp3","preferredquality":"192"}]})
-    with YoutubeDL(opts) as ydl:
-        info = ydl.extract_info(url, download=True)
+    # the last stream's "finished" splits the job into download and yt-dlp's own postprocessing
+    started = time.monotonic()
+    marks = {}
+    def _mark(d):
+        if d.get("status") == "finished":
+            marks["downloaded"] = time.monotonic()
+    opts.update({"format": format_id, "outtmpl": outtmpl, "progress_hooks":[make_progress_hook(on_progress, is_cancelled), _mark]})
+    with EngineYDL(opts, connections) as ydl:
+        info, stale = _download_info(ydl, url, info)
         filename = ydl.prepare_filename(info)
-        if is_audio and opts.get("postprocessors"):
-            base, _ = os.path.splitext(filename)
-            filename = base + ".mp3"
         size = os.path.getsize(filename) if os.path.exists(filename) else 0
-        return {"filepath": filename, "title": info.get("title"), "filesize": size}
+        done = time.monotonic()
+        downloaded = marks.get("downloaded", done)
+        # audio is converted afterwards by prepare_audio, which needs the source codec;
+        # timings and a stale cached extraction go back to the parent process, where the
+        # metrics and META_CACHE live
+        return {"filepath": filename, "title": info.get("title"), "filesize": size, "acodec": info.get("acodec"),
+                "timings": {"download": downloaded - started, "postprocess": done - downloaded}, "stale_info": stale}
 
-# Async wrapper to run safely in thread
-async def download_and_prepare(url, format_id, is_audio, async_update_cb):
-    return await asyncio.to_thread(download_blocking, url, format_id, is_audio, async_update_cb)
+# -> (info, id of the given info if it turned out stale)
+def _download_info(ydl, url, info):
+    if info is not None:
+        try:
+            return ydl.process_ie_result(copy.deepcopy(info), download=True), None
+        except DownloadError:
+            # signed format URLs expired or were revoked; fall back to a fresh extraction
+            return ydl.extract_info(url, download=True), info.get("id")
+    return ydl.extract_info(url, download=True), None
 
-# Splitting helper
-def split_file(filepath, chunk_size=SPLIT_CHUNK_SIZE):
+# Async wrapper: runs in a worker. on_progress(kind, payload) is called from a
+# worker/listener thread for every event and must be thread-safe and cheap.
+# Without info, the cached extraction of the url's video is reused when still valid.
+async def download_and_prepare(url, format_id, is_audio, on_progress=None, info=None, cancel_event=None, workdir=None,
+                               connections=1):
+    if info is None:
+        vid = extract_video_id(url)
+        if vid:
+            info = await META_CACHE.aget(vid)
+    if is_audio:
+        return await prepare_audio(url, format_id, on_progress, info, cancel_event, workdir, connections)
+    return await _timed_download(url, format_id, is_audio, info, workdir, connections, on_progress, cancel_event)
+
+async def _timed_download(url, format_id, is_audio, info, workdir, connections, on_progress, cancel_event):
+    try:
+        res = await run_ytdlp(download_blocking, url, format_id, is_audio, info, workdir, connections,
+                              on_event=on_progress, cancel_event=cancel_event)
+    except Exception as e:
+        if not isinstance(e, DownloadCancelled):
+            METRICS.inc("stage_errors", stage="download")
+        raise
+    stale = res.pop("stale_info", None)
+    if stale:
+        await asyncio.to_thread(META_CACHE.invalidate, stale)
+    for stage, seconds in res.pop("timings", {}).items():
+        METRICS.observe("stage", seconds, stage=stage)
+    METRICS.inc("bytes", res.get("filesize") or 0, direction="download")
+    return res
+
+# Audio pipeline: the transcode cache first (when the source codec is known up
+# front), else download the stream as is, then remux or transcode it in FFMPEG
+# and keep the result in the cache by (video_id, format, codec, bitrate).
+async def prepare_audio(url, format_id, on_progress=None, info=None, cancel_event=None, workdir=None, connections=1):
+    vid = (info or {}).get("id") or extract_video_id(url)
+    workdir = workdir or DOWNLOAD_DIR
+    src_fmt = next((f for f in (info or {}).get("formats") or [] if f.get("format_id") == format_id), None)
+    if src_fmt is not None:
+        codec, ext, kbps, _ = audio_target(src_fmt.get("acodec"))
+        dest = os.path.join(workdir, f"{vid}-{format_id}.{ext}")
+        if await asyncio.to_thread(TRANSCODES.get, (vid, format_id, codec, kbps), ext, dest):
+            return {"filepath": dest, "title": info.get("title"), "filesize": os.path.getsize(dest)}
+    res = await _timed_download(url, format_id, True, info, workdir, connections, on_progress, cancel_event)
+    codec, ext, kbps, remux = audio_target(res.get("acodec"))
+    src = res["filepath"]
+    base = os.path.splitext(src)[0]
+    tmp = f"{base}.tmp.{ext}"
+    if on_progress is not None:
+        on_progress("converting", None)
+    if remux:
+        args = ["-i", src, "-vn", "-c:a", "copy"] + (["-movflags", "+faststart"] if ext == "m4a" else []) + [tmp]
+    else:
+        args = ["-i", src, "-vn", "-c:a", "libmp3lame", "-b:a", f"{kbps}k", tmp]
+    with METRICS.stage("ffmpeg"):
+        await FFMPEG.run(args, cpu=not remux)
+    os.remove(src)
+    out = f"{base}.{ext}"
+    os.replace(tmp, out)
+    await asyncio.to_thread(TRANSCODES.put, (vid or res.get("id"), format_id, codec, kbps), ext, out)
+    res.update({"filepath": out, "filesize": os.path.getsize(out)})
+    return res
+
+# Splitting helper: streams each part with copy_file_range/sendfile (kernel-side
+# copy, bounded memory) and returns the part paths without globbing the directory
+_COPY_BUF = 8 * 1024 * 1024
+
+def _copy_range(src_fd, dst_fd, offset, count):
+    # -> bytes copied; tries zero-copy syscalls first, then a bounded buffer
+    done = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while done < count:
+                n = os.copy_file_range(src_fd, dst_fd, count - done, offset + done)
+                if n == 0:
+                    return done
+                done += n
+            return done
+        except OSError:
+            pass
+    if hasattr(os, "sendfile"):
+        try:
+            while done < count:
+                n = os.sendfile(dst_fd, src_fd, offset + done, count - done)
+                if n == 0:
+                    return done
+                done += n
+            return done
+        except OSError:
+            pass
+    while done < count:
+        buf = os.pread(src_fd, min(_COPY_BUF, count - done), offset + done)
+        if not buf:
+            break
+        os.write(dst_fd, buf)
+        done += len(buf)
+    return done
+
+def split_file(filepath, chunk_size=SPLIT_CHUNK_SIZE, prefix=None):
     parts = []
-    base = os.path.basename(filepath)
-    dirn = os.path.dirname(filepath)
+    prefix = prefix or filepath + ".part_"
+    total = os.path.getsize(filepath)
+    src = os.open(filepath, os.O_RDONLY)
     try:
-        prefix = os.path.join(dirn, base + ".part_")
-        # use split binary if present
-        subprocess.check_call(["split", "-b", str(chunk_size), filepath, prefix])
-        for f in sorted([os.path.join(dirn, x) for x in os.listdir(dirn) if x.startswith(base + ".part_")]):
-            parts.append(f)
-    except Exception:
-        # fallback python split
-        with open(filepath, "rb") as f:
-            idx = 0
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                part_path = f"{filepath}.part{idx}"
-                with open(part_path, "wb") as pf:
-                    pf.write(chunk)
-                parts.append(part_path)
-                idx += 1
+        for idx, offset in enumerate(range(0, total, chunk_size)):
+            part_path = f"{prefix}{idx:03d}"
+            dst = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                _copy_range(src, dst, offset, min(chunk_size, total - offset))
+            finally:
+                os.close(dst)
+            parts.append(part_path)
+    finally:
+        os.close(src)
     return parts
+
+# Read-only window [offset, offset+length) of a file, usable wherever Pyrogram
+# accepts a file object: uploads a byte range of the original without writing
+# a part file. `name` is what Telegram shows as the file name.
+class FilePart(io.RawIOBase):
+    def __init__(self, path, offset, length, name):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.name = name
+        self._pos = 0
+        self._fd = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _ensure_open(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        return self._fd
+
+    def readinto(self, b):
+        n = min(len(b), self.length - self._pos)
+        if n <= 0:
+            return 0
+        data = os.pread(self._ensure_open(), n, self.offset + self._pos)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self._pos = max(0, min(pos, self.length))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        super().close()
+
+def virtual_parts(filepath, chunk_size=SPLIT_CHUNK_SIZE, name=None):
+    total = os.path.getsize(filepath)
+    name = name or os.path.basename(filepath)
+    count = (total + chunk_size - 1) // chunk_size
+    return [FilePart(filepath, off, min(chunk_size, total - off), f"{name}.{i + 1:03d}")
+            for i, off in enumerate(range(0, total, chunk_size))] if count else []
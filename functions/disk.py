@@ -0,0 +1,190 @@
+# functions/disk.py
+import os, time, uuid, shutil, threading
+
+class DiskFull(Exception):
+    pass
+
+_JOB_PREFIX = "job-"
+_PART_SUFFIXES = (".part", ".ytdl", ".temp")
+
+# Disk space for downloads. Every job writes into its own directory under root,
+# so jobs never collide and one rmtree removes everything a job left behind
+# (merge inputs, yt-dlp .part/.ytdl files, split parts).
+# Jobs reserve their expected size (times headroom for merges/conversions) up
+# front and are refused when free space or the quota can't cover it. Running
+# reservations are counted in full, so admission errs on the safe side. The
+# quota check adds them to the bytes outside running jobs as the janitor last
+# measured them, so admitting a job never walks the download tree.
+# A janitor thread removes job directories nobody holds anymore (crashes,
+# restarts, abandoned flows) by age, then oldest first while over the quota.
+# It starts with the first reservation, so only the process that runs jobs
+# sweeps (never an importer of the module, e.g. a worker process).
+class DiskManager:
+    def __init__(self, root, quota=0, min_free=0, default_reserve=512 * 1024 * 1024, headroom=2.0,
+                 interval=300, orphan_age=3600, part_age=6 * 3600):
+        self.root = root
+        self.quota = quota
+        self.min_free = min_free
+        self.default_reserve = default_reserve
+        self.headroom = headroom
+        self.interval = interval
+        self.orphan_age = orphan_age
+        self.part_age = part_age
+        self._active = {}           # job dir -> reserved bytes
+        self._used = 0              # bytes under root outside running jobs, per the last sweep
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.admitted = 0
+        self.rejected = 0
+        self.removed = 0
+        self.freed = 0
+        os.makedirs(root, exist_ok=True)
+
+    # -> path of a fresh job directory; raises DiskFull
+    def reserve(self, expected=0):
+        need = int((expected or self.default_reserve) * self.headroom)
+        with self._lock:
+            reserved = sum(self._active.values())
+            free = shutil.disk_usage(self.root).free
+            if free - reserved - need < self.min_free:
+                self.rejected += 1
+                raise DiskFull(f"not enough free disk space ({free} bytes free, {reserved} reserved, {need} needed)")
+            if self.quota and self._used + reserved + need > self.quota:
+                self.rejected += 1
+                raise DiskFull(f"download quota reached ({self.quota} bytes)")
+            path = os.path.join(self.root, _JOB_PREFIX + uuid.uuid4().hex[:12])
+            os.makedirs(path)
+            self._active[path] = need
+            self.admitted += 1
+        # after registering: the janitor's first pass must not take this job for a leftover
+        self.start()
+        return path
+
+    def release(self, path):
+        if not path:
+            return
+        with self._lock:
+            self._active.pop(path, None)
+        self._remove(path)
+
+    def usage(self):
+        return _du(self.root)
+
+    # ------------ janitor ------------
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._janitor, name="disk-janitor", daemon=True)
+        self._thread.start()
+
+    def _janitor(self):
+        # first pass right away: only this process's own jobs are active, so leftovers of a previous run go now
+        age = 0
+        while True:
+            try:
+                self.sweep(age)
+            except Exception:
+                pass
+            age = self.orphan_age
+            if self._stop.wait(self.interval):
+                return
+
+    def sweep(self, orphan_age=None):
+        orphan_age = self.orphan_age if orphan_age is None else orphan_age
+        now = time.time()
+        with self._lock:
+            active = set(self._active)
+        candidates = []
+        for e in os.scandir(self.root):
+            if e.path in active:
+                self._sweep_parts(e.path, now)
+            elif e.name.startswith(_JOB_PREFIX):
+                candidates.append((_newest_mtime(e.path), e.path))
+            elif e.name.endswith(_PART_SUFFIXES) and now - _newest_mtime(e.path) > self.part_age:
+                # loose yt-dlp leftovers from before per-job directories
+                self._remove(e.path)
+        candidates.sort()
+        keep = []
+        for mtime, path in candidates:
+            if now - mtime > orphan_age:
+                self._remove_inactive(path)
+            else:
+                keep.append(path)
+        # still over quota: least recently written first
+        if self.quota:
+            for path in keep:
+                if self.usage() <= self.quota:
+                    break
+                self._remove_inactive(path)
+        with self._lock:
+            active = set(self._active)
+        self._used = sum(_du(e.path) for e in os.scandir(self.root) if e.path not in active)
+
+    def _sweep_parts(self, path, now):
+        # a running job's .part that hasn't been written for part_age is a stuck download
+        for dirpath, _, files in os.walk(path):
+            for f in files:
+                if f.endswith(_PART_SUFFIXES):
+                    p = os.path.join(dirpath, f)
+                    try:
+                        if now - os.path.getmtime(p) > self.part_age:
+                            self._remove(p)
+                    except OSError:
+                        pass
+
+    def _remove_inactive(self, path):
+        with self._lock:
+            if path in self._active:
+                return
+        self._remove(path)
+
+    def _remove(self, path):
+        size = _du(path)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except OSError:
+            return
+        self.removed += 1
+        self.freed += size
+
+    def stats(self):
+        try:
+            free = shutil.disk_usage(self.root).free
+        except OSError:
+            free = 0
+        with self._lock:
+            active, reserved = len(self._active), sum(self._active.values())
+        return {"used": self.usage(), "free": free, "quota": self.quota, "reserved": reserved,
+                "active_jobs": active, "admitted": self.admitted, "rejected": self.rejected,
+                "removed": self.removed, "freed": self.freed}
+
+    def close(self):
+        self._stop.set()
+
+def _du(path):
+    if not os.path.isdir(path):
+        try: return os.path.getsize(path)
+        except OSError: return 0
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            try: total += os.path.getsize(os.path.join(dirpath, f))
+            except OSError: pass
+    return total
+
+def _newest_mtime(path):
+    try:
+        newest = os.path.getmtime(path)
+    except OSError:
+        return 0
+    if os.path.isdir(path):
+        for dirpath, _, files in os.walk(path):
+            for f in files:
+                try: newest = max(newest, os.path.getmtime(os.path.join(dirpath, f)))
+                except OSError: pass
+    return newest
@@ -0,0 +1,208 @@
+# functions/engine.py
+import os, time, threading, http.client
+from urllib.parse import urlsplit, urljoin
+
+# Segmented HTTP downloads: one file fetched as many Range requests in
+# parallel, so a per-connection throttle no longer caps the whole download.
+# Connections are keep-alive and pooled per host for the life of the process
+# (each yt-dlp worker process has its own pool, reused across its jobs).
+# Segments are written in place with pwrite, i.e. out of order: a file being
+# downloaded this way is not readable as a growing prefix.
+
+_READ = 256 * 1024
+
+class SegmentError(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, max_idle_per_host=16, timeout=30):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}     # (scheme, host, port) -> [connection]
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def get(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                self.reused += 1
+                return conns.pop()
+            self.opened += 1
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=self.timeout)
+
+    def put(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append(conn)
+                return
+        conn.close()
+
+    # GET following redirects -> (key, conn, response, final url)
+    def open(self, url, headers, max_redirects=5):
+        for _ in range(max_redirects + 1):
+            u = urlsplit(url)
+            key = (u.scheme, u.hostname, u.port or (443 if u.scheme == "https" else 80))
+            conn = self.get(key)
+            path = (u.path or "/") + ("?" + u.query if u.query else "")
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                # a pooled connection may have been closed by the server: one fresh try
+                conn = self.get(key)
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+                resp.read()
+                self.release(key, conn, resp)
+                url = urljoin(url, resp.getheader("Location"))
+                continue
+            return key, conn, resp, url
+        raise SegmentError("too many redirects")
+
+    def release(self, key, conn, resp):
+        if resp.isclosed() and not resp.will_close:
+            self.put(key, conn)
+        else:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(c) for c in self._idle.values())
+        return {"opened": self.opened, "reused": self.reused, "idle": idle}
+
+POOL = ConnectionPool()
+
+def _probe(url, headers, pool):
+    # -> (final url, total size or None when the server ignores Range)
+    key, conn, resp, url = pool.open(url, dict(headers, Range="bytes=0-0"))
+    if resp.status != 206:
+        # don't read a whole body the server sent instead of one byte
+        conn.close()
+        if resp.status >= 400:
+            raise SegmentError(f"HTTP {resp.status}")
+        return url, None
+    resp.read()
+    pool.release(key, conn, resp)
+    total = (resp.getheader("Content-Range") or "").rpartition("/")[2]
+    return url, int(total) if total.isdigit() else None
+
+# Fetch url into dest with up to `connections` parallel range requests.
+# progress(downloaded, total) is called from this thread about every 0.5s and
+# may raise to abort (e.g. yt-dlp's DownloadCancelled). -> bytes written
+def segmented_download(url, dest, headers=None, connections=4, segment_size=10 * 1024 * 1024,
+                       progress=None, retries=3, pool=POOL):
+    headers = dict(headers or {})
+    url, total = _probe(url, headers, pool)
+    if total is None:
+        return _single(url, dest, headers, progress, pool)
+    segments = [(off, min(off + segment_size, total) - 1) for off in range(0, total, segment_size)]
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    done = [0] * len(segments)
+    workers = max(1, min(connections, len(segments)))
+    state = {"next": 0, "error": None, "running": workers}
+    lock = threading.Lock()
+    stop = threading.Event()
+    finished = threading.Event()
+
+    def fetch(i):
+        start, end = segments[i]
+        pos = start
+        for attempt in range(retries + 1):
+            if stop.is_set():
+                return
+            try:
+                key, conn, resp, _ = pool.open(url, dict(headers, Range=f"bytes={pos}-{end}"))
+                if resp.status != 206:
+                    conn.close()
+                    raise SegmentError(f"HTTP {resp.status} for a range request")
+                while pos <= end:
+                    if stop.is_set():
+                        conn.close()
+                        return
+                    data = resp.read(min(_READ, end - pos + 1))
+                    if not data:
+                        break
+                    os.pwrite(fd, data, pos)
+                    pos += len(data)
+                    done[i] = pos - start
+                if pos > end:
+                    pool.release(key, conn, resp)
+                    return
+                conn.close()
+            except (OSError, http.client.HTTPException, SegmentError):
+                if attempt == retries:
+                    raise
+                time.sleep(min(2 ** attempt, 8))
+        raise SegmentError(f"segment {i} incomplete")
+
+    def worker():
+        try:
+            while not stop.is_set():
+                with lock:
+                    i = state["next"]
+                    if i >= len(segments):
+                        return
+                    state["next"] = i + 1
+                fetch(i)
+        except BaseException as e:
+            with lock:
+                state["error"] = state["error"] or e
+            stop.set()
+        finally:
+            with lock:
+                state["running"] -= 1
+                if state["running"] == 0:
+                    finished.set()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    try:
+        for t in threads:
+            t.start()
+        while not finished.wait(0.5):
+            if progress is not None:
+                progress(sum(done), total)
+        if state["error"] is not None:
+            raise state["error"]
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        os.close(fd)
+    if progress is not None:
+        progress(total, total)
+    return total
+
+def _single(url, dest, headers, progress, pool):
+    # server without Range support: one sequential stream
+    key, conn, resp, _ = pool.open(url, headers)
+    if resp.status >= 400:
+        conn.close()
+        raise SegmentError(f"HTTP {resp.status}")
+    total = int(resp.getheader("Content-Length") or 0) or None
+    written = 0
+    last = time.monotonic()
+    try:
+        with open(dest, "wb") as f:
+            while True:
+                data = resp.read(_READ)
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+                if progress is not None and time.monotonic() - last > 0.5:
+                    last = time.monotonic()
+                    progress(written, total)
+    except BaseException:
+        conn.close()
+        raise
+    pool.release(key, conn, resp)
+    if progress is not None:
+        progress(written, total or written)
+    return written
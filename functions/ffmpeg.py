@@ -0,0 +1,131 @@
+# functions/ffmpeg.py
+import os, time, shutil, asyncio, threading
+
+# ffmpeg jobs outside the yt-dlp workers. Re-encodes are CPU bound: at most
+# `workers` run at once, single-threaded each, so a burst of audio requests
+# can't take every core from downloads and uploads. Stream copies (remuxes)
+# are I/O bound and skip the limit.
+class FFmpegPool:
+    def __init__(self, workers=1, binary="ffmpeg"):
+        self.workers = max(1, workers)
+        self.binary = binary
+        self._sem = asyncio.Semaphore(self.workers)
+        self.waiting = 0
+        self.running = 0
+        self.transcodes = 0
+        self.remuxes = 0
+        self.failed = 0
+        self.cpu_seconds = 0.0
+
+    async def run(self, args, cpu=True):
+        if not cpu:
+            self.remuxes += 1
+            return await self._exec(args)
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        started = time.monotonic()
+        try:
+            return await self._exec(["-threads", "1"] + args)
+        finally:
+            self._sem.release()
+            self.running -= 1
+            self.transcodes += 1
+            self.cpu_seconds += time.monotonic() - started
+
+    async def _exec(self, args):
+        proc = await asyncio.create_subprocess_exec(self.binary, "-hide_banner", "-loglevel", "error", "-y", *args,
+                                                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        try:
+            _, err = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0:
+            self.failed += 1
+            raise RuntimeError(f"ffmpeg failed: {err.decode(errors='replace').strip()[-300:]}")
+
+    def stats(self):
+        return {"workers": self.workers, "running": self.running, "waiting": self.waiting,
+                "transcodes": self.transcodes, "remuxes": self.remuxes, "failed": self.failed,
+                "transcode_seconds": round(self.cpu_seconds, 1)}
+
+# Finished audio outputs by (video_id, format, codec, bitrate), so the same
+# track is never converted twice. Files are hard-linked in and out (copied
+# across filesystems); the least recently used go once max_bytes is exceeded.
+class TranscodeCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if max_bytes:
+            os.makedirs(path, exist_ok=True)
+
+    def _file(self, video_id, format_id, codec, kbps, ext):
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in f"{video_id}-{format_id}-{codec}-{kbps}")
+        return os.path.join(self.path, f"{safe}.{ext}")
+
+    # copy of the cached output at dest -> True, or False on a miss
+    def get(self, key, ext, dest):
+        if not self.max_bytes or not key[0]:
+            return False
+        src = self._file(*key, ext)
+        try:
+            _link(src, dest)
+            os.utime(src)
+        except OSError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key, ext, src):
+        if not self.max_bytes or not key[0]:
+            return
+        dst = self._file(*key, ext)
+        try:
+            tmp = dst + ".tmp"
+            _link(src, tmp)
+            os.replace(tmp, dst)
+        except OSError:
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for e in os.scandir(self.path):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+            total = sum(e[1] for e in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        os.remove(dst)
+        os.link(src, dst)
+    except OSError:
+        if not os.path.exists(src):
+            raise
+        shutil.copyfile(src, dst)
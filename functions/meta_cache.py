@@ -0,0 +1,129 @@
+# functions/meta_cache.py
+import json, time, zlib, sqlite3, asyncio, threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+# fields yt-dlp returns that neither the menus nor the download step use
+HEAVY_FIELDS = ("automatic_captions", "subtitles", "requested_subtitles", "heatmap", "thumbnails")
+
+def trim_info(info):
+    return {k: v for k, v in info.items() if k not in HEAVY_FIELDS}
+
+def signed_url_expiry(info):
+    # googlevideo format URLs carry ?expire=<epoch>; cached info is useless after that
+    expiries = []
+    for f in info.get("formats") or []:
+        url = f.get("url") or ""
+        if "expire=" not in url:
+            continue
+        try:
+            expiries.append(int(parse_qs(urlsplit(url).query)["expire"][0]))
+        except (KeyError, ValueError, IndexError):
+            pass
+    return min(expiries) if expiries else None
+
+# yt-dlp info dicts keyed by canonical video id: an in-memory LRU in front of a
+# SQLite table, so a viral link pasted by hundreds of users is extracted once.
+class MetaCache:
+    def __init__(self, path, ttl=3 * 3600, max_size=512, expiry_margin=600):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.expiry_margin = expiry_margin
+        self._mem = OrderedDict()  # video_id -> (expires_at, info)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._conn().execute("CREATE TABLE IF NOT EXISTS meta (video_id TEXT PRIMARY KEY, expires_at INTEGER, info BLOB)")
+            self._conn().commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def _expires_at(self, info):
+        exp = time.time() + self.ttl
+        signed = signed_url_expiry(info)
+        if signed:
+            exp = min(exp, signed - self.expiry_margin)
+        return exp
+
+    def _remember(self, video_id, expires_at, info):
+        with self._lock:
+            self._mem[video_id] = (expires_at, info)
+            self._mem.move_to_end(video_id)
+            while len(self._mem) > self.max_size:
+                self._mem.popitem(last=False)
+
+    def get_memory(self, video_id):
+        with self._lock:
+            item = self._mem.get(video_id)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._mem[video_id]
+                return None
+            self._mem.move_to_end(video_id)
+            self.hits += 1
+            return item[1]
+
+    # blocking; use aget from the event loop
+    def get(self, video_id):
+        info = self.get_memory(video_id)
+        if info is not None or not self.path:
+            if info is None:
+                self.misses += 1
+            return info
+        r = self._conn().execute("SELECT expires_at, info FROM meta WHERE video_id=?", (video_id,)).fetchone()
+        if not r or r[0] < time.time():
+            self.misses += 1
+            return None
+        info = json.loads(zlib.decompress(r[1]))
+        self._remember(video_id, r[0], info)
+        self.disk_hits += 1
+        return info
+
+    def put(self, video_id, info):
+        info = trim_info(info)
+        expires_at = self._expires_at(info)
+        if expires_at <= time.time():
+            return info
+        self._remember(video_id, expires_at, info)
+        if self.path:
+            blob = zlib.compress(json.dumps(info, default=str).encode())
+            conn = self._conn()
+            conn.execute("INSERT OR REPLACE INTO meta (video_id,expires_at,info) VALUES (?,?,?)", (video_id, int(expires_at), blob))
+            conn.commit()
+        return info
+
+    def invalidate(self, video_id):
+        with self._lock:
+            self._mem.pop(video_id, None)
+        if self.path:
+            conn = self._conn()
+            conn.execute("DELETE FROM meta WHERE video_id=?", (video_id,))
+            conn.commit()
+
+    def purge_expired(self):
+        if self.path:
+            conn = self._conn()
+            conn.execute("DELETE FROM meta WHERE expires_at<?", (int(time.time()),))
+            conn.commit()
+
+    async def aget(self, video_id):
+        info = self.get_memory(video_id)
+        if info is not None:
+            return info
+        return await asyncio.to_thread(self.get, video_id)
+
+    async def aput(self, video_id, info):
+        return await asyncio.to_thread(self.put, video_id, info)
+
+    def stats(self):
+        return {"size": len(self._mem), "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
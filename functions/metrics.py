@@ -0,0 +1,206 @@
+# functions/metrics.py
+import time, asyncio, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Hot-path instrumentation: counters and latency histograms recorded in
+# process, plus gauges read from the bot's own objects only when scraped.
+# Served in Prometheus text format (serve) and summarised for /perf (summary).
+# Disabled, every call returns after one attribute check.
+
+# seconds; covers DB round trips up to multi-minute downloads
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "started")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics._observe(self.name, self.labels, time.perf_counter() - self.started)
+        # a cancelled job is not an error of the stage it was in
+        if exc_type is not None and not issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            self.metrics._inc(self.name + "_errors", self.labels, 1)
+        return False
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+class Metrics:
+    def __init__(self, enabled=True, prefix="bot"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) -> value
+        self._hists = {}        # (name, labels) -> [count, sum, max, bucket counts]
+        self._gauges = []       # (name, fn, label, kind)
+        self._server = None
+
+    # ------------ recording ------------
+    def inc(self, name, value=1, **labels):
+        if self.enabled:
+            self._inc(name, tuple(sorted(labels.items())), value)
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            self._observe(name, tuple(sorted(labels.items())), seconds)
+
+    # with METRICS.timer("db", op="user_info"): ... -> <name>_seconds, <name>_errors_total
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self, name, tuple(sorted(labels.items())))
+
+    # request pipeline stages (extract, queue, download, postprocess, ffmpeg, split, upload, job)
+    def stage(self, stage):
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self, "stage", (("stage", stage),))
+
+    def _inc(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0, 0.0, 0.0, [0] * len(BUCKETS)]
+            h[0] += 1
+            h[1] += seconds
+            h[2] = max(h[2], seconds)
+            for i, le in enumerate(BUCKETS):
+                if seconds <= le:
+                    h[3][i] += 1
+                    break
+
+    # fn() -> a number, or {label value: number} reported under `label`; read at scrape time
+    def gauge(self, name, fn, label=None, kind="gauge"):
+        self._gauges.append((name, fn, label, kind))
+
+    # ------------ reading ------------
+    def _read_gauges(self):
+        out = []
+        for name, fn, label, kind in self._gauges:
+            try:
+                v = fn()
+            except Exception:
+                # the object changed under a scrape from another thread: skip it this time
+                continue
+            rows = [((), v)] if label is None else [(((label, str(k)),), x) for k, x in v.items()]
+            out.append((name, kind, rows))
+        return out
+
+    def render(self):
+        p = self.prefix
+        with self._lock:
+            counters = sorted(self._counters.items())
+            hists = sorted((k, (h[0], h[1], h[2], list(h[3]))) for k, h in self._hists.items())
+        lines = []
+        typed = set()
+        def header(metric, kind):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+        for (name, labels), (count, total, _, buckets) in hists:
+            metric = f"{p}_{name}_seconds"
+            header(metric, "histogram")
+            cum = 0
+            for le, n in zip(BUCKETS, buckets):
+                cum += n
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', str(le)),))} {cum}")
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{metric}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+        for (name, labels), v in counters:
+            metric = f"{p}_{name}_total"
+            header(metric, "counter")
+            lines.append(f"{metric}{_labels(labels)} {v}")
+        for name, kind, rows in self._read_gauges():
+            metric = f"{p}_{name}_total" if kind == "counter" else f"{p}_{name}"
+            header(metric, kind)
+            for labels, v in rows:
+                lines.append(f"{metric}{_labels(labels)} {v}")
+        return "\n".join(lines) + "\n"
+
+    # -> {"timers": {(name, labels): {count, avg, p50, p95, max, errors}}, "counters": {...}, "gauges": {...}}
+    def summary(self):
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {k: (h[0], h[1], h[2], list(h[3])) for k, h in self._hists.items()}
+        timers = {}
+        for (name, labels), (count, total, peak, buckets) in hists.items():
+            timers[(name, labels)] = {"count": count, "avg": total / count if count else 0.0,
+                                      "p50": _quantile(buckets, count, 0.5, peak), "p95": _quantile(buckets, count, 0.95, peak),
+                                      "max": peak, "errors": counters.pop((name + "_errors", labels), 0)}
+        gauges = {name: (rows[0][1] if rows and not rows[0][0] else {l[0][1]: v for l, v in rows})
+                  for name, _, rows in self._read_gauges()}
+        return {"timers": timers, "counters": counters, "gauges": gauges}
+
+    # ------------ endpoint ------------
+    # GET /metrics on host:port from a daemon thread
+    def serve(self, host="127.0.0.1", port=9100):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self._server.server_address
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _quantile(buckets, count, q, peak):
+    # upper bound of the bucket holding the q-th observation (capped at the max seen)
+    if not count:
+        return 0.0
+    rank, cum = q * count, 0
+    for le, n in zip(BUCKETS, buckets):
+        cum += n
+        if cum >= rank:
+            return min(le, peak)
+    return peak
+
+METRICS = Metrics()
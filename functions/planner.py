@@ -0,0 +1,90 @@
+# functions/planner.py
+from functions.utils import human_size
+
+# Pre-flight size planning: estimates what a quality will weigh once delivered,
+# from the extracted info alone, so the route (direct upload, split parts or the
+# storage channel) is known before a single byte is downloaded.
+# A size of 0 means "unknown"; those are routed after the download as before.
+
+def estimate_size(fmt, duration):
+    size = fmt.get("filesize") or fmt.get("filesize_approx") or 0
+    if not size and duration:
+        # kbit/s x seconds
+        kbps = fmt.get("tbr") or ((fmt.get("vbr") or 0) + (fmt.get("abr") or 0))
+        size = kbps * 1000 / 8 * duration
+    return int(size)
+
+# Audio-only format yt-dlp would merge into a video-only one: highest bitrate,
+# preferring a codec that fits the video's container (m4a with mp4, webm with webm)
+_AUDIO_EXT = {"mp4": "m4a", "webm": "webm"}
+
+def _audio_formats(info):
+    return [f for f in info.get("formats") or [] if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none")]
+
+def _pick_audio(audios, video_ext):
+    if not audios:
+        return None
+    want = _AUDIO_EXT.get(video_ext)
+    return max(audios, key=lambda f: (f.get("ext") == want, f.get("abr") or f.get("tbr") or 0))
+
+def best_audio(info, video_ext=None):
+    return _pick_audio(_audio_formats(info), video_ext)
+
+# (label, format_id, filesize) rows from list_video_qualities -> (label, format_spec, estimate).
+# Video-only formats get "+<audio id>" so the download merges the same audio the estimate counted.
+def plan_video(info, qualities):
+    duration = info.get("duration") or 0
+    by_id = {f.get("format_id"): f for f in info.get("formats") or []}
+    # one scan of the formats; the pick only depends on the video's container
+    audios = _audio_formats(info)
+    audio_for = {}
+    planned = []
+    for label, fid, _ in qualities:
+        f = by_id.get(fid) or {}
+        spec = fid
+        size = estimate_size(f, duration)
+        if f.get("acodec") == "none":
+            ext = f.get("ext")
+            if ext not in audio_for:
+                audio_for[ext] = _pick_audio(audios, ext)
+            a = audio_for[ext]
+            if a is not None:
+                spec = f"{fid}+{a['format_id']}"
+                a_size = estimate_size(a, duration)
+                size = size + a_size if size and a_size else 0
+        planned.append((label, spec, size))
+    return planned
+
+# Sources whose codec is in keep_codecs are only remuxed (about their own size);
+# the rest are re-encoded to output_kbps, so the source size says little
+def plan_audio(info, qualities, output_kbps=None, keep_codecs=()):
+    duration = info.get("duration") or 0
+    by_id = {f.get("format_id"): f for f in info.get("formats") or []}
+    planned = []
+    for label, fid, _ in qualities:
+        codec = ((by_id.get(fid) or {}).get("acodec") or "").split(".")[0]
+        if output_kbps and duration and codec not in keep_codecs:
+            size = int(output_kbps * 1000 / 8 * duration)
+        else:
+            size = estimate_size(by_id.get(fid) or {}, duration)
+        planned.append((label, fid, size))
+    return planned
+
+# -> "direct", "split" (premium) or "storage" (free)
+def route(size, premium, limit):
+    if not size or size <= limit:
+        return "direct"
+    return "split" if premium else "storage"
+
+# Highest quality whose known estimate fits in limit; rows are lowest first
+def best_fit(planned, limit):
+    for row in reversed(planned):
+        if 0 < row[2] <= limit:
+            return row
+    return None
+
+def button_label(label, size, route_name="direct"):
+    if not size:
+        return label
+    text = f"{label} · ~{human_size(size)}"
+    return text + " ✂️" if route_name == "split" else text
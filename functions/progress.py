@@ -0,0 +1,90 @@
+# functions/progress.py
+import asyncio, threading
+
+# Progress for many jobs across many chats, without scheduling a coroutine per
+# yt-dlp callback. Worker/listener threads only overwrite the latest state of a
+# job (update); one ticker task per chat renders and edits the messages whose
+# state changed since the last flush, at a rate that backs off on FloodWait.
+class ProgressReporter:
+    def __init__(self, edit, render, flood_exc=None, interval=1.5, max_interval=10.0):
+        self.edit = edit            # async edit(chat_id, msg_id, text, reply_markup)
+        self.render = render        # render(kind, payload) -> text
+        self.flood_exc = flood_exc  # exception type carrying .value seconds (pyrogram FloodWait)
+        self.interval = interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        self._state = {}            # job_key -> [version, kind, payload, picked up by a ticker]
+        self._chats = {}            # chat_id -> {msg_id: watcher}
+        self._tickers = {}          # chat_id -> task
+        self.sent = 0
+        self.dropped = 0
+        self.flood_waits = 0
+
+    # thread-safe, O(1): called for every progress event
+    def update(self, job_key, kind, payload=None):
+        with self._lock:
+            prev = self._state.get(job_key)
+            if prev is not None and not prev[3]:
+                # replaced before any ticker sent it
+                self.dropped += 1
+            self._state[job_key] = [(prev[0] + 1) if prev else 1, kind, payload, False]
+
+    # event loop only
+    def watch(self, job_key, chat_id, msg_id, reply_markup=None):
+        self._chats.setdefault(chat_id, {})[msg_id] = {"key": job_key, "version": 0, "text": None, "markup": reply_markup}
+        if chat_id not in self._tickers:
+            self._tickers[chat_id] = asyncio.get_running_loop().create_task(self._tick(chat_id))
+
+    def unwatch(self, chat_id, msg_id):
+        msgs = self._chats.get(chat_id)
+        if msgs is None:
+            return
+        msgs.pop(msg_id, None)
+        if not msgs:
+            self._chats.pop(chat_id, None)
+
+    # job done: free its state; watchers of it stop on their own
+    def finish(self, job_key):
+        with self._lock:
+            self._state.pop(job_key, None)
+
+    async def _tick(self, chat_id):
+        interval = self.interval
+        try:
+            while chat_id in self._chats:
+                await asyncio.sleep(interval)
+                for msg_id, w in list(self._chats.get(chat_id, {}).items()):
+                    with self._lock:
+                        st = self._state.get(w["key"])
+                        if st is None or st[0] == w["version"]:
+                            continue
+                        st[3] = True
+                    text = self.render(st[1], st[2])
+                    if text == w["text"]:
+                        w["version"] = st[0]
+                        continue
+                    try:
+                        await self.edit(chat_id, msg_id, text, w["markup"])
+                        w["version"] = st[0]
+                        w["text"] = text
+                        self.sent += 1
+                        interval = max(self.interval, interval * 0.9)
+                    except Exception as e:
+                        if self.flood_exc is not None and isinstance(e, self.flood_exc):
+                            self.flood_waits += 1
+                            with self._lock:
+                                if self._state.get(w["key"]) is st:
+                                    st[3] = False       # still current: sent on a later tick
+                                else:
+                                    self.dropped += 1   # replaced meanwhile: never sent
+                            interval = min(self.max_interval, interval * 2)
+                            await asyncio.sleep(getattr(e, "value", 0) or 0)
+                            break
+                        # message deleted / not modified: stop editing it
+                        self.unwatch(chat_id, msg_id)
+        finally:
+            self._tickers.pop(chat_id, None)
+
+    def stats(self):
+        return {"jobs": len(self._state), "chats": len(self._chats), "tickers": len(self._tickers),
+                "edits_sent": self.sent, "updates_coalesced": self.dropped, "flood_waits": self.flood_waits}
@@ -0,0 +1,148 @@
+# functions/scheduler.py
+import asyncio, itertools
+from collections import deque
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    __slots__ = ("id", "user_id", "lane", "factory", "on_position", "on_start", "future", "task", "last_pos")
+
+    def __init__(self, job_id, user_id, lane, factory, on_position, on_start):
+        self.id = job_id
+        self.user_id = user_id
+        self.lane = lane
+        self.factory = factory            # async callable(job) doing the actual work
+        self.on_position = on_position    # async callable(pos) while queued (1-based)
+        self.on_start = on_start          # async callable() right before factory runs
+        self.future = asyncio.get_running_loop().create_future()
+        # results are optional to await; don't log unretrieved exceptions
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.task = None
+        self.last_pos = None
+
+# Bounded download scheduler: a global concurrency cap, a per-user cap, and
+# priority lanes (0 = highest). Lower lanes may not use the last `reserved`
+# slots, so a lane-0 job always starts immediately while one of them is free.
+class JobScheduler:
+    def __init__(self, max_concurrent=4, per_user=1, max_queued_per_user=3, reserved=1, lanes=3):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.max_queued_per_user = max_queued_per_user
+        self.reserved = min(reserved, max_concurrent - 1)
+        self.lanes = [deque() for _ in range(lanes)]
+        self.jobs = {}
+        self.running = 0
+        self._user_running = {}
+        self._user_queued = {}
+        self._ids = itertools.count(1)
+
+    def submit(self, user_id, lane, factory, on_position=None, on_start=None):
+        lane = max(0, min(lane, len(self.lanes) - 1))
+        if self._user_queued.get(user_id, 0) >= self.max_queued_per_user:
+            raise QueueFull(user_id)
+        job = Job(str(next(self._ids)), user_id, lane, factory, on_position, on_start)
+        self.jobs[job.id] = job
+        self.lanes[lane].append(job)
+        self._user_queued[user_id] = self._user_queued.get(user_id, 0) + 1
+        self._pump()
+        return job
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job:
+            return False
+        # a running job's task is cancelled; its download is aborted through the flight
+        # (functions/singleflight.py) once no other job shares it
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            self.lanes[job.lane].remove(job)
+            self._dequeued(job)
+            self.jobs.pop(job.id, None)
+            job.future.cancel()
+            self._pump()
+        return True
+
+    def position(self, job_id):
+        for pos, job in enumerate(self._queued(), 1):
+            if job.id == job_id:
+                return pos
+        return 0
+
+    def stats(self):
+        return {"running": self.running, "queued": sum(len(l) for l in self.lanes),
+                "per_lane": [len(l) for l in self.lanes]}
+
+    # ------------ internals ------------
+    def _queued(self):
+        for lane in self.lanes:
+            yield from lane
+
+    def _dequeued(self, job):
+        n = self._user_queued.get(job.user_id, 1) - 1
+        if n: self._user_queued[job.user_id] = n
+        else: self._user_queued.pop(job.user_id, None)
+
+    def _eligible(self, job):
+        if self._user_running.get(job.user_id, 0) >= self.per_user:
+            return False
+        limit = self.max_concurrent if job.lane == 0 else self.max_concurrent - self.reserved
+        return self.running < limit
+
+    def _pump(self):
+        started = True
+        while started and self.running < self.max_concurrent:
+            started = False
+            for lane in self.lanes:
+                for job in lane:
+                    if self._eligible(job):
+                        lane.remove(job)
+                        self._start(job)
+                        started = True
+                        break
+                if started:
+                    break
+        self._notify_positions()
+
+    def _start(self, job):
+        self._dequeued(job)
+        self.running += 1
+        self._user_running[job.user_id] = self._user_running.get(job.user_id, 0) + 1
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+        # bookkeeping in a done callback so it also runs if the task is cancelled before its first step
+        job.task.add_done_callback(lambda _: self._finished(job))
+
+    async def _run(self, job):
+        try:
+            if job.on_start:
+                await job.on_start()
+            res = await job.factory(job)
+            if not job.future.done():
+                job.future.set_result(res)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+
+    def _finished(self, job):
+        if not job.future.done():
+            job.future.cancel()
+        self.running -= 1
+        n = self._user_running.get(job.user_id, 1) - 1
+        if n: self._user_running[job.user_id] = n
+        else: self._user_running.pop(job.user_id, None)
+        self.jobs.pop(job.id, None)
+        self._pump()
+
+    def _notify_positions(self):
+        loop = asyncio.get_running_loop()
+        for pos, job in enumerate(self._queued(), 1):
+            if job.on_position and job.last_pos != pos:
+                job.last_pos = pos
+                loop.create_task(_quiet(job.on_position(pos)))
+
+async def _quiet(coro):
+    try:
+        await coro
+    except Exception:
+        pass
@@ -0,0 +1,220 @@
+# functions/sessions.py
+import time, pickle, sqlite3, asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Sessions behind the inline buttons and the rename flow. Each entry has a TTL;
+# the store is capped at max_size with LRU eviction (pinned entries, i.e.
+# running jobs, are never evicted), and keeps a per-user index so "is this
+# user awaiting a rename?" is a dict lookup instead of a scan.
+# With a path, entries stored with persist=True are written behind to SQLite
+# so buttons keep working after a restart.
+class SessionStore:
+    def __init__(self, ttl=3600, max_size=20000, path=None, on_evict=None, sweep_every=60):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.on_evict = on_evict      # on_evict(sid, data) for expired / LRU-dropped entries
+        self.sweep_every = sweep_every
+        self._data = OrderedDict()    # sid -> data dict
+        self._meta = {}               # sid -> [expires_at, user_id, pinned, persisted]
+        self._by_user = {}            # user_id -> set(sid)
+        self._awaiting = {}           # user_id -> sid awaiting a rename reply
+        self._next_sweep = time.monotonic() + sweep_every
+        self.evictions = 0
+        self._writer = None
+        if path:
+            # single writer thread keeps SQLite writes ordered and off the event loop
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+            self._writer.submit(self._init_db).result()
+
+    # ------------ dict-style access (memory only) ------------
+    def __contains__(self, sid):
+        return self.get(sid) is not None
+
+    def __getitem__(self, sid):
+        data = self.get(sid)
+        if data is None:
+            raise KeyError(sid)
+        return data
+
+    def __setitem__(self, sid, data):
+        self.put(sid, data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, sid, default=None):
+        meta = self._meta.get(sid)
+        if meta is None:
+            return default
+        if meta[0] < time.monotonic() and not meta[2]:
+            self._drop(sid, evicted=True)
+            return default
+        self._data.move_to_end(sid)
+        return self._data[sid]
+
+    def items(self):
+        return list(self._data.items())
+
+    # ------------ store API ------------
+    def put(self, sid, data, ttl=None, pinned=False, persist=False):
+        if sid in self._data:
+            self._drop(sid)
+        user_id = data.get("user_id")
+        ttl = ttl or self.ttl
+        self._data[sid] = data
+        self._meta[sid] = [time.monotonic() + ttl, user_id, pinned, bool(persist and self._writer)]
+        if user_id is not None:
+            self._by_user.setdefault(user_id, set()).add(sid)
+        if persist and self._writer:
+            self._writer.submit(self._db_put, sid, data, time.time() + ttl)
+        self._maybe_sweep()
+        while len(self._data) > self.max_size:
+            if not self._evict_lru():
+                break
+        return data
+
+    def pop(self, sid, default=None):
+        data = self._data.get(sid, default)
+        self._drop(sid)
+        return data
+
+    def touch(self, sid, ttl=None):
+        meta = self._meta.get(sid)
+        if meta:
+            meta[0] = time.monotonic() + (ttl or self.ttl)
+
+    def pin(self, sid, pinned=True):
+        meta = self._meta.get(sid)
+        if meta:
+            meta[2] = pinned
+
+    def set_awaiting(self, sid, ttl=None):
+        meta = self._meta.get(sid)
+        if not meta:
+            return
+        meta[2] = False
+        self.touch(sid, ttl)
+        self._data[sid]["awaiting_rename"] = True
+        self._awaiting[meta[1]] = sid
+
+    # -> (sid, data) of the session waiting for this user's rename reply, or (None, None)
+    def awaiting(self, user_id):
+        sid = self._awaiting.get(user_id)
+        if sid is None:
+            return None, None
+        data = self.get(sid)
+        if data is None or not data.get("awaiting_rename"):
+            self._awaiting.pop(user_id, None)
+            return None, None
+        return sid, data
+
+    def clear_awaiting(self, sid):
+        data = self._data.get(sid)
+        if data is not None:
+            data.pop("awaiting_rename", None)
+            uid = self._meta[sid][1]
+            if self._awaiting.get(uid) == sid:
+                del self._awaiting[uid]
+
+    def user_sessions(self, user_id):
+        return [(sid, self._data[sid]) for sid in list(self._by_user.get(user_id, ())) if sid in self._data]
+
+    # memory first, then the persisted copy (e.g. a button pressed after a restart)
+    async def aget(self, sid):
+        data = self.get(sid)
+        if data is not None or not self._writer:
+            return data
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(self._writer, self._db_get, sid)
+        if row is None:
+            return None
+        data, expires_at = row
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return None
+        self.put(sid, data, ttl=remaining)
+        self._meta[sid][3] = True
+        return data
+
+    def stats(self):
+        return {"sessions": len(self._data), "users": len(self._by_user),
+                "awaiting_rename": len(self._awaiting), "evictions": self.evictions}
+
+    # ------------ internals ------------
+    def _drop(self, sid, evicted=False, keep_persisted=False):
+        data = self._data.pop(sid, None)
+        meta = self._meta.pop(sid, None)
+        if meta is None:
+            return
+        uid = meta[1]
+        sids = self._by_user.get(uid)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._by_user[uid]
+        if self._awaiting.get(uid) == sid:
+            del self._awaiting[uid]
+        if meta[3] and not keep_persisted:
+            self._writer.submit(self._db_delete, sid)
+        if evicted:
+            self.evictions += 1
+            if self.on_evict:
+                try:
+                    self.on_evict(sid, data)
+                except Exception:
+                    pass
+
+    def _evict_lru(self):
+        for sid in self._data:
+            if not self._meta[sid][2]:
+                # memory pressure only: a persisted copy can still be reloaded by aget
+                self._drop(sid, evicted=True, keep_persisted=True)
+                return True
+        return False
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_every
+        for sid in [s for s, m in self._meta.items() if m[0] < now and not m[2]]:
+            self._drop(sid, evicted=True)
+        if self._writer:
+            self._writer.submit(self._db_purge)
+
+    def _conn(self):
+        if not hasattr(self, "_db"):
+            self._db = sqlite3.connect(self.path)
+        return self._db
+
+    def _init_db(self):
+        self._conn().execute("CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, expires_at REAL, data BLOB)")
+        self._conn().commit()
+
+    def _db_put(self, sid, data, expires_at):
+        try:
+            blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        self._conn().execute("INSERT OR REPLACE INTO sessions (sid,expires_at,data) VALUES (?,?,?)", (sid, expires_at, blob))
+        self._conn().commit()
+
+    def _db_get(self, sid):
+        r = self._conn().execute("SELECT data, expires_at FROM sessions WHERE sid=?", (sid,)).fetchone()
+        if not r:
+            return None
+        return pickle.loads(r[0]), r[1]
+
+    def _db_delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid=?", (sid,))
+        self._conn().commit()
+
+    def _db_purge(self):
+        self._conn().execute("DELETE FROM sessions WHERE expires_at<?", (time.time(),))
+        self._conn().commit()
+
+    def close(self):
+        if self._writer:
+            self._writer.shutdown(wait=True)
@@ -0,0 +1,92 @@
+# functions/singleflight.py
+import os, asyncio, threading
+
+class Flight:
+    __slots__ = ("key", "task", "future", "participants", "refs", "cancel_event", "cleanup")
+
+    def __init__(self, key, cleanup):
+        self.key = key
+        self.task = None
+        self.future = asyncio.get_running_loop().create_future()
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.participants = 0      # callers still waiting for the result
+        self.refs = 0              # callers still holding the result file
+        self.cancel_event = threading.Event()
+        self.cleanup = cleanup
+
+# Coalesces concurrent identical downloads: the first caller for a key starts
+# the work, later callers attach to it and get the same result (progress is
+# published per key, see functions/progress.py).
+# The result file is removed (or cleanup(result) called) when the last holder releases it.
+class SingleFlight:
+    def __init__(self, cleanup=None):
+        self.cleanup = cleanup or self._remove_file
+        self.flights = {}
+        self.coalesced = 0
+
+    def active(self, key):
+        return key in self.flights
+
+    # fn(flight) -> awaitable result dict with "filepath"
+    async def join(self, key, fn):
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight(key, self.cleanup)
+            self.flights[key] = flight
+            flight.task = asyncio.get_running_loop().create_task(self._lead(flight, fn))
+        else:
+            self.coalesced += 1
+        flight.participants += 1
+        flight.refs += 1
+        try:
+            return flight, await asyncio.shield(flight.future)
+        except BaseException:
+            # failed or cancelled: this caller holds nothing
+            self.release(flight)
+            raise
+        finally:
+            flight.participants -= 1
+            if flight.participants == 0 and not flight.future.done():
+                # everyone walked away: stop the download itself
+                flight.cancel_event.set()
+                flight.task.cancel()
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+
+    async def _lead(self, flight, fn):
+        try:
+            res = await fn(flight)
+            if not flight.future.done():
+                flight.future.set_result(res)
+        except asyncio.CancelledError:
+            if not flight.future.done():
+                flight.future.cancel()
+        except Exception as e:
+            if not flight.future.done():
+                flight.future.set_exception(e)
+        finally:
+            # later requests start a fresh flight (or hit the file_id cache)
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            if flight.refs <= 0:
+                self._cleanup(flight)
+
+    def release(self, flight):
+        flight.refs -= 1
+        if flight.refs <= 0:
+            self._cleanup(flight)
+
+    def _cleanup(self, flight):
+        f = flight.future
+        if f.done() and not f.cancelled() and f.exception() is None:
+            flight.cleanup(f.result())
+
+    def _remove_file(self, res):
+        path = (res or {}).get("filepath")
+        if path:
+            try: os.remove(path)
+            except OSError: pass
+
+    def stats(self):
+        return {"in_flight": len(self.flights), "coalesced": self.coalesced,
+                "waiting": sum(f.participants for f in self.flights.values())}
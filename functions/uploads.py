@@ -0,0 +1,145 @@
+# functions/uploads.py
+import os, time, asyncio, itertools
+
+# Concurrent uploads of split parts. Parts are uploaded in parallel (bounded by
+# `parallel`) over a pool of client sessions to a staging chat (the storage
+# channel); the user then gets them in order by file_id, which is instant.
+# Each part is retried on its own; FloodWait sleeps the requested time first.
+# Without a staging chat, parts go straight to the user one at a time.
+class UploadPool:
+    def __init__(self, main, extra_clients=(), stage_chat=None, parallel=3, retries=3, flood_exc=None):
+        self.main = main                  # the bot's own (already running) client: delivers the parts
+        self.extra = list(extra_clients)  # more sessions of the same bot, started on first use
+        self.stage_chat = stage_chat
+        self.parallel = max(1, parallel)
+        self.retries = retries
+        self.flood_exc = flood_exc
+        self._sem = asyncio.Semaphore(self.parallel)
+        self._rr = itertools.count()
+        self._started = False
+        self._start_lock = asyncio.Lock()
+        self.parts = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.retried = 0
+        self.failed = 0
+        self.last_rates = []              # MB/s per part of the most recent batch
+
+    async def _clients(self):
+        if not self._started:
+            async with self._start_lock:
+                if not self._started:
+                    for c in self.extra:
+                        try:
+                            await c.start()
+                        except Exception:
+                            # a session that can't start is simply left out
+                            self.extra = [x for x in self.extra if x is not c]
+                    self._started = True
+        return [self.main] + self.extra
+
+    # parts: FileParts / paths in delivery order -> parts sent
+    async def send_parts(self, chat_id, parts, caption):
+        if self.stage_chat is None:
+            return await self._send_sequential(chat_id, parts, caption)
+        clients = await self._clients()
+        queue = asyncio.Queue()
+        rates = []
+        deliver = asyncio.ensure_future(self._deliver(chat_id, queue, caption))
+        uploads = []
+        try:
+            for part in parts:
+                t = asyncio.ensure_future(self._upload(clients, part, rates))
+                uploads.append(t)
+                queue.put_nowait(t)
+            queue.put_nowait(None)
+            sent = await deliver
+        except BaseException:
+            deliver.cancel()
+            for t in uploads:
+                t.cancel()
+            await asyncio.gather(*uploads, return_exceptions=True)
+            raise
+        self.last_rates = rates
+        return sent
+
+    async def _deliver(self, chat_id, queue, caption):
+        sent = 0
+        while True:
+            t = await queue.get()
+            if t is None:
+                return sent
+            file_id = await t
+            await self._retry(lambda: self.main.send_cached_media(chat_id, file_id, caption=caption))
+            sent += 1
+
+    async def _upload(self, clients, part, rates):
+        try:
+            async with self._sem:
+                client = clients[next(self._rr) % len(clients)]
+                size = _size(part)
+                started = time.monotonic()
+                msg = await self._retry(lambda: client.send_document(self.stage_chat, _rewind(part), file_name=_name(part)))
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.parts += 1
+                self.bytes += size
+                self.seconds += elapsed
+                rates.append(round(size / elapsed / (1024 * 1024), 2))
+                return (msg.document or msg.video).file_id
+        finally:
+            if hasattr(part, "close"):
+                part.close()
+
+    async def _retry(self, call):
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.flood_exc is not None and isinstance(e, self.flood_exc):
+                    await asyncio.sleep(getattr(e, "value", 0) or 0)
+                elif attempt >= self.retries:
+                    self.failed += 1
+                    raise
+                else:
+                    await asyncio.sleep(2 ** attempt)
+                attempt += 1
+                self.retried += 1
+
+    async def _send_sequential(self, chat_id, parts, caption):
+        sent = 0
+        for part in parts:
+            try:
+                await self._retry(lambda: self.main.send_document(chat_id, _rewind(part), file_name=_name(part), caption=caption))
+            finally:
+                if hasattr(part, "close"):
+                    part.close()
+            sent += 1
+        return sent
+
+    def stats(self):
+        return {"sessions": 1 + len(self.extra), "parallel": self.parallel, "parts": self.parts,
+                "bytes": self.bytes, "retried": self.retried, "failed": self.failed,
+                "avg_mb_s": round(self.bytes / self.seconds / (1024 * 1024), 2) if self.seconds else 0.0,
+                "last_rates": self.last_rates}
+
+    async def close(self):
+        for c in self.extra if self._started else ():
+            try:
+                await c.stop()
+            except Exception:
+                pass
+
+def _size(part):
+    return part.length if hasattr(part, "length") else os.path.getsize(part)
+
+def _name(part):
+    return getattr(part, "name", None) or os.path.basename(part)
+
+def _rewind(part):
+    # a retried FilePart starts from its first byte again
+    if hasattr(part, "seek"):
+        part.seek(0)
+    return part
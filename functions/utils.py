@@ -1,5 +1,6 @@
 # functions/utils.py
-import math
+import math, re
+from urllib.parse import urlsplit, parse_qs
 
 def human_size(bytesize):
     if bytesize is None:
@@ -13,3 +14,33 @@ def human_size(bytesize):
     units = ["B", "KB", "MB", "GB", "TB"]
     i = int(math.floor(math.log(max(bytesize,1), 1024)))
     return f"{bytesize / (1024 ** i):.2f} {units[i]}"
+
+# Canonical 11-char YouTube video id from watch / youtu.be / shorts / live /
+# embed / music URLs, or None. Regex first since it covers nearly every paste.
+_ID = r"([A-Za-z0-9_-]{11})"
+_VIDEO_ID_RES = [
+    re.compile(r"(?:https?://)?(?:www\.|m\.|music\.)?youtube\.com/watch\?(?:[^#]*&)?v=" + _ID + r"(?![A-Za-z0-9_-])"),
+    re.compile(r"(?:https?://)?(?:www\.)?youtu\.be/" + _ID + r"(?![A-Za-z0-9_-])"),
+    re.compile(r"(?:https?://)?(?:www\.|m\.|music\.)?youtube(?:-nocookie)?\.com/(?:shorts|live|embed|v)/" + _ID + r"(?![A-Za-z0-9_-])"),
+]
+
+def extract_video_id(url):
+    if not url:
+        return None
+    url = url.strip()
+    for r in _VIDEO_ID_RES:
+        m = r.match(url)
+        if m:
+            return m.group(1)
+    # slower path for odd orderings / attribution_link etc.
+    try:
+        parts = urlsplit(url if "://" in url else "https://" + url)
+    except ValueError:
+        return None
+    host = (parts.hostname or "").lower()
+    if not any(host == d or host.endswith("." + d) for d in ("youtube.com", "youtu.be")):
+        return None
+    v = parse_qs(parts.query).get("v")
+    if v and re.fullmatch(_ID, v[0]):
+        return v[0]
+    return None
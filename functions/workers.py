@@ -0,0 +1,133 @@
+# functions/workers.py
+import asyncio, itertools, threading, time, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# yt-dlp's extractors and format sorting are pure Python and hold the GIL, so
+# they run in worker processes. IPC is one manager queue of
+# (token, kind, payload) events from workers back to the bot, plus a shared
+# dict of cancelled tokens the workers poll.
+
+_events = None
+_cancelled = None
+
+# progress callbacks fire per downloaded chunk; each queue put is a manager round trip
+_EMIT_INTERVAL = 0.5
+
+def _init_worker(events, cancelled):
+    global _events, _cancelled
+    _events, _cancelled = events, cancelled
+
+def _run_in_worker(token, fn, args):
+    sent = [None, 0.0]
+    def emit(kind, payload=None):
+        # repeats of a kind (download progress) at most every _EMIT_INTERVAL; a new kind
+        # (finished, converting...) goes out right away
+        now = time.monotonic()
+        if kind == sent[0] and now - sent[1] < _EMIT_INTERVAL:
+            return
+        sent[0], sent[1] = kind, now
+        _events.put((token, kind, payload))
+    last = [0.0, False]
+    def is_cancelled():
+        # one manager round trip at most every 0.5s, not per progress callback
+        now = time.monotonic()
+        if now - last[0] > 0.5:
+            last[0] = now
+            last[1] = token in _cancelled
+        return last[1]
+    return fn(*args, on_progress=emit, is_cancelled=is_cancelled)
+
+class WorkerPool:
+    def __init__(self, workers, max_tasks_per_child=50):
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self._ctx = multiprocessing.get_context("spawn")
+        self._manager = None
+        self._executor = None
+        self._listeners = {}
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        self.recycles = 0
+
+    def _start(self):
+        with self._lock:
+            if self._manager is None:
+                self._manager = self._ctx.Manager()
+                self._events = self._manager.Queue()
+                self._cancelled = self._manager.dict()
+                threading.Thread(target=self._listen, name="worker-events", daemon=True).start()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=self._ctx, initializer=_init_worker,
+                                                     initargs=(self._events, self._cancelled),
+                                                     max_tasks_per_child=self.max_tasks_per_child)
+            return self._executor
+
+    def _recycle(self, broken):
+        # a worker died (OOM, segfault in a native lib...): replace the whole pool once
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+                self.recycles += 1
+                broken.shutdown(wait=False, cancel_futures=True)
+
+    def _listen(self):
+        while True:
+            try:
+                item = self._events.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            token, kind, payload = item
+            cb = self._listeners.get(token)
+            if cb is not None:
+                try:
+                    cb(kind, payload)
+                except Exception:
+                    pass
+
+    # Run fn(*args, on_progress=..., is_cancelled=...) in a worker. on_event(kind, payload)
+    # is called from the listener thread for every event the worker emits.
+    async def run(self, fn, *args, on_event=None, retries=1):
+        loop = asyncio.get_running_loop()
+        token = next(self._tokens)
+        if on_event is not None:
+            self._listeners[token] = on_event
+        try:
+            while True:
+                executor = self._start()
+                try:
+                    return await loop.run_in_executor(executor, _run_in_worker, token, fn, args)
+                except BrokenProcessPool:
+                    self._recycle(executor)
+                    if retries <= 0:
+                        raise
+                    retries -= 1
+        except asyncio.CancelledError:
+            self._cancelled[token] = True
+            # the worker polls the flag; drop it once it has had time to notice
+            loop.call_later(5, self._forget, token)
+            raise
+        finally:
+            self._listeners.pop(token, None)
+
+    def _forget(self, token):
+        try:
+            self._cancelled.pop(token, None)
+        except Exception:
+            pass
+
+    def stats(self):
+        return {"workers": self.workers, "recycles": self.recycles, "active_listeners": len(self._listeners)}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._manager is not None:
+                try: self._events.put(None)
+                except Exception: pass
+                self._manager.shutdown()
+                self._manager = None
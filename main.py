@@ -1,9 +1,11 @@
 # main.py
 import asyncio
-from bot import app
-import database
 
 # Ensure DB file exists for JSON fallback (database import handles creation)
-print("Starting Inert Downloader Bot...")
-asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
-app.run()
+# guarded: yt-dlp worker processes are spawned and re-import this module
+if __name__ == "__main__":
+    import bot
+    import database
+    print("Starting Inert Downloader Bot...")
+    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    bot.main()
@@ -12,6 +12,8 @@ HELP = (
     "/help - this help\n"
     "/add_premium [user_id] [days] - owner only\n"
     "/rmpremium [user_id] - owner only\n"
+    "/stats [days] - usage statistics (owner only)\n"
+    "/perf - stage timings and counters (owner only)\n"
     "/check_premium - check your premium status\n"
 )
 
@@ -30,7 +32,17 @@ FAILED_INFO = "⚠️ Failed to fetch info: {error}"
 PREPARING_DOWNLOAD = "⏳ Preparing download..."
 DOWNLOAD_FINISHED = "✅ Download finished, preparing upload..."
 FILE_TOO_LARGE = "⚠️ File too large to send via Telegram ({size}). I can store in storage channel or split (Premium only)."
+TOO_LARGE_PREFLIGHT = "⚠️ This quality would be about {size}, over Telegram's upload limit. Pick a lower quality or ⭐ Best that fits — Premium gets larger files in parts."
+NOTHING_FITS = "⚠️ No quality with a known size fits in one upload."
+WILL_SPLIT = "Download started. About {size} — it will arrive in {parts} parts."
+QUEUED = "⏳ Queued — position {pos}. Gold/Platinum jobs skip the line."
+QUEUE_FULL = "⚠️ You already have the maximum number of downloads queued. Wait for one to finish."
+DL_CANCELLED = "✖️ Download cancelled."
+JOINED_DOWNLOAD = "🔗 Someone is already downloading this — you'll get the same file as soon as it's ready."
+SENT_FROM_CACHE = "⚡ Sent instantly from cache."
+DISK_FULL = "⚠️ The server is short on disk space right now. Please try again in a few minutes."
 DL_ERROR = "❌ Download error: {error}"
+PERF_DISABLED = "📉 Metrics are off (METRICS_ENABLED=0)."
 FREE_LIMIT_REACHED = "⚠️ You reached your free daily download limit ({limit}/day). Upgrade to Premium to remove the limit."
 RENAME_PROMPT = "✏️ Send the new filename (without extension) — Premium only. Reply /skip to keep original."
 ENTER_CAPTION = "📝 Send a custom caption for the upload or /skip."
@@ -0,0 +1,126 @@
+# storage/base.py
+import time, datetime
+
+def now_ts():
+    return int(time.time())
+
+def parse_until(until):
+    if not until:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(until)
+    except Exception:
+        return None
+
+# ------------ Materialized statistics ------------
+# Every backend keeps counters next to the download history, updated in the same
+# write as the records: one bucket for all time ("all") and one per UTC day, plus
+# per-video totals. /stats reads those instead of scanning the history.
+COUNTERS = ("downloads", "bytes", "audio", "video")
+
+# [(title, filesize, created_at ISO, kind, video_id)] ->
+# ({bucket: (downloads, bytes, audio, video)}, {video_id: (title, downloads, bytes)})
+def tally(records):
+    buckets, videos = {}, {}
+    for title, filesize, created_at, kind, video_id in records:
+        inc = (1, filesize or 0, int(kind == "audio"), int(kind == "video"))
+        for b in ("all", created_at[:10]):
+            cur = buckets.get(b, (0, 0, 0, 0))
+            buckets[b] = tuple(x + y for x, y in zip(cur, inc))
+        if video_id:
+            _, n, size = videos.get(video_id, (title, 0, 0))
+            videos[video_id] = (title, n + 1, size + (filesize or 0))
+    return buckets, videos
+
+# the last `days` UTC days, newest first
+def window_days(days):
+    today = datetime.datetime.utcnow().date()
+    return [(today - datetime.timedelta(days=i)).isoformat() for i in range(days)]
+
+# the shape every Storage.stats() returns
+def stats_result(buckets, window, top, premium):
+    def row(b):
+        return dict(zip(COUNTERS, buckets.get(b) or (0, 0, 0, 0)))
+    return {"total": row("all"), "days": [dict(row(d), day=d) for d in window],
+            "top": [dict(zip(("video_id", "title", "downloads", "bytes"), t)) for t in top], "premium": premium}
+
+# Common interface every backend implements. All methods are blocking and
+# must be safe to call from any thread; database.py runs them off the event loop.
+# A backend with is_async = True implements them as coroutines instead, which
+# database.py awaits on the event loop after awaiting start() once.
+class Storage:
+    name = "base"
+    is_async = False
+
+    def start(self):
+        pass
+
+    # kind is "audio"/"video"; kind and video_id feed the statistics
+    def add_download_record(self, user_id, title, filepath, filesize, kind=None, video_id=None):
+        raise NotImplementedError
+
+    def add_premium(self, user_id, days, plan="Gold"):
+        raise NotImplementedError
+
+    def remove_premium(self, user_id):
+        raise NotImplementedError
+
+    # -> dict with premium_until, plan, daily_count, last_reset (missing keys = unset)
+    def user_info(self, user_id):
+        raise NotImplementedError
+
+    def premium_info(self, user_id):
+        u = self.user_info(user_id)
+        return u.get("premium_until"), u.get("plan")
+
+    def can_download_free(self, user_id, free_limit):
+        raise NotImplementedError
+
+    # -> (daily_count, last_reset) after the increment
+    def increment_daily_count(self, user_id):
+        raise NotImplementedError
+
+    # Check-and-consume n downloads of the free quota in one atomic step, so two
+    # concurrent clicks can't both get the last slot.
+    # -> (allowed, daily_count, last_reset) after the attempt
+    def try_consume_quota(self, user_id, free_limit, n=1):
+        raise NotImplementedError
+
+    # Write-behind of counters kept in memory (storage.cache.QuotaLimiter):
+    # [(user_id, daily_count, last_reset)] written as one batch
+    def record_quota_batch(self, items):
+        raise NotImplementedError
+
+    def count_downloads(self):
+        raise NotImplementedError
+
+    # -> stats_result(): all-time totals, the last `days` days (newest first),
+    # the `top` most downloaded videos and the number of active premium users
+    def stats(self, days=7, top=5):
+        raise NotImplementedError
+
+    # ------------ Telegram file cache ------------
+    # key: (video_id, format_id, kind "audio"/"video", rename or None)
+    # -> dict(file_id, chat_id, message_id, filesize) for a still-valid entry, else None
+    def get_cached_file(self, video_id, format_id, kind, rename=None):
+        raise NotImplementedError
+
+    def put_cached_file(self, video_id, format_id, kind, rename, file_id=None, chat_id=None, message_id=None, filesize=0):
+        raise NotImplementedError
+
+    def invalidate_cached_file(self, video_id, format_id, kind, rename=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    # derived from premium_info so each backend only needs one lookup
+    def is_premium(self, user_id):
+        until = parse_until(self.premium_info(user_id)[0])
+        return bool(until and until > datetime.datetime.utcnow())
+
+    def get_remaining_days(self, user_id):
+        until = parse_until(self.premium_info(user_id)[0])
+        if not until:
+            return 0
+        return max(0, (until - datetime.datetime.utcnow()).days)
@@ -0,0 +1,190 @@
+# storage/cache.py
+import time, threading, datetime
+from collections import OrderedDict
+from storage.base import parse_until
+
+class Entitlement:
+    __slots__ = ("premium_until", "plan", "daily_count", "last_reset", "expires")
+
+    def __init__(self, premium_until, plan, daily_count, last_reset, expires):
+        self.premium_until = premium_until  # epoch seconds, 0 if not premium
+        self.plan = plan
+        self.daily_count = daily_count
+        self.last_reset = last_reset
+        self.expires = expires
+
+    def is_premium(self, now=None):
+        return self.premium_until > (now or time.time())
+
+    def remaining_days(self, now=None):
+        return max(0, int((self.premium_until - (now or time.time())) // 86400))
+
+    def can_download_free(self, free_limit, now=None):
+        if (now or time.time()) - self.last_reset > 86400:
+            return 0 < free_limit
+        return self.daily_count < free_limit
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def to_epoch(until):
+    dt = parse_until(until)
+    if not dt:
+        return 0
+    # premium_until is stored as naive UTC ISO text
+    return int((dt - _EPOCH).total_seconds())
+
+# Per-user premium + quota state with TTL and LRU eviction. Writes go through
+# database.py which refreshes or drops the entry, so the TTL only bounds how
+# long out-of-band edits (another process, manual DB changes) stay invisible.
+class EntitlementCache:
+    def __init__(self, ttl=300, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        with self._lock:
+            e = self._data.get(user_id)
+            if e is None or e.expires < time.monotonic():
+                if e is not None:
+                    del self._data[user_id]
+                self.misses += 1
+                return None
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return e
+
+    def put(self, user_id, info):
+        e = Entitlement(to_epoch(info.get("premium_until")), info.get("plan"),
+                        info.get("daily_count") or 0, info.get("last_reset") or 0,
+                        time.monotonic() + self.ttl)
+        with self._lock:
+            self._data[user_id] = e
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return e
+
+    def update_quota(self, user_id, daily_count, last_reset):
+        with self._lock:
+            e = self._data.get(user_id)
+            if e is not None:
+                e.daily_count = daily_count
+                e.last_reset = last_reset
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_ratio": (self.hits / total) if total else 0.0}
+
+# Free-quota counters held in memory, so the check-and-consume behind every
+# download click is a dict update under a lock: atomic within the process, no
+# storage round trip. A user's window is the 24h from their first download in
+# it (the rule the backends apply too, so persisted counters stay consistent).
+# Writes go behind: a flusher thread persists the latest counters of every
+# user that changed, as one batch every `interval` seconds (and on close).
+class QuotaLimiter:
+    def __init__(self, flush, interval=2.0, window=86400, max_size=100000):
+        self._flush = flush         # flush([(user_id, daily_count, last_reset)])
+        self.interval = interval
+        self.window = window
+        self.max_size = max_size
+        self._state = OrderedDict() # user_id -> [daily_count, last_reset]
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.allowed = 0
+        self.denied = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self._thread = threading.Thread(target=self._flusher, name="quota-flush", daemon=True)
+        self._thread.start()
+
+    def known(self, user_id):
+        return user_id in self._state
+
+    # first sight of a user: their persisted counters (ignored if already known)
+    def seed(self, user_id, daily_count, last_reset):
+        with self._lock:
+            if user_id not in self._state:
+                self._state[user_id] = [daily_count or 0, last_reset or 0]
+                self._evict()
+
+    # -> (allowed, daily_count, last_reset)
+    def try_consume(self, user_id, limit, n=1):
+        now = int(time.time())
+        with self._lock:
+            st = self._state.setdefault(user_id, [0, 0])
+            self._state.move_to_end(user_id)
+            if now - st[1] > self.window:
+                st[0], st[1] = 0, now
+            if st[0] + n > limit:
+                self.denied += 1
+                return False, st[0], st[1]
+            st[0] += n
+            self._dirty.add(user_id)
+            self.allowed += 1
+            return True, st[0], st[1]
+
+    # read-only check; None when the user isn't known here
+    def peek(self, user_id, limit):
+        with self._lock:
+            st = self._state.get(user_id)
+            if st is None:
+                return None
+            return int(time.time()) - st[1] > self.window or st[0] < limit
+
+    def forget(self, user_id):
+        with self._lock:
+            self._state.pop(user_id, None)
+            self._dirty.discard(user_id)
+
+    def _evict(self):
+        # never drop counters that aren't persisted yet
+        if len(self._state) <= self.max_size:
+            return
+        for uid in list(self._state):
+            if len(self._state) <= self.max_size:
+                break
+            if uid not in self._dirty:
+                del self._state[uid]
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            items = [(uid, *self._state[uid]) for uid in dirty if uid in self._state]
+        if not items:
+            return
+        try:
+            self._flush(items)
+            self.flushes += 1
+        except Exception:
+            self.flush_errors += 1
+            with self._lock:
+                self._dirty.update(uid for uid, _, _ in items)
+
+    def _flusher(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        return {"users": len(self._state), "pending": len(self._dirty), "allowed": self.allowed,
+                "denied": self.denied, "flushes": self.flushes, "flush_errors": self.flush_errors}
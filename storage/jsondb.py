@@ -0,0 +1,315 @@
+# storage/jsondb.py
+import os, json, heapq, threading, datetime
+from storage.base import Storage, now_ts, tally, window_days, stats_result
+
+# JSON fallback as an in-memory state plus append-only logs:
+#   bot.json                   snapshot of users + file cache + statistics counters (rewritten atomically
+#                              on compaction); counters are caught up from the history past stats_offset
+#   bot.json.journal           one full record per line, replayed over the snapshot
+#   bot.json.downloads.jsonl   download history, append-only and never rewritten
+# Every write is an O(1) append; reads never touch disk.
+class JSONStorage(Storage):
+    name = "json"
+
+    def __init__(self, path, compact_interval=60, compact_ops=1000, fsync=False):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.rotated_path = path + ".journal.1"
+        self.downloads_path = path + ".downloads.jsonl"
+        self.compact_ops = compact_ops
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self.users = {}
+        self.files = {}
+        self.download_count = 0
+        self.counters = {}      # bucket -> [downloads, bytes, audio, video]
+        self.videos = {}        # video_id -> [title, downloads, bytes]
+        self.premium = {}       # user key -> premium_until
+        self._load()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._downloads = open(self.downloads_path, "a", encoding="utf-8")
+        self._journal_ops = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._compactor, args=(compact_interval,), name="json-compact", daemon=True)
+        self._thread.start()
+
+    # ------------ load / replay ------------
+    def _load(self):
+        legacy = []
+        stats_offset = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.users = data.get("users", {})
+            self.files = data.get("files", {})
+            if "stats" in data:
+                self.counters = data["stats"]["counters"]
+                self.videos = data["stats"]["videos"]
+                stats_offset = data["stats"]["offset"]
+            # migrate the old single-file layout's history into the append-only log
+            legacy = data.get("downloads", [])
+        for p in (self.rotated_path, self.journal_path, self.downloads_path):
+            self._repair_tail(p)
+        for p in (self.rotated_path, self.journal_path):
+            self._replay(p)
+        if legacy:
+            with open(self.downloads_path, "a", encoding="utf-8") as f:
+                for rec in legacy:
+                    f.write(json.dumps(rec) + "\n")
+                f.flush(); os.fsync(f.fileno())
+        self.download_count = self._count_lines(self.downloads_path)
+        self._catch_up_stats(stats_offset)
+        self._stats_offset = stats_offset
+        self.premium = {k: u["premium_until"] for k, u in self.users.items() if u.get("premium_until")}
+        if legacy or not os.path.exists(self.path):
+            offset = os.path.getsize(self.downloads_path) if os.path.exists(self.downloads_path) else 0
+            self._write_snapshot(self.users, self.files, self._stats_snapshot(offset))
+            self._stats_offset = offset
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    # torn final line from a crash mid-append
+                    continue
+                if "u" in op:
+                    self.users[op["id"]] = op["u"]
+                else:
+                    self.files[op["id"]] = op["f"]
+
+    def _catch_up_stats(self, offset):
+        # history appended after the snapshot's counters (all of it without them)
+        if not os.path.exists(self.downloads_path):
+            return
+        if offset > os.path.getsize(self.downloads_path):
+            self.counters, self.videos, offset = {}, {}, 0
+        records = []
+        with open(self.downloads_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue
+                records.append((r.get("title"), r.get("filesize"), r.get("created_at") or "", r.get("kind"), r.get("video_id")))
+        self._bump_stats(records)
+
+    def _bump_stats(self, records):
+        buckets, videos = tally(records)
+        for b, inc in buckets.items():
+            cur = self.counters.setdefault(b, [0, 0, 0, 0])
+            for i, x in enumerate(inc):
+                cur[i] += x
+        for vid, (title, n, size) in videos.items():
+            cur = self.videos.setdefault(vid, [title, 0, 0])
+            cur[0], cur[1], cur[2] = title, cur[1] + n, cur[2] + size
+
+    def _stats_snapshot(self, offset):
+        # caller holds self._lock; offset = history size the counters cover
+        return {"counters": {k: list(v) for k, v in self.counters.items()},
+                "videos": {k: list(v) for k, v in self.videos.items()}, "offset": offset}
+
+    def _repair_tail(self, path):
+        # drop a partially written last record so later appends start on a clean line
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            good = f.read().rfind(b"\n") + 1
+            f.truncate(good)
+
+    def _count_lines(self, path):
+        if not os.path.exists(path):
+            return 0
+        n = 0
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                n += block.count(b"\n")
+        return n
+
+    # ------------ write path ------------
+    def _append(self, fh, line):
+        fh.write(line + "\n")
+        fh.flush()
+        if self.fsync:
+            os.fsync(fh.fileno())
+
+    def _log(self, op):
+        # caller holds self._lock; records are replaced, never mutated in place,
+        # so the compactor can snapshot with a shallow copy
+        self._append(self._journal, json.dumps(op))
+        self._journal_ops += 1
+        if self._journal_ops >= self.compact_ops:
+            self._wake.set()
+
+    def _put_user(self, user_id, u):
+        key = str(user_id)
+        self.users[key] = u
+        if u.get("premium_until"):
+            self.premium[key] = u["premium_until"]
+        else:
+            self.premium.pop(key, None)
+        self._log({"id": key, "u": u})
+
+    def _put_file(self, key, f):
+        self.files[key] = f
+        self._log({"id": key, "f": f})
+
+    def _get_user(self, user_id):
+        return dict(self.users.get(str(user_id), {}))
+
+    # ------------ compaction ------------
+    def _write_snapshot(self, users, files, stats):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"users": users, "files": files, "stats": stats}, f)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def compact(self):
+        with self._compact_lock:
+            with self._lock:
+                offset = self._downloads.tell()
+                # new history alone also counts: the snapshot's counters bound the replay at startup
+                if self._journal_ops == 0 and offset == self._stats_offset and not os.path.exists(self.rotated_path):
+                    return
+                users = dict(self.users)
+                files = dict(self.files)
+                stats = self._stats_snapshot(offset)
+                self._stats_offset = offset
+                # rotate so appends continue while the snapshot is written
+                self._journal.close()
+                os.replace(self.journal_path, self.rotated_path)
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+                self._journal_ops = 0
+            self._write_snapshot(users, files, stats)
+            os.remove(self.rotated_path)
+
+    def _compactor(self, interval):
+        while not self._stop.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.compact()
+            except Exception:
+                pass
+
+    # ------------ Storage API ------------
+    def add_download_record(self, user_id, title, filepath, filesize, kind=None, video_id=None):
+        created = datetime.datetime.utcnow().isoformat()
+        line = json.dumps({"user_id": user_id, "title": title, "filepath": filepath, "filesize": filesize, "created_at": created,
+                           "kind": kind, "video_id": video_id})
+        with self._lock:
+            self._append(self._downloads, line)
+            self.download_count += 1
+            self._bump_stats([(title, filesize, created, kind, video_id)])
+
+    def add_premium(self, user_id, days, plan="Gold"):
+        until = (datetime.datetime.utcnow() + datetime.timedelta(days=int(days))).isoformat()
+        with self._lock:
+            u = self._get_user(user_id)
+            u.update({"premium_until": until, "plan": plan, "daily_count": 0, "last_reset": now_ts()})
+            self._put_user(user_id, u)
+
+    def remove_premium(self, user_id):
+        with self._lock:
+            u = self._get_user(user_id)
+            u.pop("premium_until", None)
+            u.pop("plan", None)
+            self._put_user(user_id, u)
+
+    def user_info(self, user_id):
+        return self._get_user(user_id)
+
+    def can_download_free(self, user_id, free_limit):
+        ts = now_ts()
+        with self._lock:
+            u = self._get_user(user_id)
+            if ts - u.get("last_reset", 0) > 86400:
+                u["daily_count"] = 0
+                u["last_reset"] = ts
+                self._put_user(user_id, u)
+            return u.get("daily_count", 0) < free_limit
+
+    def increment_daily_count(self, user_id):
+        ts = now_ts()
+        with self._lock:
+            u = self._get_user(user_id)
+            if ts - u.get("last_reset", 0) > 86400:
+                u["daily_count"] = 1
+                u["last_reset"] = ts
+            else:
+                u["daily_count"] = u.get("daily_count", 0) + 1
+            self._put_user(user_id, u)
+            return u["daily_count"], u["last_reset"]
+
+    def try_consume_quota(self, user_id, free_limit, n=1):
+        ts = now_ts()
+        with self._lock:
+            u = self._get_user(user_id)
+            count, last = u.get("daily_count", 0), u.get("last_reset", 0)
+            if ts - last > 86400:
+                count, last = 0, ts
+            if count + n > free_limit:
+                return False, count, last
+            u["daily_count"], u["last_reset"] = count + n, last
+            self._put_user(user_id, u)
+            return True, count + n, last
+
+    def record_quota_batch(self, items):
+        with self._lock:
+            for user_id, count, last in items:
+                u = self._get_user(user_id)
+                u["daily_count"], u["last_reset"] = count, last
+                self._put_user(user_id, u)
+
+    def count_downloads(self):
+        return self.download_count
+
+    def stats(self, days=7, top=5):
+        window = window_days(days)
+        now = datetime.datetime.utcnow().isoformat()
+        with self._lock:
+            buckets = {b: tuple(self.counters[b]) for b in ["all"] + window if b in self.counters}
+            top_rows = [(vid, *v) for vid, v in heapq.nlargest(top, self.videos.items(), key=lambda kv: kv[1][1])]
+            premium = sum(1 for until in self.premium.values() if until > now)
+        return stats_result(buckets, window, top_rows, premium)
+
+    def _file_key(self, video_id, format_id, kind, rename):
+        return f"{video_id}|{format_id}|{kind}|{rename or ''}"
+
+    def get_cached_file(self, video_id, format_id, kind, rename=None):
+        f = self.files.get(self._file_key(video_id, format_id, kind, rename))
+        if not f or not f.get("valid"):
+            return None
+        return {k: f.get(k) for k in ("file_id", "chat_id", "message_id", "filesize")}
+
+    def put_cached_file(self, video_id, format_id, kind, rename, file_id=None, chat_id=None, message_id=None, filesize=0):
+        f = {"file_id": file_id, "chat_id": chat_id, "message_id": message_id, "filesize": filesize, "valid": True, "created_at": now_ts()}
+        with self._lock:
+            self._put_file(self._file_key(video_id, format_id, kind, rename), f)
+
+    def invalidate_cached_file(self, video_id, format_id, kind, rename=None):
+        key = self._file_key(video_id, format_id, kind, rename)
+        with self._lock:
+            f = self.files.get(key)
+            if f and f.get("valid"):
+                self._put_file(key, dict(f, valid=False))
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.compact()
+        with self._lock:
+            self._journal.close()
+            self._downloads.close()
@@ -0,0 +1,223 @@
+# storage/mongo.py
+import asyncio, datetime
+from pymongo import ReturnDocument, UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from storage.base import Storage, now_ts, tally, window_days, stats_result, COUNTERS
+
+_USER_FIELDS = {"_id": 0, "premium_until": 1, "plan": 1, "daily_count": 1, "last_reset": 1}
+_QUOTA_FIELDS = {"daily_count": 1, "last_reset": 1}
+_FILE_FIELDS = {"_id": 0, "file_id": 1, "chat_id": 1, "message_id": 1, "filesize": 1}
+
+# Async backend on motor: every method is a coroutine awaited on the bot's own
+# event loop (no thread hop). Indexes are created once by start(): unique keys
+# for users and the file cache, (user_id, created_at) for per-user history, and
+# an optional TTL on download records. Download records are buffered and written
+# with one unordered insert_many every bulk_interval seconds or bulk_size records;
+# their statistics follow as $inc bulk writes (see storage.base.tally).
+class MongoStorage(Storage):
+    name = "mongo"
+    is_async = True
+
+    def __init__(self, uri, db_name="inert_downloader_db", pool_size=50, min_pool_size=0,
+                 connect_timeout_ms=5000, server_timeout_ms=5000, socket_timeout_ms=20000,
+                 history_ttl_days=0, bulk_interval=0.05, bulk_size=500, client=None):
+        if client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            client = AsyncIOMotorClient(uri, maxPoolSize=pool_size, minPoolSize=min_pool_size,
+                                        connectTimeoutMS=connect_timeout_ms,
+                                        serverSelectionTimeoutMS=server_timeout_ms,
+                                        socketTimeoutMS=socket_timeout_ms)
+        self.client = client
+        self.db = client.get_database(db_name)
+        self.users = self.db.get_collection("users")
+        self.downloads = self.db.get_collection("downloads")
+        self.file_cache = self.db.get_collection("file_cache")
+        self.stats_coll = self.db.get_collection("stats")
+        self.stats_videos = self.db.get_collection("stats_videos")
+        self.history_ttl_days = history_ttl_days
+        self.bulk_interval = bulk_interval
+        self.bulk_size = bulk_size
+        self._pending = []
+        self._wake = None
+        self._writer = None
+        self._closing = False
+        self.bulk_writes = 0
+
+    async def start(self):
+        await self.users.create_index("user_id", unique=True)
+        await self.file_cache.create_index([("video_id", ASCENDING), ("format_id", ASCENDING),
+                                            ("kind", ASCENDING), ("rename", ASCENDING)], unique=True)
+        await self.downloads.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+        await self.downloads.create_index("created_at")
+        await self.users.create_index("premium_until")
+        await self.stats_videos.create_index([("downloads", DESCENDING)])
+        if await self.stats_coll.find_one({"_id": "all"}, {"_id": 1}) is None:
+            await self._seed_stats()
+        if self.history_ttl_days:
+            ttl = int(self.history_ttl_days * 86400)
+            try:
+                await self.downloads.create_index("created", expireAfterSeconds=ttl)
+            except OperationFailure:
+                # the TTL index exists with another expiry: change it in place
+                await self.db.command("collMod", "downloads",
+                                      index={"keyPattern": {"created": 1}, "expireAfterSeconds": ttl})
+        if self.bulk_interval > 0 and self._writer is None:
+            self._wake = asyncio.Event()
+            self._writer = asyncio.ensure_future(self._bulk_writer())
+
+    async def _seed_stats(self):
+        # first start with counters: seed them from the existing history once
+        by_day = await self.downloads.aggregate([{"$group": {"_id": {"$substrBytes": ["$created_at", 0, 10]}, "downloads": {"$sum": 1},
+                                                              "bytes": {"$sum": {"$ifNull": ["$filesize", 0]}}}}]).to_list(None)
+        total = {"downloads": sum(d["downloads"] for d in by_day), "bytes": sum(d["bytes"] for d in by_day)}
+        ops = [UpdateOne({"_id": d["_id"]}, {"$set": {"downloads": d["downloads"], "bytes": d["bytes"]}}, upsert=True) for d in by_day]
+        ops.append(UpdateOne({"_id": "all"}, {"$set": total}, upsert=True))
+        await self.stats_coll.bulk_write(ops, ordered=False)
+
+    async def _bump_stats(self, docs):
+        buckets, videos = tally((d["title"], d["filesize"], d["created_at"], d["kind"], d["video_id"]) for d in docs)
+        await self.stats_coll.bulk_write([UpdateOne({"_id": b}, {"$inc": dict(zip(COUNTERS, v))}, upsert=True)
+                                          for b, v in buckets.items()], ordered=False)
+        if videos:
+            await self.stats_videos.bulk_write([UpdateOne({"_id": vid}, {"$set": {"title": t}, "$inc": {"downloads": n, "bytes": size}}, upsert=True)
+                                                for vid, (t, n, size) in videos.items()], ordered=False)
+
+    async def add_download_record(self, user_id, title, filepath, filesize, kind=None, video_id=None):
+        now = datetime.datetime.utcnow()
+        # created (a date) is what the TTL index expires on; created_at stays the ISO string
+        doc = {"user_id": user_id, "title": title, "filepath": filepath, "filesize": filesize,
+               "created_at": now.isoformat(), "created": now, "kind": kind, "video_id": video_id}
+        if self._writer is None:
+            await self.downloads.insert_one(doc)
+            await self._bump_stats([doc])
+            return
+        self._pending.append(doc)
+        if len(self._pending) >= self.bulk_size:
+            self._wake.set()
+
+    async def _bulk_writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.bulk_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                pass
+            if self._closing:
+                return
+
+    async def flush(self):
+        docs, self._pending = self._pending, []
+        if not docs:
+            return
+        try:
+            await self.downloads.insert_many(docs, ordered=False)
+        except Exception:
+            self._pending[:0] = docs
+            raise
+        self.bulk_writes += 1
+        # the records are in: a failure from here on must not re-queue them
+        await self._bump_stats(docs)
+
+    async def add_premium(self, user_id, days, plan="Gold"):
+        until = (datetime.datetime.utcnow() + datetime.timedelta(days=int(days))).isoformat()
+        await self.users.update_one({"user_id": user_id}, {"$set": {"premium_until": until, "plan": plan, "daily_count": 0, "last_reset": now_ts()}}, upsert=True)
+
+    async def remove_premium(self, user_id):
+        await self.users.update_one({"user_id": user_id}, {"$unset": {"premium_until": "", "plan": ""}})
+
+    async def user_info(self, user_id):
+        return await self.users.find_one({"user_id": user_id}, _USER_FIELDS) or {}
+
+    async def premium_info(self, user_id):
+        u = await self.user_info(user_id)
+        return u.get("premium_until"), u.get("plan")
+
+    async def can_download_free(self, user_id, free_limit):
+        ts = now_ts()
+        u = await self.users.find_one({"user_id": user_id}, _QUOTA_FIELDS) or {}
+        daily_count = u.get("daily_count", 0)
+        if ts - u.get("last_reset", 0) > 86400:
+            await self.users.update_one({"user_id": user_id}, {"$set": {"daily_count": 0, "last_reset": ts}}, upsert=True)
+            daily_count = 0
+        return daily_count < free_limit
+
+    async def increment_daily_count(self, user_id):
+        u = await self.users.find_one_and_update({"user_id": user_id}, {"$inc": {"daily_count": 1}, "$set": {"last_reset": now_ts()}},
+                                                 projection=_QUOTA_FIELDS, upsert=True, return_document=ReturnDocument.AFTER)
+        return u.get("daily_count", 0), u.get("last_reset", 0)
+
+    async def try_consume_quota(self, user_id, free_limit, n=1):
+        ts = now_ts()
+        if free_limit >= n:
+            # matches only if the window expired or n more still fit; the update
+            # pipeline then resets or adds in the same server-side operation
+            cond = {"user_id": user_id, "$or": [{"last_reset": {"$not": {"$gte": ts - 86400}}},
+                                                {"daily_count": {"$lte": free_limit - n}},
+                                                {"daily_count": {"$exists": False}}]}
+            expired = {"$gt": [{"$subtract": [ts, {"$ifNull": ["$last_reset", 0]}]}, 86400]}
+            update = [{"$set": {"daily_count": {"$cond": [expired, n, {"$add": [{"$ifNull": ["$daily_count", 0]}, n]}]},
+                                "last_reset": {"$cond": [expired, ts, "$last_reset"]}}}]
+            u = await self.users.find_one_and_update(cond, update, projection=_QUOTA_FIELDS, return_document=ReturnDocument.AFTER)
+            if u is None and await self.users.find_one({"user_id": user_id}, {"_id": 1}) is None:
+                # first download ever: create the user, then consume
+                try:
+                    await self.users.update_one({"user_id": user_id}, {"$setOnInsert": {"daily_count": 0, "last_reset": ts}}, upsert=True)
+                except DuplicateKeyError:
+                    pass    # a concurrent click created it first
+                u = await self.users.find_one_and_update(cond, update, projection=_QUOTA_FIELDS, return_document=ReturnDocument.AFTER)
+            if u is not None:
+                return True, u.get("daily_count", 0), u.get("last_reset", 0)
+        u = await self.users.find_one({"user_id": user_id}, _QUOTA_FIELDS) or {}
+        return False, u.get("daily_count", 0), u.get("last_reset", 0)
+
+    async def record_quota_batch(self, items):
+        if items:
+            await self.users.bulk_write([UpdateOne({"user_id": uid}, {"$set": {"daily_count": c, "last_reset": r}}, upsert=True)
+                                         for uid, c, r in items], ordered=False)
+
+    async def count_downloads(self):
+        # history expired by the TTL index still counts here
+        s = await self.stats_coll.find_one({"_id": "all"}, {"downloads": 1}) or {}
+        return s.get("downloads", 0) + len(self._pending)
+
+    async def stats(self, days=7, top=5):
+        await self.flush()
+        window = window_days(days)
+        buckets = {}
+        async for s in self.stats_coll.find({"$or": [{"_id": "all"}, {"_id": {"$gte": window[-1], "$lte": window[0]}}]}):
+            buckets[s["_id"]] = tuple(s.get(c, 0) for c in COUNTERS)
+        top_rows = [(v["_id"], v.get("title"), v.get("downloads", 0), v.get("bytes", 0))
+                    async for v in self.stats_videos.find({}).sort("downloads", DESCENDING).limit(top)]
+        premium = await self.users.count_documents({"premium_until": {"$gt": datetime.datetime.utcnow().isoformat()}})
+        return stats_result(buckets, window, top_rows, premium)
+
+    def _file_key(self, video_id, format_id, kind, rename):
+        return {"video_id": video_id, "format_id": format_id, "kind": kind, "rename": rename or ""}
+
+    async def get_cached_file(self, video_id, format_id, kind, rename=None):
+        q = self._file_key(video_id, format_id, kind, rename)
+        q["valid"] = True
+        return await self.file_cache.find_one(q, _FILE_FIELDS) or None
+
+    async def put_cached_file(self, video_id, format_id, kind, rename, file_id=None, chat_id=None, message_id=None, filesize=0):
+        await self.file_cache.update_one(self._file_key(video_id, format_id, kind, rename),
+                                         {"$set": {"file_id": file_id, "chat_id": chat_id, "message_id": message_id,
+                                                   "filesize": filesize, "valid": True, "created_at": now_ts()}}, upsert=True)
+
+    async def invalidate_cached_file(self, video_id, format_id, kind, rename=None):
+        await self.file_cache.update_one(self._file_key(video_id, format_id, kind, rename), {"$set": {"valid": False}})
+
+    async def close(self):
+        if self._writer is not None:
+            # no cancel: a bulk write in progress has its records off the buffer, so the
+            # writer finishes it (one last pass) before the rest is flushed and the client closes
+            self._closing = True
+            self._wake.set()
+            await self._writer
+            self._writer = None
+        await self.flush()
+        self.client.close()
@@ -0,0 +1,283 @@
+# storage/sqlite.py
+import sqlite3, threading, datetime
+from storage.base import Storage, now_ts, tally, window_days, stats_result
+
+_INSERT_DOWNLOAD = "INSERT INTO downloads (user_id,title,filepath,filesize,created_at,kind,video_id) VALUES (?,?,?,?,?,?,?)"
+_BUMP_STATS = """INSERT INTO stats (bucket,downloads,bytes,audio,video) VALUES (?,?,?,?,?)
+                 ON CONFLICT(bucket) DO UPDATE SET downloads=downloads+excluded.downloads, bytes=bytes+excluded.bytes,
+                                                   audio=audio+excluded.audio, video=video+excluded.video"""
+_BUMP_VIDEO = """INSERT INTO stats_videos (video_id,title,downloads,bytes) VALUES (?,?,?,?)
+                 ON CONFLICT(video_id) DO UPDATE SET title=excluded.title, downloads=downloads+excluded.downloads,
+                                                     bytes=bytes+excluded.bytes"""
+
+# WAL journal (readers never block the writer, one fsync per checkpoint rather
+# than per commit with synchronous=NORMAL), one connection per thread with a
+# statement cache (every query is a constant string, so each is prepared once
+# per connection), and group commit for download records: they are queued and
+# written by one thread as a single transaction every commit_interval seconds
+# or commit_batch rows. A crash can lose at most that window of history rows;
+# premium and quota writes still commit immediately.
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path, commit_interval=0.05, commit_batch=200):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.commit_batch = commit_batch
+        # one connection per thread instead of a single cursor shared by the
+        # event loop and every worker thread
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.group_commits = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS users (
+                        user_id INTEGER PRIMARY KEY,
+                        premium_until TEXT,
+                        plan TEXT,
+                        daily_count INTEGER DEFAULT 0,
+                        last_reset INTEGER DEFAULT 0
+                    )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS downloads (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        title TEXT,
+                        filepath TEXT,
+                        filesize INTEGER,
+                        created_at TEXT
+                    )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS file_cache (
+                        video_id TEXT,
+                        format_id TEXT,
+                        kind TEXT,
+                        rename TEXT DEFAULT '',
+                        file_id TEXT,
+                        chat_id INTEGER,
+                        message_id INTEGER,
+                        filesize INTEGER,
+                        valid INTEGER DEFAULT 1,
+                        created_at INTEGER,
+                        PRIMARY KEY (video_id, format_id, kind, rename)
+                    )""")
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(downloads)")}
+        for col in ("kind", "video_id"):
+            if col not in cols:
+                conn.execute(f"ALTER TABLE downloads ADD COLUMN {col} TEXT")
+        # materialized statistics (see storage.base.tally)
+        conn.execute("""CREATE TABLE IF NOT EXISTS stats (
+                        bucket TEXT PRIMARY KEY,
+                        downloads INTEGER DEFAULT 0,
+                        bytes INTEGER DEFAULT 0,
+                        audio INTEGER DEFAULT 0,
+                        video INTEGER DEFAULT 0
+                    )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS stats_videos (
+                        video_id TEXT PRIMARY KEY,
+                        title TEXT,
+                        downloads INTEGER DEFAULT 0,
+                        bytes INTEGER DEFAULT 0
+                    )""")
+        if conn.execute("SELECT 1 FROM stats WHERE bucket='all'").fetchone() is None:
+            # first start with counters: seed them from the existing history once
+            conn.execute("""INSERT INTO stats (bucket,downloads,bytes) SELECT substr(created_at,1,10), COUNT(*), COALESCE(SUM(filesize),0)
+                            FROM downloads GROUP BY 1""")
+            conn.execute("INSERT INTO stats (bucket,downloads,bytes) SELECT 'all', COUNT(*), COALESCE(SUM(filesize),0) FROM downloads")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_videos_downloads ON stats_videos (downloads)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_premium ON users (premium_until)")
+        # per-user history (newest first) and time-window stats
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_user_created ON downloads (user_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_created ON downloads (created_at)")
+        conn.commit()
+        self._writer = None
+        if commit_interval > 0:
+            self._writer = threading.Thread(target=self._group_commit, name="sqlite-commit", daemon=True)
+            self._writer.start()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=256)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-16000")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def add_download_record(self, user_id, title, filepath, filesize, kind=None, video_id=None):
+        row = (user_id, title, filepath, filesize, datetime.datetime.utcnow().isoformat(), kind, video_id)
+        if self._writer is None:
+            self._write_records([row])
+            return
+        with self._pending_lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.commit_batch
+        if full:
+            self._wake.set()
+
+    def _group_commit(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.commit_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            self._write_records(rows)
+        except Exception:
+            with self._pending_lock:
+                self._pending[:0] = rows
+            raise
+        self.group_commits += 1
+
+    # records and their counters in one transaction
+    def _write_records(self, rows):
+        buckets, videos = tally((r[1], r[3], r[4], r[5], r[6]) for r in rows)
+        conn = self._conn()
+        try:
+            conn.executemany(_INSERT_DOWNLOAD, rows)
+            conn.executemany(_BUMP_STATS, [(b, *v) for b, v in buckets.items()])
+            conn.executemany(_BUMP_VIDEO, [(vid, *v) for vid, v in videos.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def add_premium(self, user_id, days, plan="Gold"):
+        until = (datetime.datetime.utcnow() + datetime.timedelta(days=int(days))).isoformat()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO users (user_id,premium_until,plan,last_reset,daily_count) VALUES (?,?,?,?,?)",
+                     (user_id, until, plan, now_ts(), 0))
+        conn.commit()
+
+    def remove_premium(self, user_id):
+        conn = self._conn()
+        conn.execute("UPDATE users SET premium_until=NULL, plan=NULL WHERE user_id=?", (user_id,))
+        conn.commit()
+
+    def user_info(self, user_id):
+        r = self._conn().execute("SELECT premium_until,plan,daily_count,last_reset FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if not r:
+            return {}
+        return {"premium_until": r[0], "plan": r[1], "daily_count": r[2], "last_reset": r[3]}
+
+    def can_download_free(self, user_id, free_limit):
+        ts = now_ts()
+        conn = self._conn()
+        r = conn.execute("SELECT daily_count,last_reset FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if not r:
+            conn.execute("INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)", (user_id, 0, ts))
+            conn.commit()
+            return 0 < free_limit
+        daily_count, last_reset = r
+        if ts - last_reset > 86400:
+            conn.execute("UPDATE users SET daily_count=0,last_reset=? WHERE user_id=?", (ts, user_id))
+            conn.commit()
+            daily_count = 0
+        return daily_count < free_limit
+
+    def increment_daily_count(self, user_id):
+        ts = now_ts()
+        conn = self._conn()
+        r = conn.execute("SELECT daily_count,last_reset FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if not r:
+            state = (1, ts)
+            conn.execute("INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)", (user_id, 1, ts))
+        else:
+            daily_count, last_reset = r
+            if ts - last_reset > 86400:
+                state = (1, ts)
+                conn.execute("UPDATE users SET daily_count=1,last_reset=? WHERE user_id=?", (ts, user_id))
+            else:
+                state = (daily_count + 1, last_reset)
+                conn.execute("UPDATE users SET daily_count=daily_count+1 WHERE user_id=?", (user_id,))
+        conn.commit()
+        return state
+
+    def try_consume_quota(self, user_id, free_limit, n=1):
+        ts = now_ts()
+        conn = self._conn()
+        if free_limit >= n:
+            # one statement: start a new window, or add n while it stays within the limit
+            rows = conn.execute("""INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)
+                                    ON CONFLICT(user_id) DO UPDATE SET
+                                      daily_count = CASE WHEN ?-COALESCE(last_reset,0) > 86400 THEN excluded.daily_count
+                                                         ELSE COALESCE(daily_count,0)+excluded.daily_count END,
+                                      last_reset = CASE WHEN ?-COALESCE(last_reset,0) > 86400 THEN excluded.last_reset
+                                                        ELSE last_reset END
+                                    WHERE ?-COALESCE(last_reset,0) > 86400 OR COALESCE(daily_count,0)+? <= ?
+                                    RETURNING daily_count,last_reset""",
+                                (user_id, n, ts, ts, ts, ts, n, free_limit)).fetchall()
+            conn.commit()
+            if rows:
+                return True, rows[0][0], rows[0][1]
+        r = conn.execute("SELECT daily_count,last_reset FROM users WHERE user_id=?", (user_id,)).fetchone()
+        return False, (r[0] or 0) if r else 0, (r[1] or 0) if r else 0
+
+    def record_quota_batch(self, items):
+        conn = self._conn()
+        conn.executemany("""INSERT INTO users (user_id,daily_count,last_reset) VALUES (?,?,?)
+                            ON CONFLICT(user_id) DO UPDATE SET daily_count=excluded.daily_count, last_reset=excluded.last_reset""",
+                         items)
+        conn.commit()
+
+    def count_downloads(self):
+        self.flush()
+        r = self._conn().execute("SELECT downloads FROM stats WHERE bucket='all'").fetchone()
+        return r[0] if r else 0
+
+    def stats(self, days=7, top=5):
+        self.flush()
+        conn = self._conn()
+        window = window_days(days)
+        buckets = {r[0]: r[1:] for r in conn.execute("SELECT bucket,downloads,bytes,audio,video FROM stats WHERE bucket='all' OR bucket BETWEEN ? AND ?",
+                                                     (window[-1], window[0]))}
+        top_rows = conn.execute("SELECT video_id,title,downloads,bytes FROM stats_videos ORDER BY downloads DESC LIMIT ?", (top,)).fetchall()
+        premium = conn.execute("SELECT COUNT(*) FROM users WHERE premium_until > ?", (datetime.datetime.utcnow().isoformat(),)).fetchone()[0]
+        return stats_result(buckets, window, top_rows, premium)
+
+    def get_cached_file(self, video_id, format_id, kind, rename=None):
+        r = self._conn().execute("SELECT file_id,chat_id,message_id,filesize FROM file_cache WHERE video_id=? AND format_id=? AND kind=? AND rename=? AND valid=1",
+                                 (video_id, format_id, kind, rename or "")).fetchone()
+        if not r:
+            return None
+        return {"file_id": r[0], "chat_id": r[1], "message_id": r[2], "filesize": r[3]}
+
+    def put_cached_file(self, video_id, format_id, kind, rename, file_id=None, chat_id=None, message_id=None, filesize=0):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO file_cache (video_id,format_id,kind,rename,file_id,chat_id,message_id,filesize,valid,created_at) VALUES (?,?,?,?,?,?,?,?,1,?)",
+                     (video_id, format_id, kind, rename or "", file_id, chat_id, message_id, filesize, now_ts()))
+        conn.commit()
+
+    def invalidate_cached_file(self, video_id, format_id, kind, rename=None):
+        conn = self._conn()
+        conn.execute("UPDATE file_cache SET valid=0 WHERE video_id=? AND format_id=? AND kind=? AND rename=?",
+                     (video_id, format_id, kind, rename or ""))
+        conn.commit()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._writer is not None:
+            # a group commit in progress holds rows off the buffer: let it finish before
+            # the final flush and before its connection is closed
+            self._writer.join()
+        self.flush()
+        with self._conns_lock:
+            for conn in self._conns:
+                try: conn.close()
+                except Exception: pass
+            self._conns.clear()